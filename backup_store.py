@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+去重壓縮備份庫 (取代每次完整複製 bus_data.json)
+- 以行為界的內容定義分塊 (content-defined chunking)：未改動的部分只儲存一次
+- 每個分塊以 SHA256 命名並以 zlib 壓縮，存放於 backup/chunks/
+- backup/index.json 記錄每個版本包含的文件 (bus_data.json 及其 metadata) 與分塊列表
+- 還原時逐塊解壓並驗證 SHA256，原子性地取代目標文件，無需重新收集
+
+使用方式:
+  python3 backup_store.py list [--output-dir DIR]
+  python3 backup_store.py rollback VERSION_ID [--output-dir DIR]
+"""
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+# 分塊參數：平均約 2048 行 (縮排 JSON 約 64 KB) 一塊
+CHUNK_BOUNDARY_MASK = 0x7FF
+MIN_CHUNK_BYTES = 16 * 1024
+MAX_CHUNK_BYTES = 512 * 1024
+TOP_LEVEL_KEY_PREFIX = b'  "'
+
+DEFAULT_KEEP_VERSIONS = 7
+
+
+def iter_chunks(file_path: Path) -> Iterator[bytes]:
+    """
+    以行為界切分文件：某行的 CRC32 命中遮罩時在該行後切分
+    插入或刪除內容只會影響附近的分塊，其餘分塊的內容及雜湊保持不變
+    縮排 JSON 的每個頂層鍵從新分塊開始：每次收集都會改變的 version / generated_at 不會與數據共用分塊
+    """
+    buffer: List[bytes] = []
+    size = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if buffer and line.startswith(TOP_LEVEL_KEY_PREFIX):
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+            buffer.append(line)
+            size += len(line)
+            if size >= MAX_CHUNK_BYTES or (size >= MIN_CHUNK_BYTES and zlib.crc32(line) & CHUNK_BOUNDARY_MASK == 0):
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+class BackupStore:
+    """內容定址的分塊備份庫"""
+
+    def __init__(self, backup_dir: Path, keep_versions: int = DEFAULT_KEEP_VERSIONS):
+        self.backup_dir = Path(backup_dir)
+        self.chunks_dir = self.backup_dir / 'chunks'
+        self.index_file = self.backup_dir / 'index.json'
+        self.keep_versions = keep_versions
+        self.lock = threading.Lock()
+
+    # ---- index ----
+
+    def load_index(self) -> Dict[str, Any]:
+        if not self.index_file.exists():
+            return {'versions': []}
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_index(self, index: Dict[str, Any]):
+        tmp_file = self.index_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.index_file)
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        """由新至舊列出已保留的版本"""
+        return list(reversed(self.load_index()['versions']))
+
+    # ---- chunks ----
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.chunks_dir / digest[:2] / f"{digest}.z"
+
+    def _store_file(self, file_path: Path) -> Dict[str, Any]:
+        """分塊儲存一個文件，返回其記錄 (只寫入新的分塊)"""
+        file_hash = hashlib.sha256()
+        chunks = []
+        new_chunks = 0
+        stored_bytes = 0
+        size = 0
+
+        for chunk in iter_chunks(file_path):
+            digest = hashlib.sha256(chunk).hexdigest()
+            file_hash.update(chunk)
+            size += len(chunk)
+            chunks.append(digest)
+
+            path = self.chunk_path(digest)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                compressed = zlib.compress(chunk, 6)
+                tmp_path = path.with_suffix('.tmp')
+                tmp_path.write_bytes(compressed)
+                os.replace(tmp_path, path)
+                new_chunks += 1
+                stored_bytes += len(compressed)
+
+        return {
+            'sha256': file_hash.hexdigest(),
+            'size': size,
+            'chunks': chunks,
+            'new_chunks': new_chunks,
+            'stored_bytes': stored_bytes
+        }
+
+    # ---- public API ----
+
+    def backup(self, files: Dict[str, Path], label: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        備份一組文件 (名稱 -> 路徑，不存在的會被略過) 為一個新版本
+        若內容與最新版本完全相同則不建立新版本
+        """
+        with self.lock:
+            self.chunks_dir.mkdir(parents=True, exist_ok=True)
+            index = self.load_index()
+
+            records = {}
+            for name, path in files.items():
+                path = Path(path)
+                if path.exists():
+                    records[name] = self._store_file(path)
+            if not records:
+                return None
+
+            latest = index['versions'][-1] if index['versions'] else None
+            if latest and {n: r['sha256'] for n, r in latest['files'].items()} == \
+                    {n: r['sha256'] for n, r in records.items()}:
+                return None
+
+            version = {
+                'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
+                'created_at': datetime.now().isoformat(),
+                'label': label or {},
+                'files': {
+                    name: {'sha256': r['sha256'], 'size': r['size'], 'chunks': r['chunks']}
+                    for name, r in records.items()
+                }
+            }
+            # 同一秒內的多次備份
+            existing_ids = {v['id'] for v in index['versions']}
+            suffix = 1
+            base_id = version['id']
+            while version['id'] in existing_ids:
+                version['id'] = f"{base_id}_{suffix}"
+                suffix += 1
+
+            index['versions'].append(version)
+            removed = self._prune(index)
+            self.save_index(index)
+
+            version['stats'] = {
+                'new_chunks': sum(r['new_chunks'] for r in records.values()),
+                'total_chunks': sum(len(r['chunks']) for r in records.values()),
+                'stored_bytes': sum(r['stored_bytes'] for r in records.values()),
+                'original_bytes': sum(r['size'] for r in records.values()),
+                'removed_versions': removed
+            }
+            return version
+
+    def _prune(self, index: Dict[str, Any]) -> List[str]:
+        """只保留最新的 keep_versions 個版本，並刪除不再被引用的分塊"""
+        if len(index['versions']) <= self.keep_versions:
+            return []
+
+        removed = index['versions'][:-self.keep_versions]
+        index['versions'] = index['versions'][-self.keep_versions:]
+
+        referenced = {
+            digest
+            for version in index['versions']
+            for record in version['files'].values()
+            for digest in record['chunks']
+        }
+        for version in removed:
+            for record in version['files'].values():
+                for digest in record['chunks']:
+                    if digest not in referenced:
+                        path = self.chunk_path(digest)
+                        if path.exists():
+                            path.unlink()
+                        referenced.add(digest)  # 避免重複刪除
+        return [version['id'] for version in removed]
+
+    def find_version(self, version_id: str) -> Optional[Dict[str, Any]]:
+        """以版本 ID 或資料版本號 (label.version) 尋找版本；'latest' 為最新版本"""
+        versions = self.load_index()['versions']
+        if version_id == 'latest':
+            return versions[-1] if versions else None
+        for version in reversed(versions):
+            if version['id'] == version_id or str(version.get('label', {}).get('version')) == version_id:
+                return version
+        return None
+
+    def restore(self, version_id: str, target_dir: Path) -> Dict[str, str]:
+        """還原指定版本的所有文件到 target_dir (先寫臨時文件並驗證，再原子性取代)"""
+        version = self.find_version(version_id)
+        if version is None:
+            raise KeyError(f"Backup version not found: {version_id}")
+
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        # 先全部寫到臨時文件並驗證，全部成功後才取代，避免只還原一半
+        staged = {}
+        try:
+            for name, record in version['files'].items():
+                tmp_path = target_dir / f".{name}.restore.tmp"
+                file_hash = hashlib.sha256()
+                with open(tmp_path, 'wb') as f:
+                    for digest in record['chunks']:
+                        chunk = zlib.decompress(self.chunk_path(digest).read_bytes())
+                        if hashlib.sha256(chunk).hexdigest() != digest:
+                            raise ValueError(f"Corrupted chunk {digest} in {name}")
+                        file_hash.update(chunk)
+                        f.write(chunk)
+                if file_hash.hexdigest() != record['sha256']:
+                    raise ValueError(f"Checksum mismatch restoring {name}")
+                staged[name] = tmp_path
+
+            restored = {}
+            for name, tmp_path in staged.items():
+                final_path = target_dir / name
+                os.replace(tmp_path, final_path)
+                restored[name] = str(final_path)
+            return restored
+        finally:
+            for tmp_path in staged.values():
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+
+def rebuild_derived_artifacts(output_dir: Path):
+    """
+    還原後重建衍生產物 (bus_data.bin、transfer_graph.bin、圖塊等)，使其與還原的數據一致
+    輸入雜湊與 derived_artifacts.json 比較，只重建有改變的產物；失敗時刪除清單，下次收集必定重建
+    """
+    from derived_artifacts import MANIFEST_FILENAME, build_artifacts
+
+    data_file = output_dir / 'bus_data.json'
+    try:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            bus_data = json.load(f)
+        records = build_artifacts(bus_data, data_file)
+    except Exception as e:
+        records = {'bus_data.json': {'error': f"{type(e).__name__}: {e}"}}
+
+    failed = [name for name, record in records.items() if 'error' in record]
+    if failed:
+        manifest_file = output_dir / MANIFEST_FILENAME
+        if manifest_file.exists():
+            manifest_file.unlink()
+        print(f"⚠️  Derived artifacts not rebuilt ({', '.join(failed)}); {MANIFEST_FILENAME} removed, "
+              f"the next collection rebuilds them")
+        return False
+    print(f"🧩 Derived artifacts match the restored data ({', '.join(records)})")
+    return True
+
+
+def main():
+    # .env 的 OUTPUT_DIRECTORY 作為 --output-dir 的預設值 (NAS 上只在 .env 設定)
+    from collect_bus_data_optimized_concurrent import RunLock, load_environment
+    load_environment()
+
+    parser = argparse.ArgumentParser(description='Deduplicated bus data backup store')
+    parser.add_argument('--output-dir', default=os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR)),
+                        help='Directory containing bus_data.json (default: OUTPUT_DIRECTORY)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='List retained backup versions')
+    rollback_parser = subparsers.add_parser('rollback', help='Restore a backup version and its metadata')
+    rollback_parser.add_argument('version', help="Version ID, data version number, or 'latest'")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    store = BackupStore(output_dir / 'backup')
+
+    if args.command == 'list':
+        versions = store.list_versions()
+        if not versions:
+            print(f"ℹ️  No backups found in {store.backup_dir}")
+            return
+        print(f"{'id':<20} {'data version':>12} {'generated_at':<28} files")
+        for version in versions:
+            label = version.get('label', {})
+            files = ', '.join(f"{name} ({record['size']:,} B)" for name, record in version['files'].items())
+            print(f"{version['id']:<20} {str(label.get('version', '-')):>12} {str(label.get('generated_at', '-')):<28} {files}")
+        return
+
+    logging.basicConfig(level=logging.INFO, format='   %(message)s')
+
+    # 與收集共用同一個鎖，避免還原時收集正在寫入 bus_data.json
+    run_lock = RunLock(os.getenv('COLLECTOR_LOCK_FILE') or str(output_dir / '.collector.lock'))
+    if not run_lock.acquire(blocking=False):
+        print(f"⏳ A collection is running (pid {run_lock.holder_pid()}), waiting for it to finish...")
+        run_lock.acquire()
+
+    try:
+        try:
+            restored = store.restore(args.version, output_dir)
+        except (KeyError, ValueError, OSError) as e:
+            print(f"❌ Rollback failed: {e}")
+            sys.exit(1)
+
+        for name, path in restored.items():
+            print(f"✅ Restored {name}: {path}")
+
+        if 'bus_data.json' in restored:
+            rebuild_derived_artifacts(output_dir)
+    finally:
+        run_lock.release()
+
+if __name__ == '__main__':
+    main()
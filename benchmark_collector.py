@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+離線基準測試：本地模擬 KMB / CTB API 伺服器
+- 模擬 data.etabus.gov.hk (KMB) 及 rt.data.gov.hk (CTB) 使用到的 endpoints (包括 ETA，供 eta_service.py 測試)
+- 可設定延遲分佈、錯誤率及限流 (超過並行上限返回 429)
+- 以不同 worker 數量及 HTTP 傳輸方式執行完整收集流程，報告耗時、API 調用次數及記憶體
+
+使用方式:
+  python3 benchmark_collector.py
+  python3 benchmark_collector.py --workers 5,10,20 --transports session,plain
+  python3 benchmark_collector.py --latency lognormal:0.08:0.5 --error-rate 0.01 --throttle 40
+  python3 benchmark_collector.py --log-modes off,sync,queue --workers 20 --log-disk-latency 2   # 日誌開銷 (off = 不設定日誌)
+  python3 benchmark_collector.py --serve   # 只啟動模擬伺服器 (手動測試用)
+
+延遲分佈格式:
+  fixed:SECONDS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Any
+
+from synthetic_bus_network import generate_network, NetworkResponder
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+
+class LatencyModel:
+    """延遲分佈 (fixed / uniform / lognormal)"""
+
+    def __init__(self, spec: str = 'fixed:0'):
+        parts = spec.split(':')
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        if self.kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.rng = random.Random()
+        self.lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self.lock:
+            if self.kind == 'fixed':
+                return self.params[0] if self.params else 0.0
+            if self.kind == 'uniform':
+                return self.rng.uniform(self.params[0], self.params[1])
+            median, sigma = self.params
+            return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class MockAPIBehaviour:
+    """模擬伺服器的延遲、錯誤率及限流設定與計數"""
+
+    def __init__(self, latency: str = 'fixed:0', error_rate: float = 0.0, throttle: int = 0, seed: int = 0):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {'requests': 0, 'errors_injected': 0, 'throttled': 0, 'not_found': 0}
+
+    def count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def enter(self) -> bool:
+        """返回 False 表示超過並行上限 (需返回 429)"""
+        with self.lock:
+            self.counters['requests'] += 1
+            if self.throttle and self.in_flight >= self.throttle:
+                self.counters['throttled'] += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+class MockBusAPIServer:
+    """
+    本地模擬 API 伺服器 (KMB 與 CTB 各自一個端口，模擬兩個不同主機)
+    - KMB: /v1/transport/kmb/{stop,route,route-stop}
+    - CTB: /v2/transport/citybus/{route/CTB, route-stop/CTB/{route}/{dir}, stop/{id}}
+    - ETA: kmb/stop-eta/{stop}, kmb/eta/{stop}/{route}/{service_type}, citybus/eta/CTB/{stop}/{route}
+    """
+
+    def __init__(self, responder: NetworkResponder, behaviour: MockAPIBehaviour, host: str = '127.0.0.1'):
+        self.responder = responder
+        self.behaviour = behaviour
+        self.host = host
+
+        self.kmb_server = ThreadingHTTPServer((host, 0), self._handler())
+        self.ctb_server = ThreadingHTTPServer((host, 0), self._handler())
+        self.kmb_server.daemon_threads = True
+        self.ctb_server.daemon_threads = True
+        self.threads: List[threading.Thread] = []
+
+    @property
+    def kmb_base(self) -> str:
+        return f"http://{self.host}:{self.kmb_server.server_address[1]}/v1/transport/kmb"
+
+    @property
+    def ctb_base(self) -> str:
+        return f"http://{self.host}:{self.ctb_server.server_address[1]}/v2/transport/citybus"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive，讓 session 傳輸可重用連線
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass  # 客戶端中途斷線 (例如被測進程結束)
+
+            def do_GET(self):
+                behaviour = server.behaviour
+                if not behaviour.enter():
+                    self._send(429, b'{"error": "Too Many Requests"}')
+                    return
+                try:
+                    time.sleep(behaviour.latency.sample())
+                    if behaviour.should_fail():
+                        behaviour.count('errors_injected')
+                        self._send(500, b'{"error": "Injected failure"}')
+                        return
+
+                    body = server.responder.resolve(self.path)
+                    if body is None:
+                        behaviour.count('not_found')
+                        self._send(404, b'{"error": "Not Found"}')
+                        return
+                    self._send(200, body)
+                finally:
+                    behaviour.leave()
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        for httpd in (self.kmb_server, self.ctb_server):
+            thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for httpd in (self.kmb_server, self.ctb_server):
+            httpd.shutdown()
+            httpd.server_close()
+
+
+def run_pipeline_once(output_dir: str) -> Dict[str, Any]:
+    """
+    在當前進程執行完整收集流程 (由子進程調用，確保每次量度的 RSS 獨立)
+    與 cron 執行相同的 run_collection_pipeline (包括衍生產物)，只是不上傳；輸出寫入 output_dir
+    API 位置、worker 數量、傳輸方式及日誌模式 (LOG_MODE，off = 不設定日誌) 由環境變數決定
+    """
+    import logging
+    import resource
+    import collect_bus_data_optimized_concurrent as collector_module
+    from structured_logging import shutdown_logging
+
+    os.environ['OUTPUT_DIRECTORY'] = output_dir
+    log_mode = os.getenv('LOG_MODE', 'off')
+    disk_latency = float(os.getenv('BENCH_LOG_DISK_LATENCY_MS', '0')) / 1000
+    if disk_latency > 0:
+        # 模擬 NAS 的慢速磁碟：每次日誌檔案 flush 額外等待
+        original_flush = logging.FileHandler.flush
+
+        def slow_flush(handler):
+            original_flush(handler)
+            time.sleep(disk_latency)
+        logging.FileHandler.flush = slow_flush
+    logger = logging.getLogger()
+    if log_mode != 'off':
+        os.environ['LOG_DIRECTORY'] = str(Path(output_dir) / 'logs')
+        Path(os.environ['LOG_DIRECTORY']).mkdir(exist_ok=True)
+        logger = collector_module.setup_logging()
+    start_time = time.time()
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+
+    collector = collector_module.OptimizedConcurrentBusDataCollector()
+    metrics = collector.metrics
+    exit_code, _ = collector_module.run_collection_pipeline(collector, metrics, logger, upload_enabled=False)
+
+    wall_time = time.time() - start_time
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+    snapshot = metrics.snapshot()
+
+    # 清空日誌隊列後統計寫出的記錄 (queue 模式的寫入發生在背景線程，流程結束時仍未寫出的部分計入 drain)
+    drain_start = time.time()
+    shutdown_logging()
+    drain_seconds = time.time() - drain_start
+    log_records = 0
+    if log_mode != 'off':
+        for json_file in Path(os.environ['LOG_DIRECTORY']).glob('*.jsonl'):
+            with open(json_file, 'rb') as f:
+                log_records += sum(1 for _ in f)
+
+    return {
+        'wall_seconds': round(wall_time, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'log_records': log_records,
+        'log_drain_seconds': round(drain_seconds, 3),
+        'exit_code': exit_code,
+        'validation_passed': exit_code == 0,
+        'api_calls': collector.stats['api_calls_made'],
+        'failed_calls': collector.stats['failed_calls'],
+        'retries': snapshot['totals']['retries'],
+        'bytes_received': snapshot['totals']['bytes_received'],
+        'routes': len(collector.bus_data['routes']),
+        'stops': len(collector.bus_data['stops']),
+        'stage_seconds': snapshot['stage_seconds'],
+        'peak_rss_bytes': collector_module.peak_rss_bytes()
+    }
+
+
+def run_config(server: MockBusAPIServer, workers: int, transport: str, per_host: int,
+               log_mode: str = 'off', log_disk_latency_ms: float = 0.0) -> Dict[str, Any]:
+    """在子進程中以指定設定執行一次流程"""
+    env = dict(os.environ)
+    env.update({
+        'KMB_API_BASE': server.kmb_base,
+        'CTB_API_BASE': server.ctb_base,
+        'BUS_OPERATORS': 'KMB,CTB',
+        'ROUTE_WORKERS': str(workers),
+        'MAX_REQUESTS_PER_HOST': str(per_host),
+        'HTTP_TRANSPORT': transport,
+        'PROFILE_STAGES': '',
+        'LOG_MODE': log_mode,
+        'BENCH_LOG_DISK_LATENCY_MS': str(log_disk_latency_ms),
+    })
+
+    with tempfile.TemporaryDirectory(prefix='hkbus_bench_') as output_dir:
+        process = subprocess.run(
+            [sys.executable, str(Path(__file__).absolute()), '--run-one', output_dir],
+            env=env, cwd=str(SCRIPT_DIR), capture_output=True, text=True
+        )
+
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed (workers={workers}, transport={transport}, log={log_mode}):\n{process.stderr[-2000:]}")
+
+    # 最後一行為 JSON 結果 (之前的輸出為收集器的進度訊息)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result.update({'workers': workers, 'transport': transport, 'max_requests_per_host': per_host, 'log_mode': log_mode})
+    return result
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print()
+    print(f"{'workers':>7} {'transport':>9} {'per-host':>8} {'log':>5} {'wall (s)':>9} {'CPU (s)':>8} {'records':>7} {'drain':>6} "
+          f"{'calls':>7} {'failed':>6} {'retries':>7} {'MB recv':>8} {'peak RSS (MB)':>13} {'valid':>5}")
+    print("-" * 120)
+    for r in results:
+        print(f"{r['workers']:>7} {r['transport']:>9} {r['max_requests_per_host']:>8} {r['log_mode']:>5} "
+              f"{r['wall_seconds']:>9.2f} {r['cpu_seconds']:>8.2f} {r['log_records']:>7} {r['log_drain_seconds']:>6.2f} "
+              f"{r['api_calls']:>7} {r['failed_calls']:>6} {r['retries']:>7} "
+              f"{r['bytes_received'] / 1024 / 1024:>8.1f} {r['peak_rss_bytes'] / 1024 / 1024:>13.1f} "
+              f"{'yes' if r['validation_passed'] else 'no':>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark for the bus data collector')
+    parser.add_argument('--workers', default='5,10,20', help='Comma separated per-route worker counts')
+    parser.add_argument('--transports', default='session,plain', help='Comma separated HTTP transports (session, plain)')
+    parser.add_argument('--per-host', type=int, default=20, help='MAX_REQUESTS_PER_HOST for every run')
+    parser.add_argument('--log-modes', default='off',
+                        help='Comma separated logging modes (off, sync, queue) to measure logging overhead')
+    parser.add_argument('--log-disk-latency', type=float, default=0.0,
+                        help='Extra milliseconds per log file flush, simulating a slow NAS disk')
+    parser.add_argument('--latency', default='lognormal:0.05:0.4', help='Latency distribution (see module docstring)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--throttle', type=int, default=0, help='Max concurrent requests per server before HTTP 429 (0 = off)')
+    parser.add_argument('--seed', type=int, default=42, help='Dataset random seed')
+    parser.add_argument('--scale', type=float, default=1.0, help='Dataset size as a multiple of the current network')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--serve', action='store_true', help='Only run the mock server until interrupted')
+    parser.add_argument('--eta-speedup', type=float, default=1.0,
+                        help='Divide synthetic ETA headways by this factor (ETAs change more often)')
+    parser.add_argument('--run-one', metavar='OUTPUT_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_pipeline_once(args.run_one)
+        print(json.dumps(result))
+        return
+
+    print("=" * 70)
+    print("🏁 HK Bus Collector - Offline Benchmark")
+    print("=" * 70)
+
+    dataset_start = time.time()
+    network = generate_network(scale=args.scale, seed=args.seed)
+    responder = NetworkResponder(network, eta_speedup=args.eta_speedup)
+    print(f"🧪 Mock dataset built in {time.time() - dataset_start:.2f}s: "
+          f"{len(network['kmb_routes'])} KMB route variants, {len(network['ctb_routes'])} CTB routes, "
+          f"{len(network['kmb_stops']) + len(network['ctb_stops'])} stops")
+
+    behaviour = MockAPIBehaviour(args.latency, args.error_rate, args.throttle, args.seed)
+    server = MockBusAPIServer(responder, behaviour)
+    server.start()
+    print(f"🌐 Mock KMB API: {server.kmb_base}")
+    print(f"🌐 Mock CTB API: {server.ctb_base}")
+    print(f"   Latency: {args.latency}, error rate: {args.error_rate}, throttle: {args.throttle or 'off'}")
+
+    if args.serve:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    results = []
+    try:
+        for transport in [t.strip() for t in args.transports.split(',') if t.strip()]:
+            for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+                for log_mode in [m.strip() for m in args.log_modes.split(',') if m.strip()]:
+                    print(f"\n▶️  workers={workers} transport={transport} per-host={args.per_host} log={log_mode}")
+                    result = run_config(server, workers, transport, args.per_host, log_mode, args.log_disk_latency)
+                    print(f"   ✅ {result['wall_seconds']:.2f}s ({result['cpu_seconds']:.2f}s CPU), "
+                          f"{result['api_calls']} calls, peak RSS {result['peak_rss_bytes'] / 1024 / 1024:.1f} MB")
+                    results.append(result)
+    finally:
+        server.stop()
+
+    print_report(results)
+    print(f"\n📡 Server counters: {behaviour.counters}")
+
+    if args.output:
+        report = {
+            'generated_at': datetime.now().isoformat(),
+            'settings': {
+                'latency': args.latency,
+                'error_rate': args.error_rate,
+                'throttle': args.throttle,
+                'per_host': args.per_host,
+                'log_modes': args.log_modes,
+                'log_disk_latency_ms': args.log_disk_latency,
+                'seed': args.seed,
+                'scale': args.scale
+            },
+            'server_counters': behaviour.counters,
+            'results': results
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📄 Results saved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
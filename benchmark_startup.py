@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+啟動時間基準測試
+- 每個情境以新的 Python 進程執行多次，報告中位數及最小耗時
+- 情境：空白解釋器、匯入收集器模組、--help、validate / metadata / diff 子命令 (小型測試數據)
+- 以 python -X importtime 分解匯入收集器模組的成本，並列出各重依賴 (requests、firebase_admin、dotenv) 單獨匯入的耗時
+- 檢查匯入模組後是否已載入重依賴 (延遲匯入是否有效)
+
+使用方式:
+  python3 benchmark_startup.py
+  python3 benchmark_startup.py --repeat 10 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+COLLECTOR = str(SCRIPT_DIR / 'collect_bus_data_optimized_concurrent.py')
+
+HEAVY_DEPENDENCIES = ['requests', 'firebase_admin', 'dotenv']
+
+
+def write_fixture(output_dir: Path) -> Path:
+    """小型 bus_data.json (子命令的啟動成本不被數據處理掩蓋)"""
+    data = {
+        'version': 1,
+        'generated_at': '2026-01-01T03:00:00',
+        'routes': {
+            'KMB_1_O': {'route_number': '1', 'company': 'KMB', 'direction': 'outbound',
+                        'origin_tc': '竹園邨', 'origin_en': 'CHUK YUEN ESTATE',
+                        'dest_tc': '尖沙咀碼頭', 'dest_en': 'STAR FERRY', 'service_type': '1'}
+        },
+        'stops': {
+            'A': {'name_tc': '甲', 'name_en': 'A', 'latitude': 22.34, 'longitude': 114.19, 'company': 'KMB'},
+            'B': {'name_tc': '乙', 'name_en': 'B', 'latitude': 22.29, 'longitude': 114.17, 'company': 'KMB'}
+        },
+        'route_stops': {'KMB_1_O': [{'stop_id': 'A', 'sequence': 1}, {'stop_id': 'B', 'sequence': 2}]},
+        'stop_routes': {},
+        'summary': {'total_routes': 1, 'total_stops': 2}
+    }
+    data_file = output_dir / 'bus_data.json'
+    data_file.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    return data_file
+
+
+def time_command(command: List[str], env: Dict[str, str], repeat: int) -> Dict[str, Any]:
+    """執行命令多次，返回耗時統計 (秒)"""
+    timings = []
+    exit_code = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = subprocess.run(command, env=env, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time)
+        exit_code = result.returncode
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'exit_code': exit_code
+    }
+
+
+def import_breakdown(module: str, env: Dict[str, str], top_n: int = 10) -> Dict[str, Any]:
+    """python -X importtime：匯入模組的總成本及最昂貴的直接依賴 (累計微秒)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            env=env, cwd=SCRIPT_DIR, capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # "import time:  self [us] | cumulative | <縮排表示深度>module"
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        entries.append({'module': name.strip(), 'depth': depth, 'self_us': int(self_us),
+                        'cumulative_us': int(cumulative_us)})
+
+    # 子模組列在父模組之前：從模組本身向前找，直到上一個頂層匯入 (例如 site)
+    module_index = max((i for i, e in enumerate(entries) if e['module'] == module and e['depth'] == 0), default=None)
+    if result.returncode != 0 or module_index is None:
+        return {'available': False, 'error': (result.stderr.strip().splitlines() or ['import failed'])[-1]}
+    direct = []
+    for entry in reversed(entries[:module_index]):
+        if entry['depth'] == 0:
+            break
+        if entry['depth'] == 1:
+            direct.append(entry)
+    total = entries[module_index]['cumulative_us']
+    top_level = sorted(direct, key=lambda e: e['cumulative_us'], reverse=True)
+    return {
+        'available': True,
+        'total_us': total,
+        'top_imports': [{'module': e['module'], 'cumulative_us': e['cumulative_us']} for e in top_level[:top_n]]
+    }
+
+
+def loaded_heavy_dependencies(module: str, env: Dict[str, str]) -> Optional[List[str]]:
+    """匯入模組後 sys.modules 中已載入的重依賴"""
+    code = (f"import sys, {module}; "
+            f"print(','.join(n for n in {HEAVY_DEPENDENCIES!r} if n in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=SCRIPT_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return [name for name in result.stdout.strip().split(',') if name]
+
+
+def print_report(results: Dict[str, Any]):
+    print()
+    print(f"{'scenario':<28} {'median (ms)':>11} {'min (ms)':>9} {'max (ms)':>9} {'exit':>5}")
+    print("-" * 66)
+    for name, timing in results['scenarios'].items():
+        print(f"{name:<28} {timing['median'] * 1000:>11.1f} {timing['min'] * 1000:>9.1f} "
+              f"{timing['max'] * 1000:>9.1f} {timing['exit_code']:>5}")
+
+    breakdown = results['import_breakdown']
+    if breakdown.get('available'):
+        print(f"\n📦 Import cost of collector module: {breakdown['total_us'] / 1000:.1f} ms")
+        for entry in breakdown['top_imports']:
+            print(f"   {entry['module']:<40} {entry['cumulative_us'] / 1000:>8.1f} ms")
+
+    print("\n🏋️  Heavy dependencies (import on their own):")
+    for name, cost in results['dependency_costs'].items():
+        print(f"   {name:<20} {'not installed' if cost is None else f'{cost / 1000:.1f} ms':>14}")
+
+    loaded = results['loaded_after_import']
+    if loaded is None:
+        print("\n⚠️  Could not import the collector module")
+    elif loaded:
+        print(f"\n⚠️  Loaded at import time: {', '.join(loaded)}")
+    else:
+        print("\n✅ No heavy dependency is loaded at import time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark for the bus data collector CLI')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario (default: 5)')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("⏱️  HK Bus Collector - Startup Benchmark")
+    print("=" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        data_file = write_fixture(tmp_path)
+
+        env = dict(os.environ)
+        env.update({'OUTPUT_DIRECTORY': tmp_dir, 'LOG_DIRECTORY': str(tmp_path / 'logs'), 'PYTHONDONTWRITEBYTECODE': '1'})
+
+        scenarios = {
+            'python (empty)': [sys.executable, '-c', 'pass'],
+            'import collector': [sys.executable, '-c', 'import collect_bus_data_optimized_concurrent'],
+            '--help': [sys.executable, COLLECTOR, '--help'],
+            'validate': [sys.executable, COLLECTOR, 'validate', str(data_file)],
+            'metadata': [sys.executable, COLLECTOR, 'metadata', str(data_file)],
+            'diff': [sys.executable, COLLECTOR, 'diff', str(data_file), str(data_file)],
+        }
+
+        results = {'python': sys.version.split()[0], 'repeat': args.repeat, 'scenarios': {}}
+        for name, command in scenarios.items():
+            print(f"▶️  {name}")
+            results['scenarios'][name] = time_command(command, env, args.repeat)
+
+        results['import_breakdown'] = import_breakdown('collect_bus_data_optimized_concurrent', env)
+        results['dependency_costs'] = {}
+        for name in HEAVY_DEPENDENCIES:
+            breakdown = import_breakdown(name, env)
+            results['dependency_costs'][name] = breakdown['total_us'] if breakdown.get('available') else None
+        results['loaded_after_import'] = loaded_heavy_dependencies('collect_bus_data_optimized_concurrent', env)
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+bus_data.json 的二進制索引伴隨檔案 (bus_data.bin) 及 mmap 讀取器
+- 與 bus_data.json 同時寫入；記錄來源 JSON 的 SHA256，讀取前可確認兩者一致
+- 四個分區 (routes / route_stops / stops / stop_routes)，每個分區是按鍵排序的索引表 + 記錄數據
+- 每筆記錄是一段獨立的緊湊 JSON，只在查詢時解碼；鍵以二分搜尋直接在 mmap 上比較
+- BusDataReader 不把整份數據載入記憶體，解碼結果以 LRU 快取 (單次查詢約數微秒)
+
+檔案格式 (全部小端):
+  header   : magic 'HKBD', 格式版本, 分區數, 數據版本, 來源 SHA256, meta 位置/長度, 各分區位置
+  meta     : {"version", "generated_at", "summary"} 的 JSON
+  分區     : uint32 記錄數 + 索引表 [key 位置 u64, key 長度 u16, value 位置 u64, value 長度 u32] + 鍵及值數據
+
+使用方式:
+  python3 bus_data_reader.py build                 # 由 OUTPUT_DIRECTORY/bus_data.json 建立 bus_data.bin
+  python3 bus_data_reader.py get route KMB_1A_O    # 查詢單一記錄 (route / route_stops / stop / stop_routes)
+  python3 bus_data_reader.py bench                 # 與 json.load 比較耗時及記憶體
+
+讀取 API:
+  with BusDataReader('output/bus_data.bin') as reader:
+      reader.route('KMB_1A_O'); reader.stop_routes('A60AE774B09A5E44'); reader.summary
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import random
+import struct
+import argparse
+import functools
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+COMPANION_FILENAME = 'bus_data.bin'
+COMPANION_MAGIC = b'HKBD'
+COMPANION_FORMAT_VERSION = 1
+SECTIONS = ('routes', 'route_stops', 'stops', 'stop_routes')
+DEFAULT_CACHE_SIZE = 4096
+
+# derived_artifacts 的快取輸入：記錄整個 bus_data.json 的 SHA256，任何改變都需要重建
+ARTIFACT_INPUTS = None
+
+HEADER = struct.Struct('<4sHHq32sQI' + 'Q' * len(SECTIONS))
+ENTRY = struct.Struct('<QHQI')
+COUNT = struct.Struct('<I')
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_companion(bus_data: Dict[str, Any], output_file: Path, source_sha256: str) -> int:
+    """寫入 bus_data.bin (先寫暫存檔再原子替換)，返回檔案大小"""
+    output_file = Path(output_file)
+    meta = _encode({
+        'version': bus_data.get('version'),
+        'generated_at': bus_data.get('generated_at'),
+        'summary': bus_data.get('summary', {})
+    })
+
+    # 預先計算每個分區的位置：header → meta → 各分區 (索引表、鍵、值)
+    encoded_sections = []
+    offset = HEADER.size + len(meta)
+    section_offsets = []
+    for name in SECTIONS:
+        items = sorted((key.encode('utf-8'), _encode(value)) for key, value in bus_data.get(name, {}).items())
+        section_offsets.append(offset)
+        table_size = COUNT.size + ENTRY.size * len(items)
+        data_offset = offset + table_size
+        entries = []
+        for key, value in items:
+            entries.append(ENTRY.pack(data_offset, len(key), data_offset + len(key), len(value)))
+            data_offset += len(key) + len(value)
+        encoded_sections.append((items, entries))
+        offset = data_offset
+
+    tmp_file = output_file.with_suffix(output_file.suffix + '.tmp')
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(COMPANION_MAGIC, COMPANION_FORMAT_VERSION, len(SECTIONS),
+                            int(bus_data.get('version') or 0), bytes.fromhex(source_sha256),
+                            HEADER.size, len(meta), *section_offsets))
+        f.write(meta)
+        for items, entries in encoded_sections:
+            f.write(COUNT.pack(len(items)))
+            f.write(b''.join(entries))
+            for key, value in items:
+                f.write(key)
+                f.write(value)
+    os.replace(tmp_file, output_file)
+    return output_file.stat().st_size
+
+
+def build_and_write(bus_data: Dict[str, Any], output_dir: Path) -> Tuple[str, Dict[str, Any]]:
+    """收集流程的後處理階段：為已保存的 bus_data.json 建立 bus_data.bin，返回 (路徑, 統計)"""
+    from storage_backends import file_sha256
+
+    start_time = time.time()
+    output_dir = Path(output_dir)
+    output_file = output_dir / COMPANION_FILENAME
+    size = write_companion(bus_data, output_file, file_sha256(output_dir / 'bus_data.json'))
+    return str(output_file), {
+        'records': {name: len(bus_data.get(name, {})) for name in SECTIONS},
+        'file_size_bytes': size,
+        'build_seconds': round(time.time() - start_time, 3)
+    }
+
+
+class BusDataReader:
+    """
+    mmap bus_data.bin，按需解碼單一路線 / 站點 / 路線站點 / 站點路線列表
+    返回的物件來自 LRU 快取，呼叫者不應修改
+    """
+
+    def __init__(self, path: Path, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Empty companion file: {self.path}")
+
+        try:
+            magic, version, sections, data_version, sha256, meta_offset, meta_length, *offsets = \
+                HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f"Truncated companion file: {self.path}")
+        if magic != COMPANION_MAGIC or version != COMPANION_FORMAT_VERSION or sections != len(SECTIONS):
+            self.close()
+            raise ValueError(f"Not a bus data companion file (format {COMPANION_FORMAT_VERSION}): {self.path}")
+
+        self.data_version = data_version
+        self.source_sha256 = sha256.hex()
+        self.meta: Dict[str, Any] = json.loads(self._mm[meta_offset:meta_offset + meta_length])
+        self._sections = {}
+        for name, offset in zip(SECTIONS, offsets):
+            (count,) = COUNT.unpack_from(self._mm, offset)
+            self._sections[name] = (offset + COUNT.size, count)
+
+        self._decode = functools.lru_cache(maxsize=cache_size)(self._decode_uncached)
+
+    def __enter__(self) -> 'BusDataReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None and not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+    @property
+    def version(self) -> Optional[int]:
+        return self.meta.get('version')
+
+    @property
+    def generated_at(self) -> Optional[str]:
+        return self.meta.get('generated_at')
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return self.meta.get('summary', {})
+
+    def counts(self) -> Dict[str, int]:
+        return {name: count for name, (_, count) in self._sections.items()}
+
+    def _find(self, section: str, key: bytes) -> Optional[int]:
+        """在排序的索引表上二分搜尋，返回 entry index"""
+        table, count = self._sections[section]
+        mm = self._mm
+        low, high = 0, count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            key_offset, key_length, _, _ = ENTRY.unpack_from(mm, table + middle * ENTRY.size)
+            candidate = mm[key_offset:key_offset + key_length]
+            if candidate == key:
+                return middle
+            if candidate < key:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def _decode_uncached(self, section: str, key: str) -> Any:
+        index = self._find(section, key.encode('utf-8'))
+        if index is None:
+            return None
+        table, _ = self._sections[section]
+        _, _, value_offset, value_length = ENTRY.unpack_from(self._mm, table + index * ENTRY.size)
+        return json.loads(self._mm[value_offset:value_offset + value_length])
+
+    def route(self, route_id: str) -> Optional[Dict[str, Any]]:
+        return self._decode('routes', route_id)
+
+    def route_stops(self, route_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self._decode('route_stops', route_id)
+
+    def stop(self, stop_id: str) -> Optional[Dict[str, Any]]:
+        return self._decode('stops', stop_id)
+
+    def stop_routes(self, stop_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self._decode('stop_routes', stop_id)
+
+    def keys(self, section: str) -> Iterator[str]:
+        """按排序逐個解碼某分區的鍵 (不解碼值)"""
+        table, count = self._sections[section]
+        for index in range(count):
+            key_offset, key_length, _, _ = ENTRY.unpack_from(self._mm, table + index * ENTRY.size)
+            yield self._mm[key_offset:key_offset + key_length].decode('utf-8')
+
+    def cache_info(self):
+        return self._decode.cache_info()
+
+
+def load_bus_data_header(data_file: Path, sha256_checksum: Optional[str] = None) -> Dict[str, Any]:
+    """
+    bus_data.json 的 version / generated_at / summary
+    伴隨檔案存在且 SHA256 相符時從 bus_data.bin 讀取 (不解析整份 JSON)，否則退回 json.load
+    """
+    data_file = Path(data_file)
+    companion = data_file.parent / COMPANION_FILENAME
+    if companion.exists():
+        try:
+            with BusDataReader(companion, cache_size=0) as reader:
+                if sha256_checksum is None:
+                    from storage_backends import file_sha256
+                    sha256_checksum = file_sha256(data_file)
+                if reader.source_sha256 == sha256_checksum:
+                    return dict(reader.meta)
+        except (OSError, ValueError):
+            pass
+
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {'version': data.get('version'), 'generated_at': data.get('generated_at'), 'summary': data.get('summary', {})}
+
+
+def summary_companies(summary: Dict[str, Any]) -> List[str]:
+    """summary 中有路線的營運商 (由 <company>_routes 欄位得出；KMB、CTB 在前，其餘按字母排序)"""
+    companies = [key[:-len('_routes')].upper() for key, count in summary.items()
+                 if key.endswith('_routes') and key != 'total_routes' and isinstance(count, int) and count > 0]
+    preferred = [company for company in ('KMB', 'CTB') if company in companies]
+    return preferred + sorted(company for company in companies if company not in preferred)
+
+
+def run_bench(data_file: Path, companion: Path, lookups: int, seed: int):
+    """先量度讀取器 (避免 json.load 的記憶體影響結果)，再量度完整 json.load"""
+    from synthetic_bus_network import current_rss_bytes
+
+    rng = random.Random(seed)
+    rss_before = current_rss_bytes()
+
+    start_time = time.perf_counter()
+    reader = BusDataReader(companion)
+    open_ms = (time.perf_counter() - start_time) * 1000
+    open_rss = current_rss_bytes() - rss_before
+    route_ids = list(reader.keys('routes'))
+    stop_ids = list(reader.keys('stop_routes'))
+
+    sample_routes = [rng.choice(route_ids) for _ in range(lookups)]
+    sample_stops = [rng.choice(stop_ids) for _ in range(lookups)]
+    start_time = time.perf_counter()
+    for route_id, stop_id in zip(sample_routes, sample_stops):
+        reader._decode_uncached('routes', route_id)
+        reader._decode_uncached('stop_routes', stop_id)
+    cold_us = (time.perf_counter() - start_time) * 1e6 / (lookups * 2)
+
+    for route_id, stop_id in zip(sample_routes, sample_stops):
+        reader.route(route_id)
+        reader.stop_routes(stop_id)
+    start_time = time.perf_counter()
+    for route_id, stop_id in zip(sample_routes, sample_stops):
+        reader.route(route_id)
+        reader.stop_routes(stop_id)
+    cached_us = (time.perf_counter() - start_time) * 1e6 / (lookups * 2)
+    reader_rss = current_rss_bytes() - rss_before
+
+    rss_before = current_rss_bytes()
+    start_time = time.perf_counter()
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    load_ms = (time.perf_counter() - start_time) * 1000
+    json_rss = current_rss_bytes() - rss_before
+    del data
+    reader.close()
+
+    print(f"\n{'':<28} {'bus_data.bin':>14} {'json.load':>12}")
+    print("-" * 56)
+    print(f"{'open / load':<28} {open_ms:>11.2f} ms {load_ms:>9.0f} ms")
+    print(f"{'lookup (decode)':<28} {cold_us:>11.1f} µs {'-':>12}")
+    print(f"{'lookup (LRU cached)':<28} {cached_us:>11.2f} µs {'-':>12}")
+    print(f"{'RSS increase (open)':<28} {open_rss / 1024 / 1024:>11.1f} MB {json_rss / 1024 / 1024:>9.1f} MB")
+    print(f"{'RSS increase (after lookups)':<28} {reader_rss / 1024 / 1024:>11.1f} MB {'-':>12}")
+    print(f"   ({lookups * 2:,} random lookups, {reader.cache_info().currsize:,} decoded records cached; "
+          f"touched mmap pages are file-backed and reclaimable)")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Binary companion file and memory-mapped reader for bus_data.json')
+    parser.add_argument('--data-file', help='bus_data.json (default: OUTPUT_DIRECTORY/bus_data.json)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('build', help='Write bus_data.bin next to bus_data.json')
+
+    get_parser = subparsers.add_parser('get', help='Print one record')
+    get_parser.add_argument('kind', choices=['route', 'route_stops', 'stop', 'stop_routes'])
+    get_parser.add_argument('key')
+
+    bench_parser = subparsers.add_parser('bench', help='Compare the reader with a full json.load')
+    bench_parser.add_argument('--lookups', type=int, default=2000, help='Random lookups per record type (default: 2000)')
+    bench_parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def main():
+    from collect_bus_data_optimized_concurrent import default_data_file, load_bus_data, load_environment
+
+    args = parse_args()
+    load_environment()
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    companion = data_file.parent / COMPANION_FILENAME
+
+    if args.command == 'build':
+        if not data_file.exists():
+            print(f"❌ Data file not found: {data_file}")
+            sys.exit(2)
+        path, stats = build_and_write(load_bus_data(data_file), data_file.parent)
+        print(f"✅ Companion written: {path}")
+        print(f"   {stats['file_size_bytes'] / 1024 / 1024:.2f} MB in {stats['build_seconds']:.2f}s, "
+              + ', '.join(f"{count:,} {name}" for name, count in stats['records'].items()))
+        return
+
+    if not companion.exists():
+        print(f"❌ Companion not found: {companion} (run: python3 bus_data_reader.py build)")
+        sys.exit(2)
+
+    if args.command == 'get':
+        with BusDataReader(companion) as reader:
+            record = getattr(reader, args.kind)(args.key)
+        if record is None:
+            print(f"❌ Not found: {args.kind} {args.key}")
+            sys.exit(1)
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+        return
+
+    run_bench(data_file, companion, args.lookups, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,67 +3,102 @@
 終極優化版香港巴士數據收集
 - KMB: 批量 API (3 次調用，超快)
 - CTB: 並行處理優化 (ThreadPool，快很多)
+- 營運商收集器插件 (KMB/CTB/NLB)，並行執行並共用每個主機的請求預算
 - 智能快取與錯誤處理
 - Firebase Storage 自動上傳
 - 版本管理機制
+- 子命令 CLI: collect (預設) / validate / metadata / publish / diff
+  requests、firebase_admin、dotenv 等較重的依賴只在需要的子命令中延遲匯入
 """
 
-import requests
 import json
 import time
 import threading
 import os
 import sys
 import logging
+import math
+import random
+import io
+import hashlib
+import argparse
 from pathlib import Path
 from datetime import datetime
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Any, Tuple, Optional
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from typing import TYPE_CHECKING, Dict, List, Any, Tuple, Optional
 
-# Load environment variables first (always needed)
-try:
-    from dotenv import load_dotenv
-    load_dotenv()  # Load .env file immediately
+from backup_store import BackupStore
+from structured_logging import LOG_MODES, configure_logging, stage_tag, bind_stage, ProgressReporter, log_request
+from storage_backends import METADATA_OBJECT, create_storage_backend, upload_artifacts
+
+if TYPE_CHECKING:
+    import requests  # 只用於型別註解；執行時按需匯入
+
+DOTENV_LOADED = False
+
+
+def load_environment() -> bool:
+    """載入 .env (由 CLI 入口調用，而非在匯入模組時)"""
+    global DOTENV_LOADED
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        print("⚠️ Warning: python-dotenv not installed. Using default paths.")
+        print("   Install with: pip3 install python-dotenv")
+        return False
+    load_dotenv()
     DOTENV_LOADED = True
-except ImportError:
-    DOTENV_LOADED = False
-    print("⚠️ Warning: python-dotenv not installed. Using default paths.")
-    print("   Install with: pip3 install python-dotenv")
-
-# Firebase libraries (optional)
-try:
-    import firebase_admin
-    from firebase_admin import credentials, storage
-    FIREBASE_AVAILABLE = True
-except ImportError:
-    FIREBASE_AVAILABLE = False
-    print("⚠️ Warning: Firebase libraries not installed. Upload will be skipped.")
-    print("   Install with: pip3 install firebase-admin")
+    return True
+
+
+def firebase_available() -> bool:
+    """firebase-admin 是否已安裝 (只查找套件，不匯入；真正匯入延遲到初始化 Firebase 時)"""
+    import importlib.util
+
+    if importlib.util.find_spec('firebase_admin') is None:
+        print("⚠️ Warning: Firebase libraries not installed. Upload will be skipped.")
+        print("   Install with: pip3 install firebase-admin")
+        return False
+    return True
 
 # Setup paths
 SCRIPT_DIR = Path(__file__).parent.absolute()
 
-def setup_logging():
-    """Configure logging to both file and console"""
+# Validation rules (shared by incremental accumulators and validate_data)
+REQUIRED_ROUTE_FIELDS = ['route_number', 'company', 'direction', 'origin_tc', 'dest_tc']
+VALID_DIRECTIONS = ['inbound', 'outbound']
+VALID_COMPANIES = ['KMB', 'CTB', 'NWFB', 'NLB']
+
+def setup_logging(log_to_file: bool = True, log_name: Optional[str] = None):
+    """
+    Configure logging to both file and console (validate/metadata/diff 等短命令只輸出到 console)
+    log_name: 固定的日誌檔名 (不含副檔名)，多次執行附加到同一檔案；預設每次執行一個帶時間戳記的檔案
+    """
+    if not log_to_file:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S')
+        return logging.getLogger(__name__)
+
     # Get log directory from environment or use default
     log_dir = os.getenv('LOG_DIRECTORY', str(SCRIPT_DIR / 'logs'))
     log_dir_path = Path(log_dir)
     log_dir_path.mkdir(exist_ok=True)
 
-    # Create log file with date
-    log_file = log_dir_path / f"bus_data_collection_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()  # Also print to console
-        ]
-    )
+    # Create log file with date (文字日誌 + 同名 .jsonl 結構化記錄)
+    log_name = log_name or f"bus_data_collection_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    log_file = log_dir_path / f"{log_name}.log"
+    json_file = log_dir_path / f"{log_name}.jsonl" if os.getenv('LOG_JSON', 'true').lower() == 'true' else None
+
+    # Configure logging (LOG_MODE=queue: 由背景線程寫入檔案及 console，worker 線程不會被 I/O 阻塞)
+    log_mode = os.getenv('LOG_MODE', 'queue').lower()
+    if log_mode not in LOG_MODES:
+        print(f"⚠️ Warning: unknown LOG_MODE '{log_mode}', using queue")
+        log_mode = 'queue'
+    configure_logging(log_file, json_file, mode=log_mode,
+                      log_requests=os.getenv('LOG_REQUESTS', 'true').lower() == 'true')
 
     logger = logging.getLogger(__name__)
     logger.info(f"Logging initialized: {log_file}")
@@ -71,7 +106,7 @@ def setup_logging():
 
 def initialize_firebase() -> bool:
     """Initialize Firebase Admin SDK"""
-    if not FIREBASE_AVAILABLE:
+    if not firebase_available():
         logging.warning("Firebase libraries not available, skipping Firebase initialization")
         return False
 
@@ -92,6 +127,9 @@ def initialize_firebase() -> bool:
             return False
 
         # Initialize Firebase
+        import firebase_admin
+        from firebase_admin import credentials
+
         cred = credentials.Certificate(service_account_path)
         firebase_admin.initialize_app(cred, {
             'storageBucket': storage_bucket
@@ -104,55 +142,789 @@ def initialize_firebase() -> bool:
         logging.error(f"Failed to initialize Firebase: {e}")
         return False
 
-def upload_to_firebase_storage(local_file_path: str, remote_name: str = 'bus_data.json') -> bool:
-    """Upload file to Firebase Storage with version metadata"""
-    if not FIREBASE_AVAILABLE:
+def blob_metadata_for(data_file: str, metadata_file: Optional[str] = None) -> Dict[str, str]:
+    """bus_data.json 的 blob metadata (優先讀取小型 metadata 文件，避免解析整個數據文件)"""
+    source = metadata_file if metadata_file and os.path.exists(metadata_file) else data_file
+    with open(source, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    summary = meta.get('summary', {})
+
+    return {
+        'version': str(meta.get('version', 0)),
+        'generated_at': meta.get('generated_at', ''),
+        'file_size': str(os.path.getsize(data_file)),
+        'total_routes': str(summary.get('total_routes', 0)),
+        'total_stops': str(summary.get('total_stops', 0))
+    }
+
+
+def upload_to_firebase_storage(local_file_path: str, metadata_file: Optional[str] = None) -> bool:
+    """
+    Upload bus_data.json (and its metadata file) through the configured storage backend
+    - 分塊可續傳上傳，多個文件並行
+    - 以 generation 前置條件寫入，避免兩個執行互相覆蓋
+    """
+    if os.getenv('STORAGE_BACKEND', 'firebase').lower() == 'firebase' and not firebase_available():
         logging.warning("Firebase not available, skipping upload")
         return False
 
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(remote_name)
-
-        # Read file to get version info
-        with open(local_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Set metadata including version timestamp
-        blob.metadata = {
-            'version': str(data.get('version', 0)),
-            'generated_at': data.get('generated_at', ''),
-            'file_size': str(os.path.getsize(local_file_path)),
-            'total_routes': str(data.get('summary', {}).get('total_routes', 0)),
-            'total_stops': str(data.get('summary', {}).get('total_stops', 0))
+        backend = create_storage_backend(state_dir=Path(local_file_path).parent)
+        blob_metadata = blob_metadata_for(local_file_path, metadata_file)
+
+        logging.info(f"📤 Uploading {local_file_path} via {backend.name} storage backend...")
+        logging.info(f"   Version: {blob_metadata['version']}")
+        logging.info(f"   Size: {blob_metadata['file_size']} bytes")
+
+        artifacts = [(local_file_path, 'bus_data.json', 'application/json', blob_metadata)]
+        if metadata_file:
+            artifacts.append((metadata_file, METADATA_OBJECT, 'application/json', None))
+
+        ok, _ = upload_artifacts(backend, artifacts)
+        if ok:
+            logging.info(f"✅ Upload successful!")
+            logging.info(f"   Blob path: {backend.describe('bus_data.json')}")
+        return ok
+
+    except Exception as e:
+        logging.error(f"❌ Firebase upload failed: {e}")
+        return False
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(math.ceil(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def endpoint_label(url: str) -> str:
+    """Collapse a request URL to its endpoint (host + /version/transport/operator/resource, no IDs/query)"""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    return parts.netloc + '/' + '/'.join(segments[:4])
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (0 if unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageProfiler:
+    """
+    按階段的效能剖析 (PROFILE_STAGES=cprofile 或 sample)
+    - cprofile: cProfile + pstats 報告 (.prof 可用 snakeviz 等工具查看)
+    - sample: pyinstrument 取樣剖析 (未安裝時退回 cprofile)
+    - 同時以 tracemalloc 記錄每個階段的記憶體增長及峰值 (只讀計數器，不建立快照)
+    cProfile 只剖析進入階段的線程；階段內工作線程的網絡等待請參考 CollectorMetrics 的延遲指標
+    同一時間只有一個剖析器：巢狀或在其他線程並行的階段 (例如 collect 內的 collect_kmb) 只記錄記憶體，
+    否則 Python 3.12+ 的 cProfile 會拋出 ValueError (another profiler is already active)
+    """
+
+    def __init__(self, output_dir: Path, mode: str = 'cprofile', top_n: int = 25):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.profiling: Optional[str] = None       # 持有剖析器的階段
+        self.open_stages: List[Dict[str, Any]] = []
+        if mode == 'sample':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                logging.warning("⚠️ pyinstrument not installed, falling back to cProfile")
+                self.mode = 'cprofile'
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def from_env(cls) -> Optional['StageProfiler']:
+        """PROFILE_STAGES 未設定時返回 None (不產生任何額外開銷)"""
+        mode = os.getenv('PROFILE_STAGES', '').strip().lower()
+        if mode in ('', '0', 'false', 'off'):
+            return None
+        if mode not in ('cprofile', 'sample'):
+            mode = 'cprofile'
+
+        log_dir = Path(os.getenv('LOG_DIRECTORY', str(SCRIPT_DIR / 'logs')))
+        output_dir = log_dir / 'profiles' / datetime.now().strftime('%Y%m%d_%H%M%S')
+        return cls(output_dir, mode)
+
+    def start(self, name: str) -> Dict[str, Any]:
+        """開始剖析一個命名階段，返回傳給 finish() 的階段記錄"""
+        import tracemalloc
+
+        with self.lock:
+            # reset_peak 會清除外層階段的峰值：先把目前峰值記入所有未結束的階段
+            current, peak = tracemalloc.get_traced_memory()
+            for open_stage in self.open_stages:
+                open_stage['peak'] = max(open_stage['peak'], peak)
+            tracemalloc.reset_peak()
+            session = {'name': name, 'memory_start': current, 'peak': current, 'profiler': None}
+            self.open_stages.append(session)
+            if self.profiling is not None:
+                logging.debug(f"🔬 Stage '{name}' runs inside '{self.profiling}': recording memory only")
+                return session
+            self.profiling = name
+
+        if self.mode == 'sample':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        session['profiler'] = profiler
+        return session
+
+    def finish(self, session: Dict[str, Any]):
+        """停止剖析並寫出報告 (在階段計時之外執行)"""
+        import tracemalloc
+
+        profiler = session['profiler']
+        if profiler is not None:
+            if self.mode == 'sample':
+                profiler.stop()
+            else:
+                profiler.disable()
+
+        with self.lock:
+            current, peak = tracemalloc.get_traced_memory()
+            self.open_stages.remove(session)
+            for open_stage in self.open_stages:
+                open_stage['peak'] = max(open_stage['peak'], peak)
+            if profiler is not None:
+                self.profiling = None
+        session['memory_end'] = current
+        session['peak'] = max(session['peak'], peak)
+
+        try:
+            self._write_reports(session)
+        except Exception as e:
+            logging.error(f"⚠️  Failed to write profile for {session['name']}: {e}")
+
+    def _write_reports(self, session: Dict[str, Any]):
+        import pstats
+
+        name = session['name']
+        profiler = session['profiler']
+        if profiler is not None and self.mode == 'sample':
+            (self.output_dir / f"{name}.html").write_text(profiler.output_html(), encoding='utf-8')
+            (self.output_dir / f"{name}_profile.txt").write_text(profiler.output_text(unicode=True), encoding='utf-8')
+        elif profiler is not None:
+            profiler.dump_stats(str(self.output_dir / f"{name}.prof"))
+            report = io.StringIO()
+            stats = pstats.Stats(profiler, stream=report)
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            (self.output_dir / f"{name}_profile.txt").write_text(report.getvalue(), encoding='utf-8')
+
+        # tracemalloc 為整個進程，並行階段會互相包含
+        mb = 1024 * 1024
+        lines = [
+            f"Stage: {name}",
+            f"Traced memory at start: {session['memory_start'] / mb:.1f} MB",
+            f"Traced memory at end: {session['memory_end'] / mb:.1f} MB "
+            f"({(session['memory_end'] - session['memory_start']) / mb:+.1f} MB)",
+            f"Peak during stage: {session['peak'] / mb:.1f} MB "
+            f"(+{(session['peak'] - session['memory_start']) / mb:.1f} MB above start)",
+        ]
+        if profiler is None:
+            lines.append("CPU profile: not recorded (another stage held the profiler)")
+        (self.output_dir / f"{name}_alloc.txt").write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+        logging.info(f"🔬 Profile written for stage '{name}': {self.output_dir}")
+
+
+class CollectorMetrics:
+    """
+    收集器效能指標
+    - 各階段耗時
+    - 每個 endpoint 的延遲分佈 (p50/p95/p99)、接收位元組、重試及錯誤
+    - 峰值 RSS
+    每次執行寫出 JSON 及 Prometheus textfile collector 格式
+    latency_samples: 長期運行的服務 (ETA) 設定此值，每個 endpoint 最多保留這麼多個延遲樣本 (reservoir sampling)，
+    請求數、總和及最大值仍然準確；None = 保留全部樣本 (一次收集的請求數有限)
+    """
+
+    def __init__(self, profiler: Optional[StageProfiler] = None, latency_samples: Optional[int] = None):
+        self.lock = threading.Lock()
+        self.profiler = profiler
+        self.latency_samples = latency_samples
+        self.rng = random.Random()
+        self.started_at = datetime.now().isoformat()
+        self.stages: Dict[str, float] = {}
+        self.endpoints: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """記錄一個階段的耗時 (啟用剖析時同時剖析該階段；剖析器的啟動及報告不計入耗時)"""
+        with stage_tag(name):
+            session = self.profiler.start(name) if self.profiler is not None else None
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start_time
+                if session is not None:
+                    self.profiler.finish(session)
+                self.record_stage(name, elapsed)
+
+    def record_stage(self, name: str, elapsed: float):
+        """累計階段耗時 (在其他進程執行的階段由呼叫者報告)"""
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def record_request(self, url: str, elapsed: float, bytes_received: int, ok: bool, retries: int = 0):
+        """記錄一次 API 請求 (含重試)"""
+        endpoint = endpoint_label(url)
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = {'latencies': [], 'count': 0, 'sum': 0.0, 'max': 0.0,
+                         'bytes_received': 0, 'errors': 0, 'retries': 0}
+                self.endpoints[endpoint] = stats
+            stats['count'] += 1
+            stats['sum'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            if self.latency_samples is None or len(stats['latencies']) < self.latency_samples:
+                stats['latencies'].append(elapsed)
+            else:
+                slot = self.rng.randrange(stats['count'])
+                if slot < self.latency_samples:
+                    stats['latencies'][slot] = elapsed
+            stats['bytes_received'] += bytes_received
+            stats['retries'] += retries
+            if not ok:
+                stats['errors'] += 1
+
+    def snapshot(self, exit_code: Optional[int] = None) -> Dict[str, Any]:
+        """匯總為可序列化的字典"""
+        with self.lock:
+            endpoints = {}
+            for endpoint, stats in self.endpoints.items():
+                latencies = sorted(stats['latencies'])
+                endpoints[endpoint] = {
+                    'requests': stats['count'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes_received': stats['bytes_received'],
+                    'latency_seconds': {
+                        'sum': round(stats['sum'], 4),
+                        'p50': round(percentile(latencies, 50), 4),
+                        'p95': round(percentile(latencies, 95), 4),
+                        'p99': round(percentile(latencies, 99), 4),
+                        'max': round(stats['max'], 4)
+                    }
+                }
+            stages = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+        return {
+            'started_at': self.started_at,
+            'finished_at': datetime.now().isoformat(),
+            'exit_code': exit_code,
+            'stage_seconds': stages,
+            'endpoints': endpoints,
+            'totals': {
+                'requests': sum(e['requests'] for e in endpoints.values()),
+                'errors': sum(e['errors'] for e in endpoints.values()),
+                'retries': sum(e['retries'] for e in endpoints.values()),
+                'bytes_received': sum(e['bytes_received'] for e in endpoints.values())
+            },
+            'peak_rss_bytes': peak_rss_bytes()
         }
 
-        logging.info(f"📤 Uploading {local_file_path} to Firebase Storage...")
-        logging.info(f"   Version: {blob.metadata['version']}")
-        logging.info(f"   Size: {blob.metadata['file_size']} bytes")
+    @staticmethod
+    def to_prometheus(snapshot: Dict[str, Any]) -> str:
+        """轉換為 Prometheus text exposition format"""
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: List[Tuple[str, Any]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        def label(**labels) -> str:
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        endpoints = snapshot['endpoints']
+
+        metric('hkbus_collector_stage_duration_seconds', 'gauge', 'Duration of each collection stage',
+               [(label(stage=name), seconds) for name, seconds in snapshot['stage_seconds'].items()])
+
+        latency_samples = []
+        for endpoint, stats in endpoints.items():
+            latency = stats['latency_seconds']
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                latency_samples.append((label(endpoint=endpoint, quantile=quantile), latency[key]))
+        metric('hkbus_collector_request_latency_seconds', 'summary', 'API request latency per endpoint',
+               latency_samples)
+        for endpoint, stats in endpoints.items():
+            lines.append(f"hkbus_collector_request_latency_seconds_sum{label(endpoint=endpoint)} {stats['latency_seconds']['sum']}")
+            lines.append(f"hkbus_collector_request_latency_seconds_count{label(endpoint=endpoint)} {stats['requests']}")
+
+        metric('hkbus_collector_bytes_received_total', 'counter', 'Response bytes received per endpoint',
+               [(label(endpoint=endpoint), stats['bytes_received']) for endpoint, stats in endpoints.items()])
+        metric('hkbus_collector_request_errors_total', 'counter', 'Failed API requests per endpoint',
+               [(label(endpoint=endpoint), stats['errors']) for endpoint, stats in endpoints.items()])
+        metric('hkbus_collector_request_retries_total', 'counter', 'API request retries per endpoint',
+               [(label(endpoint=endpoint), stats['retries']) for endpoint, stats in endpoints.items()])
+        metric('hkbus_collector_peak_rss_bytes', 'gauge', 'Peak resident set size of the collector',
+               [('', snapshot['peak_rss_bytes'])])
+        if snapshot['exit_code'] is not None:
+            metric('hkbus_collector_exit_code', 'gauge', 'Exit code of the last collection run',
+                   [('', snapshot['exit_code'])])
+        metric('hkbus_collector_last_run_timestamp_seconds', 'gauge', 'Unix time the last run finished',
+               [('', int(time.time()))])
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, exit_code: Optional[int] = None) -> Tuple[str, str]:
+        """寫出 JSON (LOG_DIRECTORY) 及 Prometheus textfile (METRICS_TEXTFILE_DIR 或 LOG_DIRECTORY)"""
+        snapshot = self.snapshot(exit_code)
+
+        log_dir_path = Path(os.getenv('LOG_DIRECTORY', str(SCRIPT_DIR / 'logs')))
+        log_dir_path.mkdir(parents=True, exist_ok=True)
+        json_file = log_dir_path / f"collector_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=2, ensure_ascii=False)
+
+        # Textfile collector 需要原子性寫入 (先寫 .tmp 再改名)
+        prom_dir_path = Path(os.getenv('METRICS_TEXTFILE_DIR', str(log_dir_path)))
+        prom_dir_path.mkdir(parents=True, exist_ok=True)
+        prom_file = prom_dir_path / 'hkbus_collector.prom'
+        tmp_file = prom_file.with_suffix('.prom.tmp')
+        tmp_file.write_text(self.to_prometheus(snapshot), encoding='utf-8')
+        os.replace(tmp_file, prom_file)
+
+        return str(json_file), str(prom_file)
+
+
+class HostRequestBudget:
+    """每個主機的共享並行請求預算 (所有營運商共用)"""
+
+    def __init__(self, default_limit: int = 20, limits: Optional[Dict[str, int]] = None):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limits.get(host, self.default_limit))
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def slot(self, url: str):
+        """佔用 url 所屬主機的一個請求名額"""
+        semaphore = self._semaphore(urlsplit(url).netloc)
+        with semaphore:
+            yield
+
+
+class OperatorCollector:
+    """
+    營運商收集器插件介面
+    - fetch_strategy: 'bulk' (少量批量 API) 或 'per_route' (逐條路線並行)
+    - make_route_id: 路線 ID 格式 (App 使用 {company}_{route}_{I|O})
+    - map_route / map_stop: 欄位映射到 bus_data 格式
+    """
+
+    company = ''
+    fetch_strategy = ''
+    base_url = ''
+
+    def __init__(self):
+        # {COMPANY}_API_BASE 可指向其他伺服器 (例如基準測試用的本地模擬 API)
+        self.base_url = os.getenv(f"{self.company}_API_BASE", self.base_url).rstrip('/')
+
+    def make_route_id(self, route_number: str, direction: str) -> str:
+        return f"{self.company}_{route_number}_{'I' if direction == 'inbound' else 'O'}"
+
+    def map_route(self, raw_route: Dict[str, Any], direction: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def map_stop(self, raw_stop: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'name_tc': raw_stop['name_tc'],
+            'name_en': raw_stop['name_en'],
+            'latitude': float(raw_stop['lat']),
+            'longitude': float(raw_stop['long']),
+            'company': self.company
+        }
+
+    def collect(self, collector: 'OptimizedConcurrentBusDataCollector') -> bool:
+        raise NotImplementedError
+
+
+class BulkOperatorCollector(OperatorCollector):
+    """批量策略：一次取得全部站點、路線及路線站點"""
+
+    fetch_strategy = 'bulk'
+
+    def route_key(self, raw: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    def collect(self, collector: 'OptimizedConcurrentBusDataCollector') -> bool:
+        return collector.collect_bulk_operator(self)
+
+
+class PerRouteOperatorCollector(OperatorCollector):
+    """逐條路線策略：先取路線列表，再並行取得每個方向的站點"""
+
+    fetch_strategy = 'per_route'
+    max_workers = 10
+
+    def fetch_route_list(self, collector: 'OptimizedConcurrentBusDataCollector') -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def expand_route(self, raw_route: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+        """返回 [(route_number, direction, fetch_key), ...]"""
+        raise NotImplementedError
+
+    def fetch_route_stops(self, collector: 'OptimizedConcurrentBusDataCollector',
+                          fetch_key: Any) -> List[Tuple[str, Any, Optional[Dict[str, Any]]]]:
+        """返回 [(stop_id, sequence, stop_info 或 None), ...]；None 表示需另外獲取站點詳情"""
+        raise NotImplementedError
+
+    def fetch_stop(self, collector: 'OptimizedConcurrentBusDataCollector', stop_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def route_id_for(self, raw_route: Dict[str, Any], route_number: str, direction: str) -> str:
+        """expand_route 每個方向對應的路線 ID (預設 make_route_id；同方向有多個變體時可覆寫)"""
+        return self.make_route_id(route_number, direction)
+
+    def collect(self, collector: 'OptimizedConcurrentBusDataCollector') -> bool:
+        return collector.collect_per_route_operator(self)
+
+
+class KMBOperatorCollector(BulkOperatorCollector):
+    """KMB 批量 API (3 次調用)"""
+
+    company = 'KMB'
+    base_url = "https://data.etabus.gov.hk/v1/transport/kmb"
+
+    def route_key(self, raw: Dict[str, Any]) -> str:
+        return f"{raw['route']}_{raw['bound']}_{raw['service_type']}"
+
+    def map_route(self, raw_route: Dict[str, Any], direction: str) -> Dict[str, Any]:
+        return {
+            'route_number': raw_route['route'],
+            'company': self.company,
+            'direction': direction,
+            'origin_tc': raw_route['orig_tc'],
+            'origin_en': raw_route['orig_en'],
+            'dest_tc': raw_route['dest_tc'],
+            'dest_en': raw_route['dest_en'],
+            'service_type': raw_route['service_type']
+        }
+
+
+class CTBOperatorCollector(PerRouteOperatorCollector):
+    """CTB (已合併 NWFB) 逐條路線並行收集"""
+
+    company = 'CTB'
+    base_url = "https://rt.data.gov.hk/v2/transport/citybus"
+
+    def fetch_route_list(self, collector):
+        data, _ = collector.fetch_json(f"{self.base_url}/route/{self.company}", f"{self.company} routes")
+        return data.get('data') or []
+
+    def expand_route(self, raw_route):
+        return [(raw_route['route'], direction, (raw_route['route'], direction))
+                for direction in ('inbound', 'outbound')]
+
+    def map_route(self, raw_route, direction):
+        return {
+            'route_number': raw_route['route'],
+            'company': self.company,
+            'direction': direction,
+            'origin_tc': raw_route['orig_tc'],
+            'origin_en': raw_route['orig_en'],
+            'dest_tc': raw_route['dest_tc'],
+            'dest_en': raw_route['dest_en']
+        }
 
-        # Upload file
-        blob.upload_from_filename(
-            local_file_path,
-            content_type='application/json'
+    def fetch_route_stops(self, collector, fetch_key):
+        route_number, direction = fetch_key
+        data, _ = collector.fetch_json(
+            f"{self.base_url}/route-stop/{self.company}/{route_number}/{direction}",
+            f"{self.company} {route_number} {direction}"
         )
+        return [(stop_info['stop'], stop_info['seq'], None) for stop_info in data.get('data') or []]
 
-        # Make publicly readable (or use Firebase Auth in app)
-        # blob.make_public()  # Uncomment if you want public access
+    def fetch_stop(self, collector, stop_id):
+        stop_detail, _ = collector.fetch_json(
+            f"{self.base_url}/stop/{stop_id}",
+            f"{self.company} stop {stop_id}"
+        )
+        if stop_detail.get('data'):
+            return self.map_stop(stop_detail['data'])
+        return None
+
+
+class NLBOperatorCollector(PerRouteOperatorCollector):
+    """
+    NLB (嶼巴) 逐條路線收集
+    - 每個 routeId 為單一方向；同一路線號碼的 routeId 按順序交替視為 outbound / inbound
+    - 第三個及之後的 routeId (特別班次等變體) 以 NLB_{route}_{O|I}_{variant} 保留，並記錄警告
+    - 站點列表已包含站點詳情，無需額外請求
+    """
+
+    company = 'NLB'
+    base_url = "https://rt.data.gov.hk/v2/transport/nlb"
+    max_workers = 5
+
+    def fetch_route_list(self, collector):
+        data, _ = collector.fetch_json(f"{self.base_url}/route.php?action=list", "NLB routes")
+        routes = data.get('routes') or []
+
+        # 依路線號碼分組，分配方向及變體編號 (每兩個 routeId 為一組 outbound / inbound)
+        seen = defaultdict(int)
+        expanded = []
+        for raw_route in sorted(routes, key=lambda r: int(r['routeId'])):
+            index = seen[raw_route['routeNo']]
+            seen[raw_route['routeNo']] += 1
+            expanded.append(dict(raw_route, direction='outbound' if index % 2 == 0 else 'inbound',
+                                 variant=index // 2 + 1))
+
+        for route_number, count in sorted(seen.items()):
+            if count > 2:
+                logging.warning(f"⚠️ NLB route {route_number} has {count} routeIds; "
+                                f"{count - 2} extra variants kept as NLB_{route_number}_{{O|I}}_{{variant}}",
+                                extra={'fields': {'route_number': route_number, 'route_ids': count}})
+        return expanded
+
+    def expand_route(self, raw_route):
+        return [(raw_route['routeNo'], raw_route['direction'], raw_route['routeId'])]
+
+    def route_id_for(self, raw_route, route_number, direction):
+        route_id = self.make_route_id(route_number, direction)
+        variant = raw_route.get('variant', 1)
+        return route_id if variant == 1 else f"{route_id}_{variant}"
+
+    def map_route(self, raw_route, direction):
+        origin_tc, _, dest_tc = raw_route['routeName_c'].partition(' > ')
+        origin_en, _, dest_en = raw_route['routeName_e'].partition(' > ')
+        return {
+            'route_number': raw_route['routeNo'],
+            'company': self.company,
+            'direction': direction,
+            'origin_tc': origin_tc,
+            'origin_en': origin_en,
+            'dest_tc': dest_tc,
+            'dest_en': dest_en
+        }
 
-        logging.info(f"✅ Upload successful!")
-        logging.info(f"   Blob path: gs://{bucket.name}/{remote_name}")
+    def map_stop(self, raw_stop):
+        return {
+            'name_tc': raw_stop['stopName_c'],
+            'name_en': raw_stop['stopName_e'],
+            'latitude': float(raw_stop['latitude']),
+            'longitude': float(raw_stop['longitude']),
+            'company': self.company
+        }
 
+    def fetch_route_stops(self, collector, fetch_key):
+        data, _ = collector.fetch_json(
+            f"{self.base_url}/stop.php?action=list&routeId={fetch_key}",
+            f"NLB route {fetch_key} stops"
+        )
+        return [(raw_stop['stopId'], sequence, self.map_stop(raw_stop))
+                for sequence, raw_stop in enumerate(data.get('stops') or [], start=1)]
+
+
+# 可用的營運商收集器 (BUS_OPERATORS 環境變數選擇啟用哪些，預設 KMB,CTB)
+OPERATOR_COLLECTORS = {
+    'KMB': KMBOperatorCollector,
+    'CTB': CTBOperatorCollector,
+    'NLB': NLBOperatorCollector,
+}
+DEFAULT_OPERATORS = ['KMB', 'CTB']
+
+
+def enabled_operators() -> List[str]:
+    """讀取 BUS_OPERATORS 環境變數 (例如 "KMB,CTB,NLB")"""
+    value = os.getenv('BUS_OPERATORS')
+    if not value:
+        return list(DEFAULT_OPERATORS)
+    operators = [name.strip().upper() for name in value.split(',') if name.strip()]
+    if not operators:
+        raise ValueError(f"BUS_OPERATORS lists no operators: {value!r} (available: {', '.join(OPERATOR_COLLECTORS)})")
+    return operators
+
+
+class RecordingTransport:
+    """
+    錄製模式：包裝真實傳輸，把每個回應 (原始位元組、狀態碼、耗時) 寫入單一壓縮 zip 檔案
+    同一 URL 只保留最後一次回應 (重試成功會覆蓋之前的失敗)
+    """
+
+    def __init__(self, inner, archive_path: str):
+        self.inner = inner
+        self.archive_path = archive_path
+        self.lock = threading.Lock()
+        self.index: Dict[str, Dict[str, Any]] = {}
+        import zipfile
+
+        self.archive = zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+
+    @staticmethod
+    def member_name(url: str) -> str:
+        return 'responses/' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url: str, timeout: int = 30):
+        start_time = time.time()
+        try:
+            response = self.inner.get(url, timeout=timeout)
+        except Exception as e:
+            with self.lock:
+                self.index[url] = {'error': f"{type(e).__name__}: {e}", 'elapsed': time.time() - start_time}
+            raise
+
+        elapsed = time.time() - start_time
+        member = self.member_name(url)
+        with self.lock:
+            if url not in self.index or 'member' not in self.index[url]:
+                self.archive.writestr(member, response.content)
+            else:
+                # zipfile 不能覆蓋成員，改用帶序號的新名稱
+                member = f"{member}.{len(self.index)}"
+                self.archive.writestr(member, response.content)
+            self.index[url] = {'member': member, 'status': response.status_code, 'elapsed': elapsed}
+        return response
+
+    def close(self):
+        with self.lock:
+            if self.archive.fp is None:
+                return
+            self.archive.writestr('index.json', json.dumps({
+                'recorded_at': datetime.now().isoformat(),
+                'responses': self.index
+            }, ensure_ascii=False))
+            self.archive.close()
+        size = os.path.getsize(self.archive_path)
+        logging.info(f"📼 Recorded {len(self.index):,} responses to {self.archive_path} ({size/1024/1024:.2f} MB)")
+
+
+class ReplayResponse:
+    """與 requests.Response 相容的最小回應物件"""
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+
+            raise requests.HTTPError(f"{self.status_code} Error (replayed) for url: {self.url}", response=self)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ReplayTransport:
+    """重播模式：從錄製檔案提供回應，不使用網絡；可選擇模擬錄製時的延遲"""
+
+    def __init__(self, archive_path: str, simulate_latency: bool = False):
+        import zipfile
+
+        self.archive = zipfile.ZipFile(archive_path, 'r')
+        self.index = json.loads(self.archive.read('index.json'))['responses']
+        self.simulate_latency = simulate_latency
+        self.lock = threading.Lock()
+        logging.info(f"📼 Replaying {len(self.index):,} recorded responses from {archive_path}")
+
+    def get(self, url: str, timeout: int = 30):
+        import requests
+
+        entry = self.index.get(url)
+        if entry is None:
+            raise requests.ConnectionError(f"Not in replay archive: {url}")
+
+        if self.simulate_latency:
+            time.sleep(entry['elapsed'])
+
+        if 'error' in entry:
+            raise requests.ConnectionError(f"Recorded failure: {entry['error']}")
+
+        with self.lock:
+            content = self.archive.read(entry['member'])
+        return ReplayResponse(url, entry['status'], content)
+
+    def close(self):
+        self.archive.close()
+
+
+def create_http_session(pool_maxsize: int = 20) -> 'requests.Session':
+    """連線池 + keep-alive 的 HTTP session (daemon 在多次執行之間重用以保持連線溫熱)"""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """連線錯誤、逾時、429 及 5xx 視為暫時性錯誤"""
+    # requests 尚未匯入時，錯誤不可能是 requests 的例外 (避免為檢查錯誤類型而匯入)
+    requests = sys.modules.get('requests')
+    if requests is None:
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
         return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
 
-    except Exception as e:
-        logging.error(f"❌ Firebase upload failed: {e}")
-        return False
 
 class OptimizedConcurrentBusDataCollector:
-    def __init__(self):
-        self.kmb_base = "https://data.etabus.gov.hk/v1/transport/kmb"
-        self.ctb_base = "https://rt.data.gov.hk/v2/transport/citybus"
+    def __init__(self, operators: Optional[List[str]] = None, metrics: Optional[CollectorMetrics] = None,
+                 record_path: Optional[str] = None, replay_path: Optional[str] = None,
+                 replay_latency: bool = False, http: Optional[Any] = None):
+        # 營運商收集器插件
+        self.operators: Dict[str, OperatorCollector] = {}
+        for company in operators or enabled_operators():
+            if company not in OPERATOR_COLLECTORS:
+                raise ValueError(f"Unknown operator: {company} (available: {', '.join(OPERATOR_COLLECTORS)})")
+            self.operators[company] = OPERATOR_COLLECTORS[company]()
+
+        # 所有營運商共用的每個主機請求預算
+        self.request_budget = HostRequestBudget(int(os.getenv('MAX_REQUESTS_PER_HOST', '20')))
+        # 重播的回應每次都相同 (錄製檔案只保留每個 URL 最後一次的結果)，重試只會多等退避時間
+        self.max_retries = 0 if replay_path else int(os.getenv('FETCH_MAX_RETRIES', '2'))
+        self.route_workers = int(os.getenv('ROUTE_WORKERS', '0')) or None
+
+        # HTTP 傳輸：session (連線池 + keep-alive，預設) 或 plain (每次請求新連線)
+        # 傳入 http 時沿用呼叫者的 session (例如 daemon 的長期連線)
+        # 傳輸在第一次請求時才建立，validate 等離線用途不會匯入 requests
+        self.transport = os.getenv('HTTP_TRANSPORT', 'session')
+        self._http = http
+        self._http_lock = threading.Lock()
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.replay_latency = replay_latency
+
+        # 效能指標
+        self.metrics = metrics or CollectorMetrics()
 
         # Generate version timestamp (Unix timestamp for easy comparison)
         self.version = int(datetime.now().timestamp())
@@ -179,89 +951,253 @@ class OptimizedConcurrentBusDataCollector:
             'failed_calls': 0,
             'cached_stops': 0
         }
+
+        # 增量統計與驗證累加器 (結果到達時即時更新，最後只需 finalize)
+        self.company_route_counts = defaultdict(int)
+        self.validation_acc = {
+            'missing_fields': {},       # route_id -> [field, ...]
+            'invalid_directions': {},   # route_id -> direction
+            'invalid_companies': {},    # route_id -> company
+            'nan_coords': {},           # stop_id -> label
+            'invalid_coords': {},       # stop_id -> label
+        }
+        self.unmapped_routes = []  # route_stops 中找不到路線資料的 route_id
         
         print("🚀 Optimized Concurrent Bus Data Collector initialized")
-        print("📊 Strategy: KMB batch + CTB concurrent")
+        print("📊 Strategy: " + " + ".join(f"{company} {operator.fetch_strategy}" for company, operator in self.operators.items()))
     
+    @property
+    def http(self):
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    # 錄製 / 重播 API 回應 (離線重現相同輸入)
+                    if self.replay_path:
+                        self._http = ReplayTransport(self.replay_path, simulate_latency=self.replay_latency)
+                    else:
+                        if self.transport == 'session':
+                            inner = create_http_session(self.request_budget.default_limit)
+                        else:
+                            import requests
+                            inner = requests
+                        self._http = RecordingTransport(inner, self.record_path) if self.record_path else inner
+        return self._http
+
+    @http.setter
+    def http(self, transport):
+        self._http = transport
+
+    def close(self):
+        """完成錄製檔案 / 關閉重播檔案"""
+        if isinstance(self._http, (RecordingTransport, ReplayTransport)):
+            self._http.close()
+
+    def add_route(self, route_id: str, route_info: Dict[str, Any]):
+        """登記路線資料並即時更新公司統計與欄位驗證"""
+        with self.data_lock:
+            is_new = route_id not in self.bus_data['routes']
+            self.bus_data['routes'][route_id] = route_info
+            if is_new:
+                self.company_route_counts[route_info.get('company')] += 1
+
+            acc = self.validation_acc
+            missing = [field for field in REQUIRED_ROUTE_FIELDS if not route_info.get(field)]
+            if missing:
+                acc['missing_fields'][route_id] = missing
+            else:
+                acc['missing_fields'].pop(route_id, None)
+
+            direction = route_info.get('direction')
+            if direction not in VALID_DIRECTIONS:
+                acc['invalid_directions'][route_id] = direction
+            else:
+                acc['invalid_directions'].pop(route_id, None)
+
+            company = route_info.get('company')
+            if company not in VALID_COMPANIES:
+                acc['invalid_companies'][route_id] = company
+            else:
+                acc['invalid_companies'].pop(route_id, None)
+
+    def add_stop(self, stop_id: str, stop_info: Dict[str, Any]):
+        """登記站點資料並即時檢查座標"""
+        lat = stop_info['latitude']
+        lon = stop_info['longitude']
+
+        nan_label = None
+        invalid_label = None
+        if math.isnan(lat) or math.isnan(lon) or math.isinf(lat) or math.isinf(lon):
+            nan_label = f"{stop_id} (NaN/Inf)"
+        elif lat == 0.0 or lon == 0.0:
+            invalid_label = f"{stop_id} (0.0)"
+        elif not (22.0 <= lat <= 22.7 and 113.8 <= lon <= 114.5):
+            invalid_label = f"{stop_id} ({lat}, {lon})"
+
+        with self.data_lock:
+            self.bus_data['stops'][stop_id] = stop_info
+
+            acc = self.validation_acc
+            acc['nan_coords'].pop(stop_id, None)
+            acc['invalid_coords'].pop(stop_id, None)
+            if nan_label:
+                acc['nan_coords'][stop_id] = nan_label
+            elif invalid_label:
+                acc['invalid_coords'][stop_id] = invalid_label
+
+    def add_route_stops(self, route_id: str, stops: List[Dict[str, Any]]):
+        """登記路線站點並即時更新站點→路線反向映射"""
+        with self.data_lock:
+            self.bus_data['route_stops'][route_id] = stops
+
+            route_info = self.bus_data['routes'].get(route_id)
+            if route_info is None:
+                self.unmapped_routes.append(route_id)
+                return
+
+            stop_routes = self.bus_data['stop_routes']
+            for stop_info in stops:
+                stop_id = stop_info['stop_id']
+                if stop_id not in stop_routes:
+                    stop_routes[stop_id] = []
+
+                stop_routes[stop_id].append({
+                    'route_number': route_info['route_number'],
+                    'company': route_info['company'],
+                    'direction': route_info['direction'],
+                    'destination': route_info['dest_tc'],
+                    'sequence': stop_info['sequence'],
+                    'route_id': route_id
+                })
+
     def fetch_json(self, url: str, description: str = "", timeout: int = 30) -> Tuple[Dict[str, Any], float]:
-        """線程安全的 JSON 獲取"""
-        try:
-            start_time = time.time()
-            response = requests.get(url, timeout=timeout)
-            response.raise_for_status()
-            data = response.json()
-            
-            elapsed = time.time() - start_time
-            
-            with self.data_lock:
-                self.stats['api_calls_made'] += 1
-                self.stats['successful_calls'] += 1
-            
-            return data, elapsed
-        except Exception as e:
-            with self.data_lock:
-                self.stats['api_calls_made'] += 1
-                self.stats['failed_calls'] += 1
-            
-            print(f"❌ {description}: {e}")
-            return {}, 0
-    
+        """線程安全的 JSON 獲取 (受每個主機的請求預算限制，暫時性錯誤自動重試)"""
+        start_time = time.time()
+        retries = 0
+        bytes_received = 0
+
+        while True:
+            try:
+                with self.request_budget.slot(url):
+                    response = self.http.get(url, timeout=timeout)
+                bytes_received += len(response.content)
+                response.raise_for_status()
+                data = response.json()
+                
+                elapsed = time.time() - start_time
+                
+                with self.data_lock:
+                    self.stats['api_calls_made'] += 1
+                    self.stats['successful_calls'] += 1
+                self.metrics.record_request(url, elapsed, bytes_received, True, retries)
+                log_request(url, endpoint_label(url), elapsed, bytes_received, True, retries)
+                
+                return data, elapsed
+            except Exception as e:
+                if retries < self.max_retries and is_retryable_error(e):
+                    retries += 1
+                    time.sleep(0.5 * 2 ** (retries - 1))
+                    continue
+
+                with self.data_lock:
+                    self.stats['api_calls_made'] += 1
+                    self.stats['failed_calls'] += 1
+                elapsed = time.time() - start_time
+                self.metrics.record_request(url, elapsed, bytes_received, False, retries)
+                log_request(url, endpoint_label(url), elapsed, bytes_received, False, retries, error=str(e))
+
+                logging.warning(f"❌ {description}: {e}", extra={'fields': {'url': url, 'retries': retries}})
+                return {}, 0
+
+    def collect_all_operators(self) -> Dict[str, bool]:
+        """所有營運商並行收集 (共用每個主機的請求預算)"""
+        print(f"\n🚦 Collecting operators concurrently: {', '.join(self.operators)}")
+        start_time = time.time()
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.operators))) as executor:
+            future_to_company = {
+                executor.submit(self._collect_operator_timed, operator): company
+                for company, operator in self.operators.items()
+            }
+
+            for future in as_completed(future_to_company):
+                company = future_to_company[future]
+                try:
+                    results[company] = future.result()
+                except Exception as e:
+                    print(f"❌ {company} collection error: {e}")
+                    results[company] = False
+
+        print(f"✅ All operators finished in {time.time() - start_time:.2f}s: {results}")
+        return results
+
+    def _collect_operator_timed(self, operator: OperatorCollector) -> bool:
+        with self.metrics.stage(f"collect_{operator.company.lower()}"):
+            return operator.collect(self)
+
     def collect_kmb_batch(self):
-        """KMB 批量收集 (保持原有高效方式)"""
-        print("\n🏎️  KMB Ultra-Fast Collection (3 API calls)")
+        """KMB 批量收集"""
+        return self.operators['KMB'].collect(self)
+
+    def collect_ctb_concurrent(self):
+        """CTB 並行收集"""
+        return self.operators['CTB'].collect(self)
+
+    def collect_bulk_operator(self, operator: BulkOperatorCollector) -> bool:
+        """批量策略收集 (例如 KMB：3 次 API 調用)"""
+        company = operator.company
+        print(f"\n🏎️  {company} Ultra-Fast Collection (3 API calls)")
         print("=" * 50)
         
         start_time = time.time()
         
         # 1. 批量獲取所有站點
-        print("1️⃣ Fetching ALL KMB stops...")
-        all_stops, stops_time = self.fetch_json(f"{self.kmb_base}/stop", "All KMB stops")
+        print(f"1️⃣ Fetching ALL {company} stops...")
+        all_stops, stops_time = self.fetch_json(f"{operator.base_url}/stop", f"All {company} stops")
         
         if not all_stops.get('data'):
-            print("❌ Failed to get KMB stops")
+            print(f"❌ Failed to get {company} stops")
             return False
         
         stops_index = {stop['stop']: stop for stop in all_stops['data']}
         print(f"✅ Got {len(stops_index):,} stops in {stops_time:.2f}s")
         
         # 2. 批量獲取所有路線
-        print("\n2️⃣ Fetching ALL KMB routes...")
-        all_routes, routes_time = self.fetch_json(f"{self.kmb_base}/route", "All KMB routes")
+        print(f"\n2️⃣ Fetching ALL {company} routes...")
+        all_routes, routes_time = self.fetch_json(f"{operator.base_url}/route", f"All {company} routes")
         
         if not all_routes.get('data'):
-            print("❌ Failed to get KMB routes")
+            print(f"❌ Failed to get {company} routes")
             return False
         
         routes_index = {}
         for route in all_routes['data']:
-            key = f"{route['route']}_{route['bound']}_{route['service_type']}"
-            routes_index[key] = route
+            routes_index[operator.route_key(route)] = route
         print(f"✅ Got {len(routes_index):,} route variations in {routes_time:.2f}s")
         
         # 3. 批量獲取所有路線站點映射
-        print("\n3️⃣ Fetching ALL KMB route-stops...")
-        all_route_stops, mapping_time = self.fetch_json(f"{self.kmb_base}/route-stop", "All KMB route-stops")
+        print(f"\n3️⃣ Fetching ALL {company} route-stops...")
+        all_route_stops, mapping_time = self.fetch_json(f"{operator.base_url}/route-stop", f"All {company} route-stops")
         
         if not all_route_stops.get('data'):
-            print("❌ Failed to get KMB route-stops")
+            print(f"❌ Failed to get {company} route-stops")
             return False
         
         print(f"✅ Got {len(all_route_stops['data']):,} mappings in {mapping_time:.2f}s")
         
         # 4. 高效處理數據
-        print("\n⚡ Processing KMB data...")
+        print(f"\n⚡ Processing {company} data...")
         route_stops_map = defaultdict(list)
         used_stops = set()
         
         for route_stop in all_route_stops['data']:
             route_num = route_stop['route']
-            bound = route_stop['bound']
-            service_type = route_stop['service_type']
+            direction = 'inbound' if route_stop['bound'] == 'I' else 'outbound'
             stop_id = route_stop['stop']
             sequence = route_stop['seq']
             
-            route_key = f"{route_num}_{bound}_{service_type}"
-            unique_route_id = f"KMB_{route_num}_{bound}"
+            route_key = operator.route_key(route_stop)
+            unique_route_id = operator.make_route_id(route_num, direction)
             
             route_stops_map[unique_route_id].append({
                 'stop_id': stop_id,
@@ -272,80 +1208,61 @@ class OptimizedConcurrentBusDataCollector:
             
             # 創建路線資料
             if unique_route_id not in self.bus_data['routes'] and route_key in routes_index:
-                route_info = routes_index[route_key]
-                self.bus_data['routes'][unique_route_id] = {
-                    'route_number': route_num,
-                    'company': 'KMB',
-                    'direction': 'inbound' if bound == 'I' else 'outbound',
-                    'origin_tc': route_info['orig_tc'],
-                    'origin_en': route_info['orig_en'],
-                    'dest_tc': route_info['dest_tc'],
-                    'dest_en': route_info['dest_en'],
-                    'service_type': service_type
-                }
+                self.add_route(unique_route_id, operator.map_route(routes_index[route_key], direction))
         
         # 添加站點資料
         for stop_id in used_stops:
             if stop_id in stops_index:
-                stop_data = stops_index[stop_id]
-                self.bus_data['stops'][stop_id] = {
-                    'name_tc': stop_data['name_tc'],
-                    'name_en': stop_data['name_en'],
-                    'latitude': float(stop_data['lat']),
-                    'longitude': float(stop_data['long']),
-                    'company': 'KMB'
-                }
+                self.add_stop(stop_id, operator.map_stop(stops_index[stop_id]))
                 self.stop_cache.add(stop_id)
         
-        # 整理路線站點
+        # 整理路線站點 (同時更新反向映射)
         for route_id, stops in route_stops_map.items():
             stops.sort(key=lambda x: x['sequence'])
-            self.bus_data['route_stops'][route_id] = stops
+            self.add_route_stops(route_id, stops)
         
-        kmb_time = time.time() - start_time
-        print(f"✅ KMB Complete: {len(self.bus_data['routes'])} routes, {len(used_stops)} stops in {kmb_time:.2f}s")
+        elapsed = time.time() - start_time
+        print(f"✅ {company} Complete: {self.company_route_counts[company]} routes, {len(used_stops)} stops in {elapsed:.2f}s")
         
         return True
     
-    def fetch_ctb_route_stops(self, company: str, route_id: str, direction: str) -> Dict[str, Any]:
-        """獲取單個路線的站點"""
-        unique_route_id = f"{company}_{route_id}_{direction[0].upper()}"
-        
+    def fetch_operator_route_stops(self, operator: PerRouteOperatorCollector, unique_route_id: str,
+                                   route_number: str, direction: str, fetch_key: Any) -> Dict[str, Any]:
+        """獲取單個路線方向的站點"""
         try:
-            # 獲取路線站點
-            stops_data, _ = self.fetch_json(
-                f"{self.ctb_base}/route-stop/{company}/{route_id}/{direction}",
-                f"{company} {route_id} {direction}"
-            )
+            raw_stops = operator.fetch_route_stops(self, fetch_key)
             
-            if not stops_data.get('data'):
+            if not raw_stops:
                 return {'route_id': unique_route_id, 'stops': []}
             
             route_stops = []
             new_stops = []
             
-            for stop_info in stops_data['data']:
-                stop_id = stop_info['stop']
-                sequence = stop_info['seq']
-                
+            for stop_id, sequence, stop_info in raw_stops:
                 route_stops.append({
                     'stop_id': stop_id,
                     'sequence': sequence
                 })
                 
                 # 檢查是否需要獲取站點詳情
-                if stop_id not in self.stop_cache:
-                    new_stops.append(stop_id)
+                with self.data_lock:
+                    is_new = stop_id not in self.stop_cache
                     self.stop_cache.add(stop_id)
+
+                if not is_new:
+                    continue
+                if stop_info is not None:
+                    self.add_stop(stop_id, stop_info)
+                else:
+                    new_stops.append(stop_id)
             
             # 並行獲取新站點詳情
             if new_stops:
-                stop_details = self.fetch_stop_details_concurrent(company, new_stops)
+                stop_details = self.fetch_stop_details_concurrent(operator, new_stops)
                 
-                with self.data_lock:
-                    for stop_detail in stop_details:
-                        if stop_detail:
-                            self.bus_data['stops'][stop_detail['stop_id']] = stop_detail
+                for stop_detail in stop_details:
+                    if stop_detail:
+                        self.add_stop(stop_detail['stop_id'], stop_detail)
             
             return {
                 'route_id': unique_route_id,
@@ -353,32 +1270,22 @@ class OptimizedConcurrentBusDataCollector:
             }
             
         except Exception as e:
-            print(f"❌ Error processing {company} {route_id} {direction}: {e}")
+            logging.error(f"❌ Error processing {operator.company} {route_number} {direction}: {e}",
+                          extra={'fields': {'route_id': unique_route_id}})
             return {'route_id': unique_route_id, 'stops': []}
     
-    def fetch_stop_details_concurrent(self, company: str, stop_ids: List[str]) -> List[Dict[str, Any]]:
+    def fetch_stop_details_concurrent(self, operator: PerRouteOperatorCollector, stop_ids: List[str]) -> List[Dict[str, Any]]:
         """並行獲取站點詳情"""
         results = []
         
         def fetch_single_stop(stop_id):
-            stop_detail, _ = self.fetch_json(
-                f"{self.ctb_base}/stop/{stop_id}",
-                f"{company} stop {stop_id}"
-            )
-            
-            if stop_detail.get('data'):
-                stop_data = stop_detail['data']
-                return {
-                    'stop_id': stop_id,
-                    'name_tc': stop_data['name_tc'],
-                    'name_en': stop_data['name_en'],
-                    'latitude': float(stop_data['lat']),
-                    'longitude': float(stop_data['long']),
-                    'company': company
-                }
+            stop_info = operator.fetch_stop(self, stop_id)
+            if stop_info:
+                return {'stop_id': stop_id, **stop_info}
             return None
         
         with ThreadPoolExecutor(max_workers=5) as executor:
+            fetch_single_stop = bind_stage(fetch_single_stop)
             futures = {executor.submit(fetch_single_stop, stop_id): stop_id for stop_id in stop_ids}
             
             for future in as_completed(futures):
@@ -388,103 +1295,97 @@ class OptimizedConcurrentBusDataCollector:
         
         return results
     
-    def collect_ctb_concurrent(self):
-        """CTB 並行收集"""
-        print("\n🚌 CTB Concurrent Collection")
+    def collect_per_route_operator(self, operator: PerRouteOperatorCollector) -> bool:
+        """逐條路線策略並行收集 (例如 CTB)"""
+        company = operator.company
+        print(f"\n🚌 {company} Concurrent Collection")
         print("=" * 40)
         
         start_time = time.time()
         
-        # 獲取 CTB 路線列表
-        print("📋 Fetching CTB routes...")
-        ctb_routes_data, _ = self.fetch_json(f"{self.ctb_base}/route/CTB", "CTB routes")
+        # 獲取路線列表
+        print(f"📋 Fetching {company} routes...")
+        routes = operator.fetch_route_list(self)
         
-        if not ctb_routes_data.get('data'):
-            print("❌ No CTB routes found")
+        if not routes:
+            print(f"❌ No {company} routes found")
             return False
         
-        routes = ctb_routes_data['data']
-        print(f"✅ Found {len(routes)} CTB routes")
+        print(f"✅ Found {len(routes)} {company} routes")
         
-        # 創建任務列表 (每個路線的兩個方向)
+        # 創建任務列表 (每個路線的每個方向)
         tasks = []
-        for route_info in routes:
-            route_id = route_info['route']
-            
-            # 添加路線資料
-            for direction, dir_code in [('inbound', 'I'), ('outbound', 'O')]:
-                unique_route_id = f"CTB_{route_id}_{dir_code}"
-                
-                with self.data_lock:
-                    self.bus_data['routes'][unique_route_id] = {
-                        'route_number': route_id,
-                        'company': 'CTB',
-                        'direction': direction,
-                        'origin_tc': route_info['orig_tc'],
-                        'origin_en': route_info['orig_en'],
-                        'dest_tc': route_info['dest_tc'],
-                        'dest_en': route_info['dest_en']
-                    }
-                
-                tasks.append(('CTB', route_id, direction))
+        for raw_route in routes:
+            for route_number, direction, fetch_key in operator.expand_route(raw_route):
+                unique_route_id = operator.route_id_for(raw_route, route_number, direction)
+                self.add_route(unique_route_id, operator.map_route(raw_route, direction))
+                tasks.append((unique_route_id, route_number, direction, fetch_key))
         
         print(f"📊 Processing {len(tasks)} route directions with ThreadPool...")
         
-        # 並行處理 CTB 路線
+        # 並行處理路線 (進度訊息按時間限流)
         successful_routes = 0
-        with ThreadPoolExecutor(max_workers=10) as executor:
+        progress = ProgressReporter(company, len(tasks), float(os.getenv('LOG_PROGRESS_SECONDS', '5')))
+        fetch_route_stops = bind_stage(self.fetch_operator_route_stops)
+        with ThreadPoolExecutor(max_workers=self.route_workers or operator.max_workers) as executor:
             # 提交所有任務
             future_to_task = {
-                executor.submit(self.fetch_ctb_route_stops, company, route_id, direction): (company, route_id, direction)
-                for company, route_id, direction in tasks
+                executor.submit(fetch_route_stops, operator, unique_route_id, route_number, direction, fetch_key): unique_route_id
+                for unique_route_id, route_number, direction, fetch_key in tasks
             }
             
             # 處理結果
-            for i, future in enumerate(as_completed(future_to_task)):
-                if i % 50 == 0:
-                    print(f"   Progress: {i}/{len(tasks)} ({i/len(tasks)*100:.1f}%)")
-                
+            for future in as_completed(future_to_task):
+                progress.advance()
                 try:
                     result = future.result()
                     if result['stops']:
-                        with self.data_lock:
-                            self.bus_data['route_stops'][result['route_id']] = result['stops']
+                        self.add_route_stops(result['route_id'], result['stops'])
                         successful_routes += 1
                 except Exception as e:
                     task = future_to_task[future]
-                    print(f"❌ Failed {task}: {e}")
+                    logging.error(f"❌ Failed {task}: {e}")
         
-        ctb_time = time.time() - start_time
-        print(f"✅ CTB Complete: {successful_routes} routes processed in {ctb_time:.2f}s")
+        elapsed = time.time() - start_time
+        print(f"✅ {company} Complete: {successful_routes} routes processed in {elapsed:.2f}s")
         
         return successful_routes > 0
     
+    def carry_over_operators(self, existing_data: Dict[str, Any], companies: List[str]) -> int:
+        """
+        部分收集：沿用現有 bus_data 中指定營運商的路線、站點及路線站點 (不重新請求 API)
+        返回沿用的路線數量
+        """
+        prefixes = tuple(f"{company}_" for company in companies)
+        carried_routes = {route_id: route_info for route_id, route_info in existing_data.get('routes', {}).items()
+                          if route_id.startswith(prefixes)}
+
+        for route_id, route_info in carried_routes.items():
+            self.add_route(route_id, route_info)
+        for stop_id, stop_info in existing_data.get('stops', {}).items():
+            if stop_info.get('company') in companies:
+                self.add_stop(stop_id, stop_info)
+                self.stop_cache.add(stop_id)
+        for route_id, stops in existing_data.get('route_stops', {}).items():
+            if route_id in carried_routes:
+                self.add_route_stops(route_id, stops)
+
+        return len(carried_routes)
+
     def create_reverse_mapping(self):
-        """創建站點→路線反向映射"""
-        print("\n🔄 Creating stop-to-routes mapping...")
-        
-        for route_id, stops in self.bus_data['route_stops'].items():
-            route_info = self.bus_data['routes'][route_id]
-            
-            for stop_info in stops:
-                stop_id = stop_info['stop_id']
-                
-                if stop_id not in self.bus_data['stop_routes']:
-                    self.bus_data['stop_routes'][stop_id] = []
-                
-                self.bus_data['stop_routes'][stop_id].append({
-                    'route_number': route_info['route_number'],
-                    'company': route_info['company'],
-                    'direction': route_info['direction'],
-                    'destination': route_info['dest_tc'],
-                    'sequence': stop_info['sequence'],
-                    'route_id': route_id
-                })
-        
+        """完成站點→路線反向映射 (映射已在收集時增量建立)"""
+        print("\n🔄 Finalizing stop-to-routes mapping...")
+
+        if self.unmapped_routes:
+            print(f"⚠️  {len(self.unmapped_routes)} route-stop lists have no route info (examples: {self.unmapped_routes[:5]})")
+
         print(f"✅ Created mappings for {len(self.bus_data['stop_routes'])} stops")
 
-    def validate_data(self) -> bool:
-        """Enhanced validation with comprehensive checks and detailed reporting"""
+    def validate_data(self, report_path: Optional[Path] = None) -> bool:
+        """
+        Enhanced validation with comprehensive checks and detailed reporting
+        report_path: 驗證報告寫入位置 (None 則只輸出到日誌)
+        """
         logging.info("🔍 Validating collected data with enhanced checks...")
         errors = []
         warnings = []
@@ -515,16 +1416,15 @@ class OptimizedConcurrentBusDataCollector:
         if not min_stops_check:
             errors.append(f"Too few stops: {len(self.bus_data['stops'])} (expected ≥5000)")
 
-        # Check 2: Required fields completeness
-        missing_fields_count = 0
+        acc = self.validation_acc
+
+        # Check 2: Required fields completeness (accumulated in add_route)
+        missing_fields_count = sum(len(fields) for fields in acc['missing_fields'].values())
         missing_field_examples = []
-        for route_id, route_info in self.bus_data['routes'].items():
-            required_fields = ['route_number', 'company', 'direction', 'origin_tc', 'dest_tc']
-            for field in required_fields:
-                if not route_info.get(field) or route_info.get(field) == '':
-                    missing_fields_count += 1
-                    if len(missing_field_examples) < 5:
-                        missing_field_examples.append(f"{route_id}.{field}")
+        for route_id, fields in acc['missing_fields'].items():
+            for field in fields:
+                if len(missing_field_examples) < 5:
+                    missing_field_examples.append(f"{route_id}.{field}")
 
         validation_report['checks']['required_fields'] = {
             'missing_count': missing_fields_count,
@@ -553,27 +1453,9 @@ class OptimizedConcurrentBusDataCollector:
         elif len(routes_with_no_stops) > 0:
             warnings.append(f"{len(routes_with_no_stops)} routes have no stops (within threshold)")
 
-        # Check 4: Coordinate validity (Hong Kong bounds + NaN/Infinity check)
-        invalid_coords = []
-        nan_coords = []
-        for stop_id, stop_info in self.bus_data['stops'].items():
-            lat = stop_info['latitude']
-            lon = stop_info['longitude']
-
-            # Check for NaN or Infinity
-            import math
-            if math.isnan(lat) or math.isnan(lon) or math.isinf(lat) or math.isinf(lon):
-                nan_coords.append(f"{stop_id} (NaN/Inf)")
-                continue
-
-            # Check for zero coordinates
-            if lat == 0.0 or lon == 0.0:
-                invalid_coords.append(f"{stop_id} (0.0)")
-                continue
-
-            # Check Hong Kong geographic bounds
-            if not (22.0 <= lat <= 22.7 and 113.8 <= lon <= 114.5):
-                invalid_coords.append(f"{stop_id} ({lat}, {lon})")
+        # Check 4: Coordinate validity (Hong Kong bounds + NaN/Infinity, accumulated in add_stop)
+        invalid_coords = list(acc['invalid_coords'].values())
+        nan_coords = list(acc['nan_coords'].values())
 
         total_invalid = len(invalid_coords) + len(nan_coords)
         coord_check = total_invalid == 0
@@ -602,12 +1484,8 @@ class OptimizedConcurrentBusDataCollector:
         if not orphaned_stops_check:
             warnings.append(f"{len(orphaned_stops)} stops have no associated routes")
 
-        # Check 6: Direction consistency
-        invalid_directions = []
-        for route_id, route_info in self.bus_data['routes'].items():
-            direction = route_info.get('direction')
-            if direction not in ['inbound', 'outbound']:
-                invalid_directions.append(f"{route_id}: {direction}")
+        # Check 6: Direction consistency (accumulated in add_route)
+        invalid_directions = [f"{route_id}: {direction}" for route_id, direction in acc['invalid_directions'].items()]
 
         direction_check = len(invalid_directions) == 0
         validation_report['checks']['direction_consistency'] = {
@@ -618,12 +1496,8 @@ class OptimizedConcurrentBusDataCollector:
         if not direction_check:
             errors.append(f"{len(invalid_directions)} routes with invalid direction (examples: {invalid_directions[:10]})")
 
-        # Check 7: Company field validity
-        invalid_companies = []
-        for route_id, route_info in self.bus_data['routes'].items():
-            company = route_info.get('company')
-            if company not in ['KMB', 'CTB', 'NWFB']:
-                invalid_companies.append(f"{route_id}: {company}")
+        # Check 7: Company field validity (accumulated in add_route)
+        invalid_companies = [f"{route_id}: {company}" for route_id, company in acc['invalid_companies'].items()]
 
         company_check = len(invalid_companies) == 0
         validation_report['checks']['company_validity'] = {
@@ -634,17 +1508,27 @@ class OptimizedConcurrentBusDataCollector:
         if not company_check:
             errors.append(f"{len(invalid_companies)} routes with invalid company (examples: {invalid_companies[:10]})")
 
+        # Check 8: stop_routes 與 route_stops 一致 (每個站點的 (route_id, sequence) 集合)
+        mismatched_stops = stop_routes_mismatches(self.bus_data)
+
+        stop_routes_check = len(mismatched_stops) == 0
+        validation_report['checks']['stop_routes_match'] = {
+            'mismatched_count': len(mismatched_stops),
+            'examples': mismatched_stops[:10],
+            'status': 'PASS' if stop_routes_check else 'FAIL'
+        }
+        if not stop_routes_check:
+            errors.append(f"{len(mismatched_stops)} stops whose stop_routes do not match route_stops (examples: {mismatched_stops[:10]})")
+
         # Save validation report
         validation_report['warnings'] = warnings
         validation_report['errors'] = errors
         validation_report['status'] = 'PASS' if len(errors) == 0 else 'FAIL'
 
-        # Get output directory
-        output_dir = os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))
-        report_path = Path(output_dir) / 'validation_report.json'
-        with open(report_path, 'w', encoding='utf-8') as f:
-            json.dump(validation_report, f, indent=2, ensure_ascii=False)
-        logging.info(f"📄 Validation report saved: {report_path}")
+        if report_path is not None:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(validation_report, f, indent=2, ensure_ascii=False)
+            logging.info(f"📄 Validation report saved: {report_path}")
 
         # Report results
         if errors:
@@ -665,6 +1549,13 @@ class OptimizedConcurrentBusDataCollector:
         logging.info(f"   Warnings: {len(warnings)}")
         return True
 
+    def summary_companies(self) -> List[str]:
+        """本次收集或沿用的營運商 (部分收集時包括沿用的營運商)"""
+        companies = list(self.operators)
+        companies += [company for company in OPERATOR_COLLECTORS
+                      if company not in companies and self.company_route_counts.get(company)]
+        return companies
+
     def finalize_and_save(self, filename: str = "bus_data.json") -> str:
         """完成並保存數據"""
         logging.info("📊 Finalizing data...")
@@ -682,8 +1573,10 @@ class OptimizedConcurrentBusDataCollector:
             'total_routes': len(self.bus_data['routes']),
             'total_stops': len(self.bus_data['stops']),
             'total_stop_route_mappings': len(self.bus_data['stop_routes']),
-            'kmb_routes': len([r for r in self.bus_data['routes'] if r.startswith('KMB')]),
-            'ctb_routes': len([r for r in self.bus_data['routes'] if r.startswith('CTB')]),
+            'kmb_routes': self.company_route_counts['KMB'],
+            'ctb_routes': self.company_route_counts['CTB'],
+            **{f"{company.lower()}_routes": self.company_route_counts[company]
+               for company in self.summary_companies() if company not in ('KMB', 'CTB')},
             'api_calls_made': self.stats['api_calls_made'],
             'success_rate': f"{(self.stats['successful_calls']/self.stats['api_calls_made']*100):.1f}%" if self.stats['api_calls_made'] > 0 else "0%"
         }
@@ -691,8 +1584,10 @@ class OptimizedConcurrentBusDataCollector:
         summary = self.bus_data['summary']
         logging.info("📈 Final Statistics:")
         logging.info(f"   🚌 Total Routes: {summary['total_routes']:,}")
-        logging.info(f"      ├─ KMB: {summary['kmb_routes']:,}")
-        logging.info(f"      └─ CTB: {summary['ctb_routes']:,}")
+        companies = ['KMB', 'CTB'] + [company for company in self.summary_companies() if company not in ('KMB', 'CTB')]
+        for i, company in enumerate(companies):
+            branch = '└─' if i == len(companies) - 1 else '├─'
+            logging.info(f"      {branch} {company}: {summary[f'{company.lower()}_routes']:,}")
         logging.info(f"   📍 Total Stops: {summary['total_stops']:,}")
         logging.info(f"   🗺️  Stop-Route Mappings: {summary['total_stop_route_mappings']:,}")
         logging.info(f"   📡 API Calls: {summary['api_calls_made']:,} (Success: {summary['success_rate']})")
@@ -701,8 +1596,7 @@ class OptimizedConcurrentBusDataCollector:
         logging.info(f"💾 Saving to {output_file}...")
         start_time = time.time()
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.bus_data, f, ensure_ascii=False, indent=2)
+        write_bus_data(self.bus_data, output_file)
 
         save_time = time.time() - start_time
 
@@ -714,167 +1608,398 @@ class OptimizedConcurrentBusDataCollector:
         return str(output_file)
 
     def create_backup(self, data_file: str) -> bool:
-        """Create backup of previous bus_data.json with automatic cleanup"""
+        """Back up the previous bus_data.json and its metadata into the deduplicated backup store"""
         try:
             data_path = Path(data_file)
             if not data_path.exists():
                 logging.info("ℹ️  No existing data file to backup")
                 return True
 
-            # Get backup directory
-            backup_dir = data_path.parent / 'backup'
-            backup_dir.mkdir(exist_ok=True)
+            metadata_path = data_path.parent / 'bus_data_metadata.json'
+            label = {}
+            if metadata_path.exists():
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                label = {'version': metadata.get('version'), 'generated_at': metadata.get('generated_at')}
 
-            # Create timestamped backup
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = backup_dir / f"bus_data_{timestamp}.json"
+            store = BackupStore(data_path.parent / 'backup')
+            start_time = time.time()
+            version = store.backup({
+                'bus_data.json': data_path,
+                'bus_data_metadata.json': metadata_path
+            }, label=label)
 
-            # Copy file
-            import shutil
-            shutil.copy2(data_path, backup_file)
-            logging.info(f"💾 Backup created: {backup_file}")
+            if version is None:
+                logging.info("ℹ️  Data unchanged since last backup, no new version created")
+                return True
 
-            # Cleanup old backups (keep last 7)
-            backups = sorted(backup_dir.glob('bus_data_*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
-            if len(backups) > 7:
-                for old_backup in backups[7:]:
-                    old_backup.unlink()
-                    logging.info(f"🗑️  Removed old backup: {old_backup.name}")
+            stats = version['stats']
+            logging.info(f"💾 Backup version {version['id']} created in {time.time() - start_time:.2f}s")
+            logging.info(f"   Chunks: {stats['new_chunks']}/{stats['total_chunks']} new, "
+                         f"{stats['stored_bytes']:,} bytes written for {stats['original_bytes']:,} bytes of data")
+            for removed_id in stats['removed_versions']:
+                logging.info(f"🗑️  Removed old backup version: {removed_id}")
 
-            logging.info(f"✅ Backup complete (keeping {min(len(backups), 7)} backups)")
+            logging.info(f"✅ Backup complete (keeping {min(len(store.list_versions()), store.keep_versions)} versions)")
             return True
 
         except Exception as e:
             logging.error(f"⚠️  Backup failed: {e}")
             return False
 
-    def generate_metadata(self, data_file: str) -> str:
+    def generate_metadata(self, data_file: str, artifacts: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
         """Generate metadata file with checksums for version control"""
-        import hashlib
-
-        logging.info("📋 Generating metadata file...")
-
-        data_path = Path(data_file)
-        if not data_path.exists():
-            logging.error(f"Data file not found: {data_file}")
-            return ""
-
-        # Calculate checksums
-        md5_hash = hashlib.md5()
-        sha256_hash = hashlib.sha256()
-
-        with open(data_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_hash.update(chunk)
-                sha256_hash.update(chunk)
-
-        md5_checksum = md5_hash.hexdigest()
-        sha256_checksum = sha256_hash.hexdigest()
-
-        # Read data for summary
-        with open(data_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Get file size
-        file_size = data_path.stat().st_size
-
-        # Create metadata
-        metadata = {
-            'version': data.get('version'),
-            'generated_at': data.get('generated_at'),
-            'file_size_bytes': file_size,
-            'md5_checksum': md5_checksum,
-            'sha256_checksum': sha256_checksum,
-            'summary': {
-                'total_routes': data.get('summary', {}).get('total_routes', 0),
-                'total_stops': data.get('summary', {}).get('total_stops', 0),
-                'total_mappings': data.get('summary', {}).get('total_stop_route_mappings', 0),
-                'companies': ['KMB', 'CTB', 'NWFB']
-            },
-            'download_url': f"gs://{os.getenv('FIREBASE_STORAGE_BUCKET', 'your-bucket.appspot.com')}/bus_data.json"
+        return generate_metadata_file(data_file, artifacts)
+
+def stop_routes_mismatches(bus_data: Dict[str, Any]) -> List[str]:
+    """
+    比較 stop_routes 與由 route_stops 推算的反向映射，返回不一致的站點 ID
+    (只計算有路線資料的 route_stops，與收集時 add_route_stops 的規則相同)
+    """
+    routes = bus_data.get('routes', {})
+    expected = defaultdict(set)
+    for route_id, stops in bus_data.get('route_stops', {}).items():
+        if route_id in routes:
+            for stop in stops:
+                expected[stop['stop_id']].add((route_id, stop['sequence']))
+
+    actual = {stop_id: {(entry.get('route_id'), entry.get('sequence')) for entry in entries}
+              for stop_id, entries in bus_data.get('stop_routes', {}).items()}
+    return sorted(stop_id for stop_id in expected.keys() | actual.keys()
+                  if expected.get(stop_id, set()) != actual.get(stop_id, set()))
+
+
+def write_bus_data(bus_data: Dict[str, Any], output_file: Path):
+    """
+    以固定格式寫出 bus_data.json：鍵排序，stop_routes 每個站點的路線按 route_id 及 sequence 排序
+    相同數據不論線程完成次序都寫出相同的位元組，備份庫的分塊因此可以重用
+    """
+    for routes in bus_data.get('stop_routes', {}).values():
+        routes.sort(key=lambda route: (route.get('route_id', ''), route.get('sequence', 0)))
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(bus_data, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def generate_metadata_file(data_file: str, artifacts: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """
+    Generate metadata file with checksums for version control
+    artifacts: 本次衍生產物的記錄 (None = 讀取 derived_artifacts.json 清單)
+    """
+    logging.info("📋 Generating metadata file...")
+
+    data_path = Path(data_file)
+    if not data_path.exists():
+        logging.error(f"Data file not found: {data_file}")
+        return ""
+
+    # Calculate checksums
+    md5_hash = hashlib.md5()
+    sha256_hash = hashlib.sha256()
+
+    with open(data_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            md5_hash.update(chunk)
+            sha256_hash.update(chunk)
+
+    md5_checksum = md5_hash.hexdigest()
+    sha256_checksum = sha256_hash.hexdigest()
+
+    # Read data for summary (bus_data.bin 與此檔案一致時不需解析整份 JSON)
+    from bus_data_reader import load_bus_data_header, summary_companies
+    data = load_bus_data_header(data_path, sha256_checksum)
+
+    # Get file size
+    file_size = data_path.stat().st_size
+
+    # Create metadata
+    metadata = {
+        'version': data.get('version'),
+        'generated_at': data.get('generated_at'),
+        'file_size_bytes': file_size,
+        'md5_checksum': md5_checksum,
+        'sha256_checksum': sha256_checksum,
+        'summary': {
+            'total_routes': data.get('summary', {}).get('total_routes', 0),
+            'total_stops': data.get('summary', {}).get('total_stops', 0),
+            'total_mappings': data.get('summary', {}).get('total_stop_route_mappings', 0),
+            'companies': summary_companies(data.get('summary', {}))
+        },
+        'download_url': f"gs://{os.getenv('FIREBASE_STORAGE_BUCKET', 'your-bucket.appspot.com')}/bus_data.json"
+    }
+
+    # 衍生產物的建立耗時 (cached = 輸入未變，沿用上次的檔案)
+    if artifacts is None:
+        from derived_artifacts import load_manifest
+        artifacts = load_manifest(data_path.parent)
+    if artifacts:
+        metadata['derived_artifacts'] = {
+            name: {key: record[key] for key in ('file', 'file_size_bytes', 'build_seconds', 'cached', 'input_sha256', 'error')
+                   if key in record}
+            for name, record in artifacts.items()
         }
 
-        # Save metadata file
-        metadata_file = data_path.parent / 'bus_data_metadata.json'
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+    # Save metadata file
+    metadata_file = data_path.parent / 'bus_data_metadata.json'
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
 
-        logging.info(f"✅ Metadata generated: {metadata_file}")
-        logging.info(f"   MD5: {md5_checksum}")
-        logging.info(f"   SHA256: {sha256_checksum[:16]}...")
-        logging.info(f"   File size: {file_size:,} bytes ({file_size/1024/1024:.2f} MB)")
+    logging.info(f"✅ Metadata generated: {metadata_file}")
+    logging.info(f"   MD5: {md5_checksum}")
+    logging.info(f"   SHA256: {sha256_checksum[:16]}...")
+    logging.info(f"   File size: {file_size:,} bytes ({file_size/1024/1024:.2f} MB)")
 
-        return str(metadata_file)
+    return str(metadata_file)
 
-def main():
-    """主執行函數 with Firebase upload"""
-    # Setup logging first
-    logger = setup_logging()
 
-    logger.info("=" * 70)
-    logger.info("🚀 Hong Kong Bus Data Collection with Firebase Upload")
-    logger.info("⚡ KMB: Batch API + CTB: Concurrent + Firebase Storage")
-    logger.info("=" * 70)
+SUBCOMMANDS = ('collect', 'validate', 'metadata', 'publish', 'diff')
 
-    start_time = time.time()
-    firebase_enabled = False
 
-    try:
-        # Initialize Firebase (if available)
-        if FIREBASE_AVAILABLE:
-            firebase_enabled = initialize_firebase()
-            if not firebase_enabled:
-                logger.warning("⚠️ Firebase initialization failed. Data will be saved locally only.")
-        else:
-            logger.warning("⚠️ Firebase libraries not installed. Data will be saved locally only.")
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # 沒有子命令時 (例如現有的 cron 設定) 預設為 collect
+    if not argv or (argv[0] not in SUBCOMMANDS and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'collect')
 
-        # Create collector
-        collector = OptimizedConcurrentBusDataCollector()
+    parser = argparse.ArgumentParser(description='Hong Kong bus data collection with Firebase upload')
+    subparsers = parser.add_subparsers(dest='command', required=True)
 
-        # 1. KMB 批量收集
-        logger.info("\n" + "=" * 50)
-        if not collector.collect_kmb_batch():
-            logger.error("❌ KMB collection failed")
-            sys.exit(2)
+    collect_parser = subparsers.add_parser('collect', help='Collect, validate, save and upload (default)')
+    replay_group = collect_parser.add_mutually_exclusive_group()
+    replay_group.add_argument('--record', metavar='ARCHIVE',
+                              help='Record every API response into a compressed archive (.zip)')
+    replay_group.add_argument('--replay', metavar='ARCHIVE',
+                              help='Serve API responses from a recorded archive (no network, no upload)')
+    collect_parser.add_argument('--replay-latency', action='store_true',
+                                help='With --replay, sleep for each response\'s recorded latency')
+    collect_parser.add_argument('--no-upload', action='store_true',
+                                help='Save locally only (Firebase is not initialized)')
 
-        # 2. CTB 並行收集
-        logger.info("\n" + "=" * 50)
-        if not collector.collect_ctb_concurrent():
-            logger.error("❌ CTB collection failed")
-            sys.exit(2)
+    validate_parser = subparsers.add_parser('validate', help='Validate an existing bus_data.json')
+    validate_parser.add_argument('data_file', nargs='?', help='Default: OUTPUT_DIRECTORY/bus_data.json')
+    validate_parser.add_argument('--report', metavar='PATH',
+                                 help='Also write the JSON report here (validation_report.json is left untouched)')
 
-        # 3. 創建反向映射
-        logger.info("\n" + "=" * 50)
-        collector.create_reverse_mapping()
+    metadata_parser = subparsers.add_parser('metadata', help='Regenerate bus_data_metadata.json')
+    metadata_parser.add_argument('data_file', nargs='?', help='Default: OUTPUT_DIRECTORY/bus_data.json')
 
-        # 4. 驗證資料
-        logger.info("\n" + "=" * 50)
-        if not collector.validate_data():
-            logger.error("❌ Data validation failed")
-            sys.exit(2)
+    publish_parser = subparsers.add_parser('publish', help='Upload an existing bus_data.json and its metadata')
+    publish_parser.add_argument('data_file', nargs='?', help='Default: OUTPUT_DIRECTORY/bus_data.json')
 
-        # 5. 備份舊數據
-        logger.info("\n" + "=" * 50)
-        output_dir = os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))
-        data_file_path = Path(output_dir) / 'bus_data.json'
+    diff_parser = subparsers.add_parser('diff', help='Compare two versions of bus_data.json')
+    diff_parser.add_argument('old', help="Old file, or a backup version ID / data version / 'latest'")
+    diff_parser.add_argument('new', nargs='?', help='New file (default: OUTPUT_DIRECTORY/bus_data.json)')
+    diff_parser.add_argument('--limit', type=int, default=10, help='Examples shown per section (default: 10)')
+
+    return parser.parse_args(argv)
+
+class RunLock:
+    """
+    以 flock 序列化收集執行 (cron、手動執行及 daemon 共用同一個鎖文件)
+    進程結束時鎖自動釋放，不會留下失效的鎖
+    """
+
+    def __init__(self, lock_path: Optional[str] = None):
+        self.lock_path = Path(lock_path or os.getenv(
+            'COLLECTOR_LOCK_FILE', str(Path(os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))) / '.collector.lock')))
+        self.handle = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        import fcntl
+
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{os.getpid()}\n")
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def release(self):
+        if self.handle is not None:
+            import fcntl
+
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+    def holder_pid(self) -> str:
+        try:
+            return self.lock_path.read_text().strip() or '?'
+        except OSError:
+            return '?'
+
+
+def initialize_upload(logger: logging.Logger, replay: bool = False) -> bool:
+    """初始化上傳後端，返回是否啟用上傳 (replay 永不上傳)"""
+    if replay:
+        logger.info("📼 Replay mode: Firebase upload disabled")
+        return False
+    if os.getenv('STORAGE_BACKEND', 'firebase').lower() == 'local':
+        logger.info(f"📁 Local storage backend: {os.getenv('LOCAL_STORAGE_DIR', 'storage/')}")
+        return True
+    if firebase_available():
+        if initialize_firebase():
+            return True
+        logger.warning("⚠️ Firebase initialization failed. Data will be saved locally only.")
+        return False
+    logger.warning("⚠️ Data will be saved locally only.")
+    return False
+
+
+def build_derived_artifacts(bus_data: Dict[str, Any], data_file: Path, metrics: CollectorMetrics) -> Dict[str, Dict[str, Any]]:
+    """
+    由已保存的數據建立衍生產物 (derived_artifacts：內容雜湊快取，多核時以進程池並行)
+    每個產物的耗時記錄為一個階段，返回 {名稱: 清單記錄} 供 metadata 使用
+    """
+    from derived_artifacts import build_artifacts
+
+    # 外層只計時 (不剖析)，避免與每個產物的剖析階段重疊
+    start_time = time.time()
+    with stage_tag('derived_artifacts'):
+        records = build_artifacts(bus_data, data_file, stage=metrics.stage)
+    metrics.record_stage('derived_artifacts', time.time() - start_time)
+    for name, record in records.items():
+        if not record.get('cached') and 'build_seconds' in record and name not in metrics.stages:
+            metrics.record_stage(name, record['build_seconds'])
+    return records
+
+
+def run_collection_pipeline(collector: OptimizedConcurrentBusDataCollector, metrics: CollectorMetrics,
+                            logger: logging.Logger, upload_enabled: bool) -> Tuple[int, str]:
+    """
+    收集 → 反向映射 → 驗證 → 備份 → 保存 → 衍生產物 → metadata → 上傳
+    返回 (exit code, 數據文件路徑)；0 成功、1 上傳失敗、2 收集或驗證失敗
+    """
+    # 1-2. 所有營運商並行收集 (KMB 批量 + CTB 並行 + 其他插件)
+    logger.info("\n" + "=" * 50)
+    with metrics.stage('collect'):
+        operator_results = collector.collect_all_operators()
+    collector.close()
+    failed_operators = [company for company, ok in operator_results.items() if not ok]
+    if failed_operators:
+        logger.error(f"❌ Collection failed for: {', '.join(failed_operators)}")
+        return 2, ''
+
+    # 3. 創建反向映射
+    logger.info("\n" + "=" * 50)
+    with metrics.stage('reverse_mapping'):
+        collector.create_reverse_mapping()
+
+    # 4. 驗證資料
+    logger.info("\n" + "=" * 50)
+    with metrics.stage('validate'):
+        valid = collector.validate_data(Path(os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))) / 'validation_report.json')
+    if not valid:
+        logger.error("❌ Data validation failed")
+        return 2, ''
+
+    # 5. 備份舊數據
+    logger.info("\n" + "=" * 50)
+    output_dir = os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))
+    data_file_path = Path(output_dir) / 'bus_data.json'
+    with metrics.stage('backup'):
         collector.create_backup(str(data_file_path))
 
-        # 6. 保存本地檔案
-        logger.info("\n" + "=" * 50)
+    # 6. 保存本地檔案
+    logger.info("\n" + "=" * 50)
+    with metrics.stage('save'):
         filename = collector.finalize_and_save()
 
-        # 7. 生成 metadata
+    # 7. 衍生產物 (二進制索引、轉乘圖、站點聚類圖塊、路線距離等；輸入未變時跳過，失敗不影響發佈)
+    logger.info("\n" + "=" * 50)
+    artifacts = build_derived_artifacts(collector.bus_data, Path(filename), metrics)
+
+    # 8. 生成 metadata (可直接讀取 bus_data.bin 的摘要；包括各衍生產物的建立耗時)
+    logger.info("\n" + "=" * 50)
+    with metrics.stage('metadata'):
+        metadata_file = collector.generate_metadata(filename, artifacts)
+
+    # 9. 上傳到 Firebase
+    if upload_enabled:
         logger.info("\n" + "=" * 50)
-        metadata_file = collector.generate_metadata(filename)
+        with metrics.stage('upload'):
+            uploaded = upload_to_firebase_storage(filename, metadata_file or None)
+        if not uploaded:
+            logger.error("❌ Firebase upload failed")
+            return 1, filename
+    else:
+        logger.warning("⚠️ Skipping Firebase upload (not configured)")
 
-        # 8. 上傳到 Firebase
-        if firebase_enabled:
-            logger.info("\n" + "=" * 50)
-            if not upload_to_firebase_storage(filename):
-                logger.error("❌ Firebase upload failed")
-                sys.exit(1)  # Exit with code 1 for upload failure
-        else:
-            logger.warning("⚠️ Skipping Firebase upload (not configured)")
+    return 0, filename
+
+
+def default_data_file() -> Path:
+    return Path(os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR))) / 'bus_data.json'
+
+
+def load_bus_data(data_file: Path) -> Dict[str, Any]:
+    with open(data_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def diff_bus_data(old_data: Dict[str, Any], new_data: Dict[str, Any]) -> Dict[str, Dict[str, List[str]]]:
+    """比較兩個版本的 routes / stops / route_stops：新增、刪除及內容改變的 ID"""
+    result = {}
+    for section in ('routes', 'stops', 'route_stops'):
+        old_section = old_data.get(section, {})
+        new_section = new_data.get(section, {})
+        result[section] = {
+            'added': sorted(new_section.keys() - old_section.keys()),
+            'removed': sorted(old_section.keys() - new_section.keys()),
+            'changed': sorted(key for key in new_section.keys() & old_section.keys()
+                              if new_section[key] != old_section[key])
+        }
+    return result
+
+
+def cmd_collect(args: argparse.Namespace) -> int:
+    """collect 子命令：完整收集流程"""
+    # Setup logging first
+    logger = setup_logging()
+
+    logger.info("=" * 70)
+    logger.info("🚀 Hong Kong Bus Data Collection with Firebase Upload")
+    logger.info("⚡ KMB: Batch API + CTB: Concurrent + Firebase Storage")
+    logger.info("=" * 70)
+
+    start_time = time.time()
+    firebase_enabled = False
+    collector = None
+    metrics = CollectorMetrics(profiler=StageProfiler.from_env())
+    exit_code = 2
+
+    # 同一時間只允許一個收集執行 (cron / 手動 / daemon)
+    run_lock = RunLock()
+    if not run_lock.acquire(blocking=False):
+        logger.info(f"⏳ Another collection is running (pid {run_lock.holder_pid()}), waiting for it to finish...")
+        run_lock.acquire()
+
+    try:
+        # Initialize Firebase (if available; replay and --no-upload runs never upload)
+        with metrics.stage('firebase_init'):
+            if args.no_upload and not args.replay:
+                logger.info("📁 --no-upload: data will be saved locally only")
+            else:
+                firebase_enabled = initialize_upload(logger, replay=bool(args.replay))
+
+        # Create collector
+        collector = OptimizedConcurrentBusDataCollector(
+            metrics=metrics,
+            record_path=args.record,
+            replay_path=args.replay,
+            replay_latency=args.replay_latency
+        )
+
+        exit_code, filename = run_collection_pipeline(collector, metrics, logger, firebase_enabled)
+        if exit_code != 0:
+            return exit_code
 
         # Success!
         total_time = time.time() - start_time
@@ -885,15 +2010,147 @@ def main():
             logger.info("☁️  Firebase: Uploaded successfully")
         logger.info("✅ Ready for iOS app integration!")
 
-        sys.exit(0)  # Success
+        return 0  # Success
 
     except KeyboardInterrupt:
         logger.warning("\n⏸️  Collection interrupted by user")
-        sys.exit(130)  # Standard exit code for SIGINT
+        exit_code = 130  # Standard exit code for SIGINT
+        return exit_code
 
     except Exception as e:
         logger.error(f"\n💥 Fatal error: {e}", exc_info=True)
-        sys.exit(2)  # General error
+        exit_code = 2  # General error
+        return exit_code
+
+    finally:
+        if collector is not None:
+            collector.close()
+        run_lock.release()
+
+        # 每次執行都寫出效能指標 (包括失敗的執行)
+        try:
+            with metrics.lock:
+                metrics.stages['total'] = time.time() - start_time
+            json_file, prom_file = metrics.write(exit_code)
+            logger.info(f"📊 Metrics written: {json_file}, {prom_file}")
+        except Exception as e:
+            logger.error(f"⚠️  Failed to write metrics: {e}")
+
+
+def cmd_validate(args: argparse.Namespace) -> int:
+    """
+    validate 子命令：以收集時相同的規則驗證現有的 bus_data.json (不需網絡及 Firebase)
+    - 檔案內容原樣驗證：不按營運商篩選，也不重新計算 stop_routes (不一致的站點會列出)
+    - 報告只輸出到日誌，或寫入 --report 指定的路徑 (不覆寫收集時的 validation_report.json)
+    """
+    setup_logging(log_to_file=False)
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    if not data_file.exists():
+        logging.error(f"❌ Data file not found: {data_file}")
+        return 2
+
+    data = load_bus_data(data_file)
+    collector = OptimizedConcurrentBusDataCollector()
+    collector.version = collector.bus_data['version'] = data.get('version')
+    for route_id, route_info in data.get('routes', {}).items():
+        collector.add_route(route_id, route_info)
+    for stop_id, stop_info in data.get('stops', {}).items():
+        collector.add_stop(stop_id, stop_info)
+    collector.bus_data['route_stops'] = data.get('route_stops', {})
+    collector.bus_data['stop_routes'] = data.get('stop_routes', {})
+    return 0 if collector.validate_data(Path(args.report) if args.report else None) else 2
+
+
+def cmd_metadata(args: argparse.Namespace) -> int:
+    """metadata 子命令：重新生成 bus_data_metadata.json"""
+    setup_logging(log_to_file=False)
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    return 0 if generate_metadata_file(str(data_file)) else 2
+
+
+def cmd_publish(args: argparse.Namespace) -> int:
+    """publish 子命令：上傳現有的 bus_data.json 及 metadata (metadata 不存在時先生成)"""
+    logger = setup_logging(log_to_file=False)
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    if not data_file.exists():
+        logger.error(f"❌ Data file not found: {data_file}")
+        return 2
+
+    run_lock = RunLock()
+    if not run_lock.acquire(blocking=False):
+        logger.info(f"⏳ Another collection is running (pid {run_lock.holder_pid()}), waiting for it to finish...")
+        run_lock.acquire()
+
+    try:
+        metadata_file = data_file.parent / 'bus_data_metadata.json'
+        if not metadata_file.exists() and not generate_metadata_file(str(data_file)):
+            return 2
+        if not initialize_upload(logger):
+            return 1
+        return 0 if upload_to_firebase_storage(str(data_file), str(metadata_file)) else 1
+    finally:
+        run_lock.release()
+
+
+def cmd_diff(args: argparse.Namespace) -> int:
+    """diff 子命令：比較兩個版本 (舊版本可為文件或備份版本)；有差異時返回 1"""
+    import tempfile
+
+    setup_logging(log_to_file=False)
+    new_file = Path(args.new) if args.new else default_data_file()
+    new_data = load_bus_data(new_file)
+
+    old_path = Path(args.old)
+    if old_path.exists():
+        old_data = load_bus_data(old_path)
+        old_label = str(old_path)
+    else:
+        store = BackupStore(default_data_file().parent / 'backup')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            try:
+                restored = store.restore(args.old, Path(tmp_dir))
+            except (KeyError, ValueError, OSError) as e:
+                logging.error(f"❌ Cannot load {args.old}: {e}")
+                return 2
+            old_data = load_bus_data(Path(restored['bus_data.json']))
+        old_label = f"backup {args.old}"
+
+    print(f"🔍 {old_label} (version {old_data.get('version')}) → {new_file} (version {new_data.get('version')})")
+    differences = diff_bus_data(old_data, new_data)
+    total = 0
+    for section, changes in differences.items():
+        counts = {kind: len(ids) for kind, ids in changes.items()}
+        total += sum(counts.values())
+        print(f"   {section}: +{counts['added']} -{counts['removed']} ~{counts['changed']}")
+        for kind, symbol in (('added', '+'), ('removed', '-'), ('changed', '~')):
+            for key in changes[kind][:args.limit]:
+                detail = ''
+                if kind == 'changed' and isinstance(new_data[section][key], dict):
+                    fields = [field for field in new_data[section][key]
+                              if new_data[section][key].get(field) != old_data[section][key].get(field)]
+                    detail = f" ({', '.join(fields)})"
+                print(f"      {symbol} {key}{detail}")
+
+    if total == 0:
+        print("✅ No differences")
+        return 0
+    return 1
+
+
+COMMANDS = {
+    'collect': cmd_collect,
+    'validate': cmd_validate,
+    'metadata': cmd_metadata,
+    'publish': cmd_publish,
+    'diff': cmd_diff,
+}
+
+
+def main():
+    """主執行函數：分派子命令 (預設 collect)"""
+    args = parse_args()
+    load_environment()
+    sys.exit(COMMANDS[args.command](args))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
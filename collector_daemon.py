@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+長期運行的收集 daemon (取代固定的 cron 全量收集)
+- 定期執行低成本的變更偵測探測 (probe)，只有上游數據改變時才收集
+- KMB 批量 API：以 ETag / Last-Modified 條件請求 (304 即未變)；伺服器不支援時比較 data 的指紋
+- CTB (及其他逐條路線營運商)：比較路線列表，並抽樣部分路線方向比較站點序列
+- 只有部分營運商改變時執行部分收集，其餘營運商沿用現有 bus_data.json
+- 超過 DAEMON_FULL_INTERVAL_HOURS 未全量收集時強制全量收集 (安全網)
+- 在多次探測及收集之間重用同一個 HTTP session，保持連線溫熱
+- 只有偵測到變更需要收集時才初始化上傳後端 (Firebase)；日誌附加到當日的 logs/collector_daemon_YYYYMMDD.log
+
+探測成本：KMB 批量 endpoint 沒有返回 ETag / Last-Modified 時，每次探測都要下載 route、stop 及 route-stop
+三個完整回應 (未壓縮約 7 MB) 才能比較指紋；每 30 分鐘一次即每日約 340 MB。
+有驗證標頭時自動改用條件請求 (304 不傳送內容)；流量受限時可調高 DAEMON_PROBE_INTERVAL_MINUTES
+- 與 cron / 手動執行共用同一個鎖文件，同一時間只有一個收集執行
+
+使用方式:
+  python3 collector_daemon.py                 # 持續運行
+  python3 collector_daemon.py --once          # 探測一次 (有變更時收集) 後退出，可由 cron 頻繁調用
+  python3 collector_daemon.py --once --full   # 立即全量收集
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+from collect_bus_data_optimized_concurrent import (
+    SCRIPT_DIR,
+    BulkOperatorCollector,
+    CollectorMetrics,
+    OptimizedConcurrentBusDataCollector,
+    PerRouteOperatorCollector,
+    RunLock,
+    StageProfiler,
+    create_http_session,
+    enabled_operators,
+    initialize_upload,
+    load_environment,
+    run_collection_pipeline,
+    setup_logging,
+)
+
+# 探測設定
+DEFAULT_PROBE_INTERVAL_MINUTES = 30
+DEFAULT_PROBE_SAMPLE = 20
+DEFAULT_FULL_INTERVAL_HOURS = 72  # 與原本 cron (每 3 日) 相同的全量收集安全網
+
+
+def payload_fingerprint(payload: Dict[str, Any]) -> str:
+    """API 回應 data 部分的指紋 (忽略每次請求都會改變的 generated_timestamp)"""
+    canonical = json.dumps(payload.get('data'), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DaemonState:
+    """探測基準 (每個 URL 的 ETag / Last-Modified / 指紋) 及上次收集時間，保存於 daemon_state.json"""
+
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self.data = {'validators': {}, 'last_full_run': None, 'last_run': None, 'last_probe': None}
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"⚠️  Ignoring unreadable daemon state {self.state_file}: {e}")
+
+    def save(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+    def full_run_due(self, full_interval_hours: float, data_generated_at: Optional[str] = None) -> bool:
+        """
+        距離上次全量收集是否已超過 full_interval_hours
+        daemon 未曾全量收集時以現有 bus_data.json 的 generated_at 為準；兩者都沒有 (或無法解析) 時視為到期
+        """
+        last_full_run = self.data.get('last_full_run') or data_generated_at
+        if not last_full_run:
+            return True
+        try:
+            last_full_run_at = datetime.fromisoformat(last_full_run)
+        except (TypeError, ValueError):
+            return True
+        return datetime.now() - last_full_run_at >= timedelta(hours=full_interval_hours)
+
+
+class ChangeProbe:
+    """
+    上游變更偵測
+    run() 返回 {'changed': [company, ...], 'reasons': {company: [...]}, 'validators': {url: {...}}}
+    validators 為新的探測基準，只在收集成功後才寫入 DaemonState (收集失敗時下次探測會再次偵測到變更)
+    """
+
+    def __init__(self, collector: OptimizedConcurrentBusDataCollector, state: DaemonState,
+                 sample_size: int = DEFAULT_PROBE_SAMPLE):
+        self.collector = collector
+        self.state = state
+        self.sample_size = sample_size
+        self.rng = random.Random()
+
+    def run(self, existing_data: Dict[str, Any]) -> Dict[str, Any]:
+        result = {'changed': [], 'reasons': {}, 'validators': {}}
+        for company, operator in self.collector.operators.items():
+            reasons = []
+            try:
+                if isinstance(operator, BulkOperatorCollector):
+                    reasons = self.probe_bulk_operator(operator, existing_data, result['validators'])
+                elif isinstance(operator, PerRouteOperatorCollector):
+                    reasons = self.probe_per_route_operator(operator, existing_data)
+            except Exception as e:
+                # 探測失敗 (上游暫時不可用) 不觸發收集，下次探測再試
+                logging.warning(f"⚠️  {company} probe failed: {e}")
+                continue
+
+            if reasons:
+                result['changed'].append(company)
+                result['reasons'][company] = reasons
+        return result
+
+    def probe_bulk_operator(self, operator: BulkOperatorCollector, existing_data: Dict[str, Any],
+                            new_validators: Dict[str, Any]) -> List[str]:
+        """批量端點條件請求：304 或指紋相同即未改變"""
+        reasons = []
+        has_existing = any(route_id.startswith(f"{operator.company}_") for route_id in existing_data.get('routes', {}))
+        if not has_existing:
+            reasons.append("no existing data")
+
+        for resource in ('route', 'stop', 'route-stop'):
+            url = f"{operator.base_url}/{resource}"
+            previous = self.state.data['validators'].get(url, {})
+
+            headers = {}
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+
+            start_time = time.time()
+            with self.collector.request_budget.slot(url):
+                response = self.collector.http.get(url, headers=headers, timeout=60)
+            self.collector.metrics.record_request(url, time.time() - start_time, len(response.content),
+                                                  response.status_code in (200, 304))
+
+            if response.status_code == 304:
+                continue
+            response.raise_for_status()
+
+            fingerprint = payload_fingerprint(response.json())
+            new_validators[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fingerprint': fingerprint
+            }
+            if not previous.get('fingerprint'):
+                # 沒有基準 (第一次探測)：無法確認現有數據與上游一致，視為改變；
+                # 基準與其他驗證標頭一樣只在收集成功後寫入
+                reasons.append(f"{resource}: no probe baseline")
+            elif previous['fingerprint'] != fingerprint:
+                reasons.append(f"{resource} changed")
+            else:
+                # 內容未變但驗證標頭可能已更新
+                self.state.data['validators'][url] = new_validators.pop(url)
+        return reasons
+
+    def probe_per_route_operator(self, operator: PerRouteOperatorCollector,
+                                 existing_data: Dict[str, Any]) -> List[str]:
+        """比較路線列表，並抽樣比較部分路線方向的站點序列"""
+        company = operator.company
+        existing_routes = existing_data.get('routes', {})
+        existing_route_stops = existing_data.get('route_stops', {})
+
+        raw_routes = operator.fetch_route_list(self.collector)
+        if not raw_routes:
+            raise RuntimeError(f"{company} route list unavailable")
+
+        reasons = []
+        tasks = []
+        probed_ids = set()
+        for raw_route in raw_routes:
+            for route_number, direction, fetch_key in operator.expand_route(raw_route):
+                route_id = operator.route_id_for(raw_route, route_number, direction)
+                probed_ids.add(route_id)
+                tasks.append((route_id, fetch_key))
+                if route_id in existing_routes and existing_routes[route_id] != operator.map_route(raw_route, direction):
+                    reasons.append(f"route {route_id} details changed")
+
+        existing_ids = {route_id for route_id in existing_routes if route_id.startswith(f"{company}_")}
+        added = probed_ids - existing_ids
+        removed = existing_ids - probed_ids
+        if added:
+            reasons.append(f"{len(added)} routes added (e.g. {sorted(added)[:3]})")
+        if removed:
+            reasons.append(f"{len(removed)} routes removed (e.g. {sorted(removed)[:3]})")
+        if reasons:
+            return reasons
+
+        # 抽樣比較站點序列 (每次抽不同的路線，長期覆蓋全部路線)
+        sample = self.rng.sample(tasks, min(self.sample_size, len(tasks)))
+
+        def probe_route(task):
+            route_id, fetch_key = task
+            probed = [(stop_id, sequence) for stop_id, sequence, _ in operator.fetch_route_stops(self.collector, fetch_key)]
+            probed.sort(key=lambda item: item[1])
+            return route_id, probed
+
+        with ThreadPoolExecutor(max_workers=max(1, min(operator.max_workers, len(sample)))) as executor:
+            for route_id, probed in executor.map(probe_route, sample):
+                existing = [(stop['stop_id'], stop['sequence']) for stop in existing_route_stops.get(route_id, [])]
+                if not probed and existing:
+                    continue  # 請求失敗與「站點被移除」無法區分，不作判斷
+                if probed != existing:
+                    reasons.append(f"stops of {route_id} changed")
+        return reasons
+
+
+class CollectorDaemon:
+    """探測 → (有變更時) 部分或全量收集 → 等待下一次探測"""
+
+    def __init__(self, logger: logging.Logger, probe_interval: float, sample_size: int,
+                 full_interval_hours: float):
+        self.logger = logger
+        self.probe_interval = probe_interval
+        self.sample_size = sample_size
+        self.full_interval_hours = full_interval_hours
+
+        self.output_dir = Path(os.getenv('OUTPUT_DIRECTORY', str(SCRIPT_DIR)))
+        self.data_file = self.output_dir / 'bus_data.json'
+        self.state = DaemonState(self.output_dir / 'daemon_state.json')
+        self.stop_event = threading.Event()
+
+        # 整個 daemon 生命週期共用的 HTTP session (探測與收集都重用溫熱的連線)
+        if os.getenv('HTTP_TRANSPORT', 'session') == 'session':
+            self.http = create_http_session(int(os.getenv('MAX_REQUESTS_PER_HOST', '20')))
+        else:
+            import requests
+            self.http = requests
+
+        self.upload_enabled: Optional[bool] = None   # 第一次收集時才初始化 (沒有變更的探測不需要 Firebase)
+
+        self._existing_data = None
+        self._existing_mtime = None
+
+    def load_existing_data(self) -> Optional[Dict[str, Any]]:
+        """現有 bus_data.json (文件未改變時沿用記憶體中的副本)"""
+        if not self.data_file.exists():
+            return None
+        mtime = self.data_file.stat().st_mtime
+        if self._existing_data is None or mtime != self._existing_mtime:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                self._existing_data = json.load(f)
+            self._existing_mtime = mtime
+        return self._existing_data
+
+    def run_cycle(self, force_full: bool = False) -> Optional[int]:
+        """執行一次探測 (及所需的收集)；返回收集的 exit code，沒有收集返回 None"""
+        run_lock = RunLock()
+        if not run_lock.acquire(blocking=False):
+            self.logger.info(f"⏳ Another collection is running (pid {run_lock.holder_pid()}), skipping this probe")
+            return None
+
+        try:
+            existing_data = self.load_existing_data()
+            operators = enabled_operators()
+
+            if existing_data is None:
+                self.logger.info("🆕 No existing bus_data.json, running full collection")
+                return self.collect(operators, None, full=True)
+            if force_full:
+                self.logger.info("🔁 Full collection requested")
+                return self.collect(operators, None, full=True)
+            if self.state.full_run_due(self.full_interval_hours, existing_data.get('generated_at')):
+                self.logger.info(f"🔁 No full collection for {self.full_interval_hours:g}h, running full collection")
+                return self.collect(operators, None, full=True)
+
+            # 變更偵測探測
+            probe_start = time.time()
+            probe_collector = OptimizedConcurrentBusDataCollector(operators=operators, http=self.http)
+            probe = ChangeProbe(probe_collector, self.state, self.sample_size)
+            result = probe.run(existing_data)
+            probe_totals = probe_collector.metrics.snapshot()['totals']
+            self.state.data['last_probe'] = datetime.now().isoformat()
+            self.state.save()
+
+            self.logger.info(f"🔎 Probe finished in {time.time() - probe_start:.2f}s "
+                             f"({probe_totals['requests']} requests, {probe_totals['bytes_received']:,} bytes)")
+
+            if not result['changed']:
+                self.logger.info("✅ No upstream changes detected")
+                return None
+
+            for company, reasons in result['reasons'].items():
+                self.logger.info(f"📢 {company} changed: {'; '.join(reasons[:5])}")
+
+            full = set(result['changed']) >= set(operators)
+            code = self.collect(result['changed'] if not full else operators, existing_data, full=full)
+            if code == 0:
+                self.state.data['validators'].update(result['validators'])
+                self.state.save()
+            return code
+
+        finally:
+            run_lock.release()
+
+    def collect(self, operators: List[str], existing_data: Optional[Dict[str, Any]], full: bool) -> int:
+        """執行收集流程；部分收集時沿用未改變營運商的現有數據"""
+        start_time = time.time()
+        metrics = CollectorMetrics(profiler=StageProfiler.from_env())
+        collector = OptimizedConcurrentBusDataCollector(operators=operators, metrics=metrics, http=self.http)
+        exit_code = 2
+
+        try:
+            if not full:
+                unchanged = [company for company in enabled_operators() if company not in operators]
+                self.logger.info(f"🧩 Partial collection: {', '.join(operators)} (reusing {', '.join(unchanged)})")
+                carried = collector.carry_over_operators(existing_data, unchanged)
+                self.logger.info(f"♻️  Carried over {carried} unchanged routes")
+            else:
+                self.logger.info(f"🚚 Full collection: {', '.join(operators)}")
+
+            if self.upload_enabled is None:
+                self.upload_enabled = initialize_upload(self.logger)
+            exit_code, filename = run_collection_pipeline(collector, metrics, self.logger, self.upload_enabled)
+        except Exception as e:
+            self.logger.error(f"💥 Collection error: {e}", exc_info=True)
+        finally:
+            collector.close()
+            with metrics.lock:
+                metrics.stages['total'] = time.time() - start_time
+            try:
+                metrics.write(exit_code)
+            except Exception as e:
+                self.logger.error(f"⚠️  Failed to write metrics: {e}")
+
+        if exit_code == 0:
+            now = datetime.now().isoformat()
+            self.state.data['last_run'] = now
+            if full:
+                self.state.data['last_full_run'] = now
+            self.state.save()
+            self.logger.info(f"🎉 {'Full' if full else 'Partial'} collection complete in {time.time() - start_time:.2f}s")
+        else:
+            self.logger.error(f"❌ Collection failed with exit code {exit_code}")
+        return exit_code
+
+    def run_forever(self, force_full: bool = False):
+        self.logger.info(f"🛰️  Daemon started: probing every {self.probe_interval / 60:g} min, "
+                         f"full collection at least every {self.full_interval_hours:g}h")
+        while not self.stop_event.is_set():
+            try:
+                self.run_cycle(force_full)
+            except Exception as e:
+                self.logger.error(f"💥 Probe cycle error: {e}", exc_info=True)
+            force_full = False
+            self.stop_event.wait(self.probe_interval)
+        self.logger.info("👋 Daemon stopped")
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Bus data collector daemon with upstream change detection')
+    parser.add_argument('--once', action='store_true',
+                        help='Run a single probe (and collection if needed), then exit')
+    parser.add_argument('--full', action='store_true',
+                        help='Run a full collection on the first cycle regardless of probes')
+    parser.add_argument('--interval', type=float,
+                        default=float(os.getenv('DAEMON_PROBE_INTERVAL_MINUTES', str(DEFAULT_PROBE_INTERVAL_MINUTES))),
+                        help='Minutes between probes (default: DAEMON_PROBE_INTERVAL_MINUTES or 30)')
+    parser.add_argument('--sample', type=int,
+                        default=int(os.getenv('DAEMON_PROBE_SAMPLE', str(DEFAULT_PROBE_SAMPLE))),
+                        help='Route directions sampled per per-route operator on each probe (default: 20)')
+    return parser.parse_args(argv)
+
+
+def main():
+    load_environment()      # .env 的 DAEMON_* 設定作為命令列參數的預設值
+    args = parse_args()
+    # 每次探測 (--once 由 cron 調用) 附加到當日的 daemon 日誌，而不是每次建立新的 .log / .jsonl
+    logger = setup_logging(log_name=f"collector_daemon_{datetime.now().strftime('%Y%m%d')}")
+
+    daemon = CollectorDaemon(
+        logger,
+        probe_interval=args.interval * 60,
+        sample_size=args.sample,
+        full_interval_hours=float(os.getenv('DAEMON_FULL_INTERVAL_HOURS', str(DEFAULT_FULL_INTERVAL_HOURS)))
+    )
+
+    if args.once:
+        exit_code = daemon.run_cycle(force_full=args.full)
+        sys.exit(exit_code or 0)
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run_forever(force_full=args.full)
+
+
+if __name__ == '__main__':
+    main()
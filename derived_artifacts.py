@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+收集後的衍生產物建立階段
+- 每個產物模組提供 build_and_write(bus_data, output_dir) -> (路徑, 統計)
+  及 ARTIFACT_INPUTS (使用的 bus_data 分區；None = 整個 bus_data.json) / ARTIFACT_ENV (影響輸出的環境變數)
+- 內容雜湊快取：輸入分區、環境變數及模組原始碼的 SHA256 與上次相同且輸出仍存在時跳過
+  (跳過的產物保留上次建立時的數據版本號)
+- 多個產物需要重建且有多於一個 CPU 核心時，以進程池並行建立：
+  bus_data 只 pickle 一次放入共享記憶體，每個 worker 啟動時讀取一次
+- 結果記錄在 OUTPUT_DIRECTORY/derived_artifacts.json (快取清單)，並由 generate_metadata_file 寫入 metadata
+
+環境變數:
+  DERIVED_BUILD_WORKERS   進程數 (預設: CPU 核心數與需重建產物數的較小者；1 = 在當前進程依次建立)
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+import importlib
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Tuple
+
+DERIVED_ARTIFACTS = ('bus_data_reader', 'transfer_graph', 'stop_tiles', 'route_geometry')
+MANIFEST_FILENAME = 'derived_artifacts.json'
+
+# worker 進程內的 bus_data (由 _attach_snapshot 從共享記憶體讀取)
+_worker_bus_data: Optional[Dict[str, Any]] = None
+
+
+def _sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def section_digest(bus_data: Dict[str, Any], section: str) -> str:
+    """單一分區的內容雜湊 (鍵排序的緊湊 JSON)"""
+    return _sha256_bytes(json.dumps(bus_data.get(section), sort_keys=True, ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8'))
+
+
+def artifact_input_hash(module, bus_data: Dict[str, Any], data_file: Path, digests: Dict[str, str]) -> str:
+    """產物輸入的 SHA256：使用的分區 (digests 共用快取)、環境變數及模組原始碼"""
+    from storage_backends import file_sha256
+
+    hasher = hashlib.sha256()
+    hasher.update(Path(module.__file__).read_bytes())
+    inputs = getattr(module, 'ARTIFACT_INPUTS', None)
+    if inputs is None:
+        hasher.update(b'file:' + file_sha256(data_file).encode())
+    else:
+        for section in inputs:
+            if section not in digests:
+                digests[section] = section_digest(bus_data, section)
+            hasher.update(f"{section}:{digests[section]}".encode())
+    for name in getattr(module, 'ARTIFACT_ENV', ()):
+        hasher.update(f"{name}={os.getenv(name, '')}".encode())
+    return hasher.hexdigest()
+
+
+def load_manifest(output_dir: Path) -> Dict[str, Dict[str, Any]]:
+    manifest_file = Path(output_dir) / MANIFEST_FILENAME
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir: Path, manifest: Dict[str, Dict[str, Any]]):
+    manifest_file = Path(output_dir) / MANIFEST_FILENAME
+    tmp_file = manifest_file.with_suffix('.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+def _attach_snapshot(shm_name: str, size: int):
+    """worker 初始化：從共享記憶體讀取 bus_data (每個 worker 一次)"""
+    global _worker_bus_data
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        _worker_bus_data = pickle.loads(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _build_in_worker(name: str, output_dir: str) -> Tuple[str, Dict[str, Any]]:
+    return importlib.import_module(name).build_and_write(_worker_bus_data, Path(output_dir))
+
+
+def default_workers(pending: int) -> int:
+    workers = os.getenv('DERIVED_BUILD_WORKERS')
+    if workers:
+        return max(1, int(workers))
+    return max(1, min(pending, os.cpu_count() or 1))
+
+
+def _build_serial(names: List[str], bus_data: Dict[str, Any], output_dir: Path,
+                  stage=None) -> Dict[str, Any]:
+    """在當前進程依次建立 (stage: 可選的計時 context manager factory，例如 CollectorMetrics.stage)"""
+    results = {}
+    for name in names:
+        try:
+            if stage is None:
+                results[name] = importlib.import_module(name).build_and_write(bus_data, output_dir)
+            else:
+                with stage(name):
+                    results[name] = importlib.import_module(name).build_and_write(bus_data, output_dir)
+        except Exception as e:
+            results[name] = e
+    return results
+
+
+def _build_parallel(names: List[str], bus_data: Dict[str, Any], output_dir: Path, workers: int) -> Dict[str, Any]:
+    """進程池並行建立；bus_data 只序列化一次放入共享記憶體"""
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    snapshot = pickle.dumps(bus_data, protocol=pickle.HIGHEST_PROTOCOL)
+    size = len(snapshot)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    results = {}
+    try:
+        shm.buf[:size] = snapshot
+        del snapshot
+        # spawn：不複製父進程的線程狀態 (日誌背景線程、HTTP 連線池)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_attach_snapshot, initargs=(shm.name, size)) as executor:
+            futures = {executor.submit(_build_in_worker, name, str(output_dir)): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def build_artifacts(bus_data: Dict[str, Any], data_file: Path, names: Tuple[str, ...] = DERIVED_ARTIFACTS,
+                    workers: Optional[int] = None, stage=None) -> Dict[str, Dict[str, Any]]:
+    """
+    建立 (或沿用快取) 所有衍生產物，返回 {名稱: 清單記錄}
+    清單記錄: file, input_sha256, cached, build_seconds, file_size_bytes, built_at (失敗時為 error)
+    """
+    data_file = Path(data_file)
+    output_dir = data_file.parent
+    manifest = load_manifest(output_dir)
+    digests: Dict[str, str] = {}
+
+    input_hashes = {}
+    pending = []
+    records: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        try:
+            input_hashes[name] = artifact_input_hash(importlib.import_module(name), bus_data, data_file, digests)
+        except Exception as e:
+            records[name] = {'error': f"{type(e).__name__}: {e}"}
+            logging.warning(f"⚠️  {name} build failed: {e}")
+            continue
+        previous = manifest.get(name, {})
+        if previous.get('input_sha256') == input_hashes[name] and previous.get('file') \
+                and (output_dir / previous['file']).is_file():
+            records[name] = {**previous, 'cached': True}
+            logging.info(f"🧩 {previous['file']}: unchanged inputs, skipped (built {previous.get('built_at')})")
+        else:
+            pending.append(name)
+
+    workers = min(workers or default_workers(len(pending)), len(pending))
+    if workers > 1:
+        logging.info(f"🧩 Building {len(pending)} derived artifacts in {workers} processes: {', '.join(pending)}")
+        results = _build_parallel(pending, bus_data, output_dir, workers)
+    else:
+        results = _build_serial(pending, bus_data, output_dir, stage)
+
+    for name in pending:
+        result = results.get(name)
+        if isinstance(result, Exception) or result is None:
+            records[name] = {'error': f"{type(result).__name__}: {result}"}
+            logging.warning(f"⚠️  {name} build failed: {result}")
+            continue
+        path, stats = result
+        records[name] = {
+            'file': Path(path).name,
+            'input_sha256': input_hashes[name],
+            'cached': False,
+            'build_seconds': stats['build_seconds'],
+            'file_size_bytes': stats['file_size_bytes'],
+            'built_at': datetime.now().isoformat()
+        }
+        logging.info(f"🧩 {Path(path).name}: {stats['file_size_bytes'] / 1024:.0f} KB "
+                     f"in {stats['build_seconds']:.2f}s")
+
+    records = {name: records[name] for name in names if name in records}
+
+    # 失敗的產物從清單移除，下次必定重建
+    manifest = {name: record for name, record in manifest.items() if name not in names}
+    manifest.update({name: {key: value for key, value in record.items() if key != 'cached'}
+                     for name, record in records.items() if 'error' not in record})
+    write_manifest(output_dir, manifest)
+    return records
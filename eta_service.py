@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+ETA 聚合服務 (App / 網頁不再各自直接調用 KMB / CTB ETA API)
+- 批量 endpoint：一次請求查詢多個 (站點, 路線, 方向)，以 bus_data.json 的索引驗證及展開查詢
+- 多個查詢共用同一個上游請求：KMB 以 stop-eta 一次取得站點所有路線 (包括所有 service_type)，CTB 每站每路線一次
+- 相同的上游請求同時進行時只發出一次 (其他請求等待結果)，結果以短 TTL 快取
+- 沿用收集器的 HTTP 層 (連線池、每個主機請求預算、暫時性錯誤重試) 及 {COMPANY}_API_BASE 設定
+- bus_data.json 更新後自動重新載入索引
+
+使用方式:
+  python3 eta_service.py                        # 預設 0.0.0.0:8080
+  python3 eta_service.py --port 9000 --ttl 10
+
+  # 以本地模擬上游測試 (benchmark_collector.py --serve 同時提供 ETA endpoints)
+  python3 benchmark_collector.py --serve
+  KMB_API_BASE=... CTB_API_BASE=... python3 collect_bus_data_optimized_concurrent.py collect --no-upload
+  KMB_API_BASE=... CTB_API_BASE=... python3 eta_service.py
+
+Endpoints:
+  POST /v1/eta/batch   {"queries": [{"route_id": "KMB_1A_O", "stop_id": "..."},
+                                    {"company": "CTB", "route": "1", "direction": "inbound", "sequence": 3},
+                                    {"stop_id": "..."}]}       # 只有 stop_id：該站所有路線
+  GET  /v1/eta?route_id=KMB_1A_O&stop_id=...  (或 company / route / direction / sequence)
+  GET  /health
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import Dict, List, Any, Optional, Tuple, Callable
+
+from collect_bus_data_optimized_concurrent import (
+    CollectorMetrics,
+    OptimizedConcurrentBusDataCollector,
+    default_data_file,
+    load_bus_data,
+    load_environment,
+    setup_logging,
+)
+
+# 服務設定
+DEFAULT_CACHE_TTL = 15          # 秒；上游 ETA 約每分鐘更新
+DEFAULT_MAX_BATCH = 200         # 每個批量請求最多展開的查詢數
+DEFAULT_UPSTREAM_WORKERS = 16
+DEFAULT_UPSTREAM_TIMEOUT = 10
+DATA_RELOAD_CHECK_SECONDS = 60
+ETA_LATENCY_SAMPLES = 1024      # 每個上游 endpoint 保留的延遲樣本數
+
+ETA_COMPANIES = ('KMB', 'CTB')
+ETA_FIELDS = ('eta', 'eta_seq', 'dest_tc', 'dest_en', 'rmk_tc', 'rmk_en', 'service_type')
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(ValueError):
+    """查詢無法在 bus_data.json 中解析 (返回 400 / 個別結果的 error)"""
+
+
+class ETACache:
+    """
+    短 TTL 快取 + single-flight
+    - 快取未過期：直接返回
+    - 相同 key 的請求正在進行：等待同一個 Future，不重複調用上游
+    - 失敗結果 (None) 不快取，下一個請求會重試
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 20000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'failures': 0}
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Tuple[Any, float, str]:
+        """返回 (value, fetched_at, 'hit' | 'miss' | 'coalesced')"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.stats['hits'] += 1
+                return entry[1], entry[0], 'hit'
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not owner:
+            value, fetched_at = future.result()
+            return value, fetched_at, 'coalesced'
+
+        value = None
+        fetched_at = time.time()
+        try:
+            value = loader()
+            fetched_at = time.time()
+        finally:
+            with self._lock:
+                if value is not None:
+                    if len(self._entries) >= self.max_entries:
+                        self._purge_expired(fetched_at)
+                    self._entries[key] = (fetched_at, value)
+                else:
+                    self.stats['failures'] += 1
+                del self._in_flight[key]
+            future.set_result((value, fetched_at))
+        return value, fetched_at, 'miss'
+
+    def _purge_expired(self, now: float):
+        expired = [key for key, (fetched_at, _) in self._entries.items() if now - fetched_at >= self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class BusDataIndex:
+    """bus_data.json 的查詢索引 (路線資料、每條路線的站點序列及站點→路線)"""
+
+    def __init__(self, data_file: Path):
+        self.data_file = Path(data_file)
+        self.mtime = self.data_file.stat().st_mtime
+        data = load_bus_data(self.data_file)
+        self.version = data.get('version')
+        self.routes: Dict[str, Dict[str, Any]] = data.get('routes', {})
+        self.stops: Dict[str, Dict[str, Any]] = data.get('stops', {})
+        self.stop_routes: Dict[str, List[Dict[str, Any]]] = data.get('stop_routes', {})
+        self.route_sequences: Dict[str, Dict[int, str]] = {
+            route_id: {int(stop['sequence']): stop['stop_id'] for stop in stops}
+            for route_id, stops in data.get('route_stops', {}).items()
+        }
+        self.route_stop_sets = {route_id: set(sequence.values()) for route_id, sequence in self.route_sequences.items()}
+
+    def resolve(self, query: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """
+        把一個查詢展開為 [(route_id, stop_id), ...]
+        - route_id 或 company + route + direction 指定路線；stop_id 或 sequence 指定站點
+        - 只有 stop_id：該站所有支援 ETA 的路線 (與 App 的站點 ETA 頁相同)
+        """
+        if not isinstance(query, dict):
+            raise QueryError("Query must be an object")
+
+        stop_id = query.get('stop_id')
+        route_id = query.get('route_id') or self._route_id_from_parts(query)
+
+        if route_id is None:
+            if not stop_id:
+                raise QueryError("Query needs route_id, company/route/direction or stop_id")
+            if stop_id not in self.stop_routes:
+                raise QueryError(f"Unknown stop: {stop_id}")
+            return [(entry['route_id'], stop_id) for entry in self.stop_routes[stop_id]
+                    if entry['company'] in ETA_COMPANIES]
+
+        if route_id not in self.routes:
+            raise QueryError(f"Unknown route: {route_id}")
+        if self.routes[route_id]['company'] not in ETA_COMPANIES:
+            raise QueryError(f"ETA not supported for {self.routes[route_id]['company']}")
+
+        if not stop_id:
+            sequence = query.get('sequence')
+            if sequence is None:
+                raise QueryError("Query needs stop_id or sequence")
+            try:
+                stop_id = self.route_sequences.get(route_id, {})[int(sequence)]
+            except (KeyError, ValueError, TypeError):
+                raise QueryError(f"Route {route_id} has no stop at sequence {sequence}")
+        elif stop_id not in self.route_stop_sets.get(route_id, ()):
+            raise QueryError(f"Stop {stop_id} is not on route {route_id}")
+
+        return [(route_id, stop_id)]
+
+    @staticmethod
+    def _route_id_from_parts(query: Dict[str, Any]) -> Optional[str]:
+        company, route, direction = query.get('company'), query.get('route'), query.get('direction')
+        if not (company or route or direction):
+            return None
+        if not (company and route and direction):
+            raise QueryError("company, route and direction must be given together")
+        letter = str(direction)[0].upper()
+        if letter not in ('O', 'I'):
+            raise QueryError(f"Invalid direction: {direction}")
+        return f"{str(company).upper()}_{route}_{letter}"
+
+
+class ETAAggregator:
+    """把批量查詢映射到最少的上游 ETA 請求，並按路線方向過濾結果"""
+
+    def __init__(self, data_file: Path, cache_ttl: float = DEFAULT_CACHE_TTL,
+                 upstream_workers: int = DEFAULT_UPSTREAM_WORKERS, upstream_timeout: int = DEFAULT_UPSTREAM_TIMEOUT,
+                 max_batch: int = DEFAULT_MAX_BATCH, collector: Optional[OptimizedConcurrentBusDataCollector] = None):
+        self.data_file = Path(data_file)
+        self.index = BusDataIndex(self.data_file)
+        self._index_lock = threading.Lock()
+        self._last_reload_check = time.time()
+
+        # 收集器只用作 HTTP 層 (session、請求預算、重試) 及營運商 base_url
+        # 服務長期運行：延遲指標只保留固定數量的樣本，記憶體不隨請求數增長
+        self.collector = collector or OptimizedConcurrentBusDataCollector(
+            operators=list(ETA_COMPANIES), metrics=CollectorMetrics(latency_samples=ETA_LATENCY_SAMPLES))
+        self.cache = ETACache(cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=upstream_workers, thread_name_prefix='eta-upstream')
+        self.upstream_timeout = upstream_timeout
+        self.max_batch = max_batch
+        self.stats = {'requests': 0, 'queries': 0, 'upstream_calls': 0, 'upstream_failures': 0}
+        self._stats_lock = threading.Lock()
+
+    def current_index(self) -> BusDataIndex:
+        """bus_data.json 改變時重新載入索引 (最多每 DATA_RELOAD_CHECK_SECONDS 檢查一次)"""
+        now = time.time()
+        if now - self._last_reload_check < DATA_RELOAD_CHECK_SECONDS:
+            return self.index
+        with self._index_lock:
+            if now - self._last_reload_check >= DATA_RELOAD_CHECK_SECONDS:
+                self._last_reload_check = now
+                try:
+                    if self.data_file.stat().st_mtime != self.index.mtime:
+                        self.index = BusDataIndex(self.data_file)
+                        logger.info(f"🔄 Reloaded {self.data_file} (version {self.index.version})")
+                except (OSError, ValueError) as e:
+                    logger.warning(f"⚠️  Keeping previous bus data, reload failed: {e}")
+        return self.index
+
+    def upstream_url(self, route_info: Dict[str, Any], stop_id: str) -> str:
+        """上游請求 URL：KMB 一個站點一個請求 (涵蓋所有路線及 service_type)，CTB 每站每路線一個"""
+        operator = self.collector.operators[route_info['company']]
+        if route_info['company'] == 'KMB':
+            return f"{operator.base_url}/stop-eta/{stop_id}"
+        return f"{operator.base_url}/eta/{route_info['company']}/{stop_id}/{route_info['route_number']}"
+
+    def fetch_upstream(self, url: str) -> Optional[List[Dict[str, Any]]]:
+        data, _ = self.collector.fetch_json(url, f"ETA {url}", timeout=self.upstream_timeout)
+        with self._stats_lock:
+            self.stats['upstream_calls'] += 1
+            if 'data' not in data:
+                self.stats['upstream_failures'] += 1
+        return data.get('data') if 'data' in data else None
+
+    def lookup(self, url: str) -> Tuple[Optional[List[Dict[str, Any]]], float, str]:
+        return self.cache.get(url, lambda: self.fetch_upstream(url))
+
+    @staticmethod
+    def filter_etas(entries: List[Dict[str, Any]], route_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """只保留該路線方向的班次 (與 App 相同：比較 dir 的首字母)，按到站時間排序"""
+        letter = route_info['direction'][0].upper()
+        etas = [
+            {field: entry[field] for field in ETA_FIELDS if field in entry}
+            for entry in entries
+            if entry.get('route') == route_info['route_number'] and entry.get('dir') == letter and entry.get('eta')
+        ]
+        etas.sort(key=lambda e: e['eta'])
+        return etas
+
+    def query_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """解析所有查詢，去重上游請求並行獲取，返回每個 (路線, 站點) 的結果"""
+        index = self.current_index()
+        started = time.time()
+
+        resolved: List[Tuple[int, Optional[Tuple[str, str]], Optional[str]]] = []
+        for position, query in enumerate(queries):
+            try:
+                for pair in index.resolve(query):
+                    resolved.append((position, pair, None))
+            except QueryError as e:
+                resolved.append((position, None, str(e)))
+        if len(resolved) > self.max_batch:
+            raise QueryError(f"Batch expands to {len(resolved)} queries (max {self.max_batch})")
+
+        # 每個唯一上游 URL 只查詢一次 (批量內去重；跨請求由快取 single-flight 合併)
+        urls = {}
+        for _, pair, _ in resolved:
+            if pair is not None:
+                urls.setdefault(self.upstream_url(index.routes[pair[0]], pair[1]), None)
+        futures = {url: self.executor.submit(self.lookup, url) for url in urls}
+        upstream = {url: future.result() for url, future in futures.items()}
+
+        now = time.time()
+        results = []
+        for position, pair, error in resolved:
+            if pair is None:
+                results.append({'query_index': position, 'status': 'error', 'error': error})
+                continue
+            route_id, stop_id = pair
+            route_info = index.routes[route_id]
+            entries, fetched_at, cache_status = upstream[self.upstream_url(route_info, stop_id)]
+            result = {
+                'query_index': position,
+                'route_id': route_id,
+                'company': route_info['company'],
+                'route': route_info['route_number'],
+                'direction': route_info['direction'],
+                'stop_id': stop_id,
+            }
+            if entries is None:
+                result.update({'status': 'error', 'error': 'Upstream ETA request failed'})
+            else:
+                result.update({
+                    'status': 'ok',
+                    'etas': self.filter_etas(entries, route_info),
+                    'cache': cache_status,
+                    'age_seconds': round(max(0.0, now - fetched_at), 1)
+                })
+            results.append(result)
+
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['queries'] += len(resolved)
+
+        return {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'data_version': index.version,
+            'upstream_requests': len(urls),
+            'elapsed_ms': round((time.time() - started) * 1000, 1),
+            'results': results
+        }
+
+    def health(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'status': 'ok',
+            'data_version': self.index.version,
+            'routes': len(self.index.routes),
+            'cache_ttl': self.cache.ttl,
+            'cache_entries': self.cache.size(),
+            'cache': dict(self.cache.stats),
+            'service': stats
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.collector.close()
+
+
+class ETAHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 預設 backlog (5) 在大量客戶端同時連線時會被重設
+
+
+def make_handler(aggregator: ETAAggregator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/health':
+                self._send_json(200, aggregator.health())
+                return
+            if url.path == '/v1/eta':
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self._run_batch([params])
+                return
+            self._send_json(404, {'error': 'Not Found'})
+
+        def do_POST(self):
+            if urlsplit(self.path).path != '/v1/eta/batch':
+                self._send_json(404, {'error': 'Not Found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except (ValueError, UnicodeDecodeError):
+                self._send_json(400, {'error': 'Invalid JSON body'})
+                return
+            queries = payload.get('queries') if isinstance(payload, dict) else payload
+            if not isinstance(queries, list):
+                self._send_json(400, {'error': 'Body must be {"queries": [...]}'})
+                return
+            self._run_batch(queries)
+
+        def do_OPTIONS(self):
+            # 網頁版 (bus_time.js) 跨域調用的 preflight
+            self.send_response(204)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _run_batch(self, queries: List[Dict[str, Any]]):
+            try:
+                self._send_json(200, aggregator.query_batch(queries))
+            except QueryError as e:
+                self._send_json(413, {'error': str(e)})
+            except Exception as e:
+                logger.exception(f"❌ ETA batch failed: {e}")
+                self._send_json(500, {'error': 'Internal error'})
+
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='ETA aggregation service with request coalescing and caching')
+    parser.add_argument('--host', default=os.getenv('ETA_SERVICE_HOST', '0.0.0.0'),
+                        help='Listen address (default: ETA_SERVICE_HOST or 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=int(os.getenv('ETA_SERVICE_PORT', '8080')),
+                        help='Listen port (default: ETA_SERVICE_PORT or 8080)')
+    parser.add_argument('--data-file', help='bus_data.json used to resolve queries (default: OUTPUT_DIRECTORY/bus_data.json)')
+    parser.add_argument('--ttl', type=float, default=float(os.getenv('ETA_CACHE_TTL', str(DEFAULT_CACHE_TTL))),
+                        help='Seconds an upstream ETA response is reused (default: ETA_CACHE_TTL or 15)')
+    return parser.parse_args(argv)
+
+
+def main():
+    load_environment()
+    args = parse_args()
+    setup_logging(log_to_file=False)
+
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    if not data_file.exists():
+        logger.error(f"❌ Bus data file not found: {data_file}")
+        sys.exit(2)
+
+    aggregator = ETAAggregator(
+        data_file,
+        cache_ttl=args.ttl,
+        upstream_workers=int(os.getenv('ETA_UPSTREAM_WORKERS', str(DEFAULT_UPSTREAM_WORKERS))),
+        upstream_timeout=int(os.getenv('ETA_UPSTREAM_TIMEOUT', str(DEFAULT_UPSTREAM_TIMEOUT))),
+        max_batch=int(os.getenv('ETA_MAX_BATCH', str(DEFAULT_MAX_BATCH)))
+    )
+    httpd = ETAHTTPServer((args.host, args.port), make_handler(aggregator))
+    logger.info(f"🚌 ETA service listening on http://{args.host}:{httpd.server_address[1]} "
+                f"({len(aggregator.index.routes)} routes, cache TTL {args.ttl}s)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("⏹️  Stopping ETA service")
+    finally:
+        httpd.server_close()
+        aggregator.close()
+
+
+if __name__ == '__main__':
+    main()
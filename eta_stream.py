@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+ETA 推送串流 (Server-Sent Events)
+- 客戶端訂閱一組 (路線, 站點)，站點可用 stop_id 或路線站序 (以 bus_data.json 解析)
+- 伺服器對所有訂閱者的唯一上游請求輪詢一次 (KMB 同一站點的所有路線共用一個請求)，只推送有改變的 ETA
+- 單一 asyncio 進程處理數千個連線：每個事件只序列化一次，慢速客戶端只保留每個訂閱的最新狀態
+- 上游請求、快取及 bus_data.json 索引沿用 eta_service.py
+
+使用方式:
+  python3 eta_stream.py                          # 預設 0.0.0.0:8081
+  python3 eta_stream.py --port 9001 --poll 15
+
+Endpoints:
+  GET /v1/eta/stream?q=KMB_1A_O:<stop_id>&q=CTB_1_I:#3&stop=<stop_id>
+      q=<route_id>:<stop_id> 或 q=<route_id>:#<sequence>；stop=<stop_id> 訂閱該站所有路線
+      事件: subscribed (訂閱結果)、eta (某個訂閱的完整最新 ETA 列表)
+  GET /health
+
+瀏覽器:
+  const source = new EventSource('http://nas:8081/v1/eta/stream?q=KMB_1A_O:A60AE774B09A5E44');
+  source.addEventListener('eta', e => render(JSON.parse(e.data)));
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from collect_bus_data_optimized_concurrent import default_data_file, load_environment, setup_logging
+from eta_service import (
+    DEFAULT_CACHE_TTL,
+    DEFAULT_UPSTREAM_TIMEOUT,
+    DEFAULT_UPSTREAM_WORKERS,
+    ETAAggregator,
+    QueryError,
+)
+
+# 串流設定
+DEFAULT_POLL_SECONDS = 20
+DEFAULT_MAX_SUBSCRIPTIONS = 50   # 每個連線最多訂閱數
+KEEPALIVE_SECONDS = 15           # 沒有事件時的註解行 (保持代理不斷線，亦用來偵測已離開的客戶端)
+HEADER_TIMEOUT_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+SubscriptionKey = Tuple[str, str]  # (route_id, stop_id)
+KEEPALIVE_KEY = ('', '')
+KEEPALIVE_EVENT = b": keepalive\n\n"
+
+
+def encode_event(event_id: int, name: str, payload: Dict[str, Any]) -> bytes:
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {name}\ndata: {data}\n\n".encode('utf-8')
+
+
+def raise_fd_limit():
+    """把打開檔案數的軟上限提高到硬上限 (每個訂閱者佔用一個 socket)"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class Subscriber:
+    """一個 SSE 連線：pending 只保留每個訂閱最新的事件 (慢速客戶端不會累積過期事件)"""
+
+    __slots__ = ('keys', 'pending', 'wakeup')
+
+    def __init__(self, keys: List[SubscriptionKey]):
+        self.keys = keys
+        self.pending: Dict[SubscriptionKey, bytes] = {}
+        self.wakeup = asyncio.Event()
+
+    def push(self, key: SubscriptionKey, event: bytes):
+        self.pending[key] = event
+        self.wakeup.set()
+
+    def drain(self) -> bytes:
+        self.wakeup.clear()
+        events, self.pending = self.pending, {}
+        return b''.join(events.values())
+
+
+class ETAStreamHub:
+    """訂閱登記、按上游 URL 排程輪詢及變更推送 (全部在事件循環線程上執行，不需要鎖)"""
+
+    def __init__(self, aggregator: ETAAggregator, poll_interval: float,
+                 max_subscriptions: int = DEFAULT_MAX_SUBSCRIPTIONS):
+        self.aggregator = aggregator
+        self.poll_interval = poll_interval
+        self.max_subscriptions = max_subscriptions
+
+        self.subscribers: Dict[SubscriptionKey, Set[Subscriber]] = defaultdict(set)
+        self.key_urls: Dict[SubscriptionKey, str] = {}
+        self.url_keys: Dict[str, Set[SubscriptionKey]] = {}
+        self.next_poll: Dict[str, float] = {}
+        self.poll_queue: List[Tuple[float, str]] = []  # (due_at, url) 堆；next_poll 不同的項目已過期
+        self.last_etas: Dict[SubscriptionKey, List[Dict[str, Any]]] = {}
+        self.snapshots: Dict[SubscriptionKey, bytes] = {}
+
+        self.connections: Set[Subscriber] = set()
+        self.event_id = 0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.poll_tasks: Set[asyncio.Task] = set()
+        self.stats = {'polls': 0, 'poll_failures': 0, 'changes': 0, 'deliveries': 0, 'connections_total': 0}
+
+    # ---- 訂閱 ----
+
+    def resolve(self, params: Dict[str, List[str]]) -> Tuple[List[SubscriptionKey], List[str]]:
+        """把查詢參數解析為訂閱 (去重)，返回 (keys, errors)"""
+        index = self.aggregator.index
+        queries = []
+        for value in params.get('q', []):
+            route_id, _, stop = value.partition(':')
+            if stop.startswith('#'):
+                queries.append({'route_id': route_id, 'sequence': stop[1:]})
+            else:
+                queries.append({'route_id': route_id, 'stop_id': stop})
+        queries.extend({'stop_id': stop_id} for stop_id in params.get('stop', []))
+
+        keys: Dict[SubscriptionKey, None] = {}
+        errors = []
+        for query in queries:
+            try:
+                for key in index.resolve(query):
+                    keys.setdefault(key, None)
+            except QueryError as e:
+                errors.append(str(e))
+        return list(keys), errors
+
+    def subscribe(self, keys: List[SubscriptionKey]) -> Subscriber:
+        subscriber = Subscriber(keys)
+        routes = self.aggregator.index.routes
+        for key in keys:
+            self.subscribers[key].add(subscriber)
+            if key in self.snapshots:
+                subscriber.push(key, self.snapshots[key])
+            if key in self.key_urls:
+                continue
+
+            url = self.aggregator.upstream_url(routes[key[0]], key[1])
+            self.key_urls[key] = url
+            if url not in self.url_keys:
+                self.url_keys[url] = set()
+                self.next_poll[url] = 0.0  # 新的上游請求：立即輪詢
+                heapq.heappush(self.poll_queue, (0.0, url))
+                self.wakeup.set()
+            self.url_keys[url].add(key)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        for key in subscriber.keys:
+            subscribers = self.subscribers.get(key)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscriber)
+            if subscribers:
+                continue
+            # 最後一個訂閱者離開：停止輪詢
+            del self.subscribers[key]
+            self.last_etas.pop(key, None)
+            self.snapshots.pop(key, None)
+            url = self.key_urls.pop(key)
+            keys = self.url_keys[url]
+            keys.discard(key)
+            if not keys:
+                del self.url_keys[url]
+                del self.next_poll[url]
+
+    # ---- 輪詢 ----
+
+    async def run(self):
+        """排程器：每個上游 URL 每 poll_interval 秒輪詢一次 (輪詢在背景任務中進行，不阻塞排程)"""
+        self.wakeup = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            queue = self.poll_queue
+            while queue and queue[0][0] <= now:
+                due_at, url = heapq.heappop(queue)
+                if self.next_poll.get(url) != due_at:
+                    continue  # 已取消訂閱或重新排程
+                self.next_poll[url] = now + self.poll_interval
+                heapq.heappush(queue, (now + self.poll_interval, url))
+                task = asyncio.create_task(self.poll(url))
+                self.poll_tasks.add(task)
+                task.add_done_callback(self.poll_tasks.discard)
+
+            next_due = queue[0][0] if queue else now + self.poll_interval
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(0.05, next_due - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _lookup(self, url: str):
+        # 在線程池中執行：bus_data.json 重新載入 (如有) 亦不阻塞事件循環
+        self.aggregator.current_index()
+        return self.aggregator.lookup(url)
+
+    async def poll(self, url: str):
+        loop = asyncio.get_running_loop()
+        entries, _, _ = await loop.run_in_executor(self.aggregator.executor, self._lookup, url)
+        self.stats['polls'] += 1
+        if entries is None:
+            self.stats['poll_failures'] += 1
+            return
+
+        polled_at = round(time.time(), 3)
+        routes = self.aggregator.index.routes
+        for key in self.url_keys.get(url, ()):
+            route_info = routes.get(key[0])
+            if route_info is None:
+                continue
+            etas = ETAAggregator.filter_etas(entries, route_info)
+            if etas == self.last_etas.get(key):
+                continue
+
+            self.last_etas[key] = etas
+            self.event_id += 1
+            event = encode_event(self.event_id, 'eta', {
+                'route_id': key[0],
+                'company': route_info['company'],
+                'route': route_info['route_number'],
+                'direction': route_info['direction'],
+                'stop_id': key[1],
+                'etas': etas,
+                'polled_at': polled_at
+            })
+            self.snapshots[key] = event
+            subscribers = self.subscribers.get(key, ())
+            for subscriber in subscribers:
+                subscriber.push(key, event)
+            self.stats['changes'] += 1
+            self.stats['deliveries'] += len(subscribers)
+
+    # ---- HTTP ----
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=HEADER_TIMEOUT_SECONDS)
+            method, target = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ')[:2]
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            writer.close()
+            return
+
+        url = urlsplit(target)
+        try:
+            if method == 'GET' and url.path == '/v1/eta/stream':
+                await self.stream(parse_qs(url.query), writer)
+            elif method == 'GET' and url.path == '/health':
+                await self.send_json(writer, 200, self.health())
+            else:
+                await self.send_json(writer, 404, {'error': 'Not Found'})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def stream(self, params: Dict[str, List[str]], writer: asyncio.StreamWriter):
+        keys, errors = self.resolve(params)
+        if not keys:
+            await self.send_json(writer, 400, {'error': 'No valid subscriptions', 'details': errors})
+            return
+        if len(keys) > self.max_subscriptions:
+            await self.send_json(writer, 400, {'error': f"Too many subscriptions ({len(keys)}, max {self.max_subscriptions})"})
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\nAccess-Control-Allow-Origin: *\r\nX-Accel-Buffering: no\r\n\r\n"
+                     b"retry: 5000\n\n")
+        writer.write(encode_event(0, 'subscribed', {
+            'subscriptions': [f"{route_id}:{stop_id}" for route_id, stop_id in keys],
+            'errors': errors,
+            'poll_seconds': self.poll_interval
+        }))
+
+        subscriber = self.subscribe(keys)
+        self.connections.add(subscriber)
+        self.stats['connections_total'] += 1
+        try:
+            while True:
+                await writer.drain()
+                await subscriber.wakeup.wait()
+                writer.write(subscriber.drain())
+        finally:
+            self.connections.discard(subscriber)
+            self.unsubscribe(subscriber)
+
+    async def keepalive(self):
+        """定期向沒有待發事件的連線發送註解行 (一個任務處理全部連線，而不是每個連線各自計時)"""
+        while True:
+            await asyncio.sleep(KEEPALIVE_SECONDS)
+            for subscriber in self.connections:
+                if not subscriber.pending:
+                    subscriber.push(KEEPALIVE_KEY, KEEPALIVE_EVENT)
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'status': 'ok',
+            'data_version': self.aggregator.index.version,
+            'connections': len(self.connections),
+            'subscriptions': len(self.subscribers),
+            'upstream_urls': len(self.url_keys),
+            'poll_seconds': self.poll_interval,
+            'stream': dict(self.stats),
+            'cache': dict(self.aggregator.cache.stats),
+            'upstream': dict(self.aggregator.stats),
+            # 上游延遲 (聚合器的指標只保留固定數量的樣本，輪詢不會令記憶體增長)
+            'upstream_latency': self.aggregator.collector.metrics.snapshot()['endpoints']
+        }
+
+
+async def serve(hub: ETAStreamHub, host: str, port: int):
+    scheduler = asyncio.create_task(hub.run())
+    keepalive = asyncio.create_task(hub.keepalive())
+    server = await asyncio.start_server(hub.handle_connection, host, port, backlog=4096)
+    bound_port = server.sockets[0].getsockname()[1]
+    logger.info(f"📡 ETA stream listening on http://{host}:{bound_port} "
+                f"({len(hub.aggregator.index.routes)} routes, poll every {hub.poll_interval}s)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        scheduler.cancel()
+        keepalive.cancel()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Server-sent ETA push stream for subscribed stop sets')
+    parser.add_argument('--host', default=os.getenv('ETA_STREAM_HOST', '0.0.0.0'),
+                        help='Listen address (default: ETA_STREAM_HOST or 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=int(os.getenv('ETA_STREAM_PORT', '8081')),
+                        help='Listen port, 0 for any free port (default: ETA_STREAM_PORT or 8081)')
+    parser.add_argument('--data-file', help='bus_data.json used to resolve subscriptions (default: OUTPUT_DIRECTORY/bus_data.json)')
+    parser.add_argument('--poll', type=float, default=float(os.getenv('ETA_STREAM_POLL_SECONDS', str(DEFAULT_POLL_SECONDS))),
+                        help='Seconds between upstream polls of each subscribed stop (default: ETA_STREAM_POLL_SECONDS or 20)')
+    return parser.parse_args(argv)
+
+
+def main():
+    load_environment()
+    args = parse_args()
+    setup_logging(log_to_file=False)
+    raise_fd_limit()
+
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    if not data_file.exists():
+        logger.error(f"❌ Bus data file not found: {data_file}")
+        sys.exit(2)
+
+    # 快取 TTL 不超過輪詢間隔的一半，確保每次輪詢都取得新數據
+    aggregator = ETAAggregator(
+        data_file,
+        cache_ttl=min(float(os.getenv('ETA_CACHE_TTL', str(DEFAULT_CACHE_TTL))), args.poll / 2),
+        upstream_workers=int(os.getenv('ETA_UPSTREAM_WORKERS', str(DEFAULT_UPSTREAM_WORKERS))),
+        upstream_timeout=int(os.getenv('ETA_UPSTREAM_TIMEOUT', str(DEFAULT_UPSTREAM_TIMEOUT)))
+    )
+    hub = ETAStreamHub(
+        aggregator,
+        poll_interval=args.poll,
+        max_subscriptions=int(os.getenv('ETA_STREAM_MAX_SUBSCRIPTIONS', str(DEFAULT_MAX_SUBSCRIPTIONS)))
+    )
+    try:
+        asyncio.run(serve(hub, args.host, args.port))
+    except KeyboardInterrupt:
+        logger.info("⏹️  Stopping ETA stream")
+    finally:
+        aggregator.close()
+
+
+if __name__ == '__main__':
+    main()
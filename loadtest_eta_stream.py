@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+ETA 推送串流負載測試 (本地模擬上游)
+- 啟動模擬 KMB / CTB API (benchmark_collector.py)，以它收集一份 bus_data.json
+- 以子進程啟動 eta_stream.py，再以 asyncio 開啟數千個 SSE 訂閱者
+- 訂閱集中在熱門 (路線, 站點) (Zipf 分佈，模擬多人收藏相同路線)
+- 報告：連線成功率、首個事件延遲、推送延遲 (輪詢完成至客戶端收到)、事件數、上游請求數及伺服器 RSS
+- 上游請求數與「每個客戶端各自輪詢」的請求數比較
+
+使用方式:
+  python3 loadtest_eta_stream.py
+  python3 loadtest_eta_stream.py --subscribers 5000 --per-subscriber 8 --duration 60
+  python3 loadtest_eta_stream.py --scale 0.5 --poll 5 --output stream_load.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+from datetime import datetime
+from urllib.parse import urlencode
+from typing import Dict, List, Any, Optional, Tuple
+
+from benchmark_collector import MockAPIBehaviour, MockBusAPIServer
+from collect_bus_data_optimized_concurrent import load_bus_data
+from eta_stream import raise_fd_limit
+from synthetic_bus_network import generate_network, NetworkResponder
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def build_bus_data(server: MockBusAPIServer, output_dir: str) -> Path:
+    """以模擬上游執行一次收集 (與 benchmark_collector 相同的子進程流程)"""
+    env = dict(os.environ)
+    env.update({'KMB_API_BASE': server.kmb_base, 'CTB_API_BASE': server.ctb_base,
+                'BUS_OPERATORS': 'KMB,CTB', 'PROFILE_STAGES': ''})
+    process = subprocess.run([sys.executable, str(SCRIPT_DIR / 'benchmark_collector.py'), '--run-one', output_dir],
+                             env=env, cwd=str(SCRIPT_DIR), capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Collection against the mock server failed:\n{process.stderr[-2000:]}")
+    return Path(output_dir) / 'bus_data.json'
+
+
+def subscription_pool(data_file: Path, size: int, rng: random.Random) -> List[str]:
+    """隨機抽取 (路線, 站點) 作為可訂閱的組合"""
+    data = load_bus_data(data_file)
+    route_ids = sorted(route_id for route_id in data['route_stops'] if route_id in data['routes'])
+    pool = set()
+    while len(pool) < min(size, len(route_ids)):
+        route_id = rng.choice(route_ids)
+        stop = rng.choice(data['route_stops'][route_id])
+        pool.add(f"{route_id}:{stop['stop_id']}")
+    return sorted(pool)
+
+
+def start_stream_server(data_file: Path, server: MockBusAPIServer, poll: float, log_file: Path) -> Tuple[subprocess.Popen, int]:
+    """以隨機端口啟動 eta_stream.py，從日誌讀取實際端口"""
+    env = dict(os.environ)
+    env.update({'KMB_API_BASE': server.kmb_base, 'CTB_API_BASE': server.ctb_base, 'ETA_STREAM_MAX_SUBSCRIPTIONS': '1000'})
+    log = open(log_file, 'w')
+    process = subprocess.Popen(
+        [sys.executable, str(SCRIPT_DIR / 'eta_stream.py'), '--host', '127.0.0.1', '--port', '0',
+         '--data-file', str(data_file), '--poll', str(poll)],
+        env=env, cwd=str(SCRIPT_DIR), stdout=log, stderr=subprocess.STDOUT
+    )
+    log.close()
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"eta_stream.py exited:\n{log_file.read_text()[-2000:]}")
+        for line in log_file.read_text().splitlines():
+            if 'ETA stream listening on' in line:
+                return process, int(line.split('http://', 1)[1].split()[0].rsplit(':', 1)[1])
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("eta_stream.py did not start within 60s")
+
+
+def process_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """進程累計 CPU 時間 (user + system)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def fetch_health(port: int) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=10) as response:
+        return json.load(response)
+
+
+class SubscriberClient:
+    """
+    一個 SSE 客戶端：記錄首個事件延遲及推送延遲
+    每個訂閱的第一個事件是伺服器現有的快照 (可能是較早前的輪詢)，不計入推送延遲
+    """
+
+    def __init__(self, port: int, subscriptions: List[str]):
+        self.port = port
+        self.subscriptions = subscriptions
+        self.connected = False
+        self.error: Optional[str] = None
+        self.first_event_seconds: Optional[float] = None
+        self.events = 0
+        self.connect_seconds: Optional[float] = None
+        self.delivery_lags: List[float] = []
+
+    async def run(self, deadline: float):
+        started = time.time()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', self.port), timeout=30)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.error = type(e).__name__
+            return
+
+        try:
+            query = urlencode([('q', subscription) for subscription in self.subscriptions])
+            writer.write(f"GET /v1/eta/stream?{query} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                         f"Accept: text/event-stream\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+            status = await asyncio.wait_for(reader.readline(), timeout=30)
+            if b' 200 ' not in status:
+                self.error = status.decode('latin-1').strip() or 'no response'
+                return
+            self.connected = True
+            self.connect_seconds = time.time() - started
+
+            # 整個讀取循環只設一個期限 (數千個客戶端時避免每行建立計時器)
+            try:
+                await asyncio.wait_for(self.read_events(reader, started), timeout=max(0.0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                pass
+        except (OSError, asyncio.TimeoutError) as e:
+            self.error = type(e).__name__
+        finally:
+            writer.close()
+
+    async def read_events(self, reader: asyncio.StreamReader, started: float):
+        event_name = None
+        seen = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                self.error = 'closed by server'
+                return
+            if line.startswith(b'event: '):
+                event_name = line[7:].strip()
+            elif line.startswith(b'data: ') and event_name == b'eta':
+                received = time.time()
+                payload = json.loads(line[6:])
+                self.events += 1
+                key = (payload['route_id'], payload['stop_id'])
+                if key in seen:
+                    self.delivery_lags.append(received - payload['polled_at'])
+                seen.add(key)
+                if self.first_event_seconds is None:
+                    self.first_event_seconds = received - started
+
+
+async def run_clients(port: int, assignments: List[List[str]], duration: float, connect_concurrency: int) -> List[SubscriberClient]:
+    """以有限並行數逐步建立連線，所有客戶端在同一時間結束"""
+    clients = [SubscriberClient(port, subscriptions) for subscriptions in assignments]
+    deadline = time.time() + duration
+    semaphore = asyncio.Semaphore(connect_concurrency)
+
+    async def start(client: SubscriberClient):
+        async with semaphore:
+            task = asyncio.create_task(client.run(deadline))
+            # 釋放名額前等待連線建立 (或失敗)
+            while not client.connected and client.error is None and not task.done():
+                await asyncio.sleep(0.01)
+        await task
+
+    await asyncio.gather(*(start(client) for client in clients))
+    return clients
+
+
+def summarize(clients: List[SubscriberClient], health: Dict[str, Any], upstream_requests: int,
+              args: argparse.Namespace, server_rss: Optional[int], server_cpu: Optional[float]) -> Dict[str, Any]:
+    connected = [c for c in clients if c.connected]
+    lags = [lag for c in connected for lag in c.delivery_lags]
+    first_events = [c.first_event_seconds for c in connected if c.first_event_seconds is not None]
+    connects = [c.connect_seconds for c in connected]
+    errors: Dict[str, int] = {}
+    for client in clients:
+        if client.error:
+            errors[client.error] = errors.get(client.error, 0) + 1
+
+    unique_subscriptions = len({s for c in clients for s in c.subscriptions})
+    # 每個客戶端每 poll 秒各自調用每個訂閱一次 (App / 網頁現時的做法)
+    naive_requests = int(sum(len(c.subscriptions) for c in connected) * args.duration / args.poll)
+
+    return {
+        'duration': args.duration,
+        'subscribers': len(clients),
+        'connected': len(connected),
+        'errors': errors,
+        'unique_subscriptions': unique_subscriptions,
+        'events_received': sum(c.events for c in connected),
+        'events_per_second': round(sum(c.events for c in connected) / args.duration, 1),
+        'connect_p50_ms': round(statistics.median(connects) * 1000, 1) if connects else None,
+        'connect_p95_ms': round(percentile(connects, 95) * 1000, 1) if connects else None,
+        'first_event_p50_ms': round(statistics.median(first_events) * 1000, 1) if first_events else None,
+        'first_event_p95_ms': round(percentile(first_events, 95) * 1000, 1) if first_events else None,
+        'delivery_lag_p50_ms': round(percentile(lags, 50) * 1000, 1) if lags else None,
+        'delivery_lag_p95_ms': round(percentile(lags, 95) * 1000, 1) if lags else None,
+        'delivery_lag_p99_ms': round(percentile(lags, 99) * 1000, 1) if lags else None,
+        'upstream_requests': upstream_requests,
+        'naive_client_polling_requests': naive_requests,
+        'server_rss_bytes': server_rss,
+        'server_cpu_seconds': round(server_cpu, 2) if server_cpu is not None else None,
+        'server_health': health
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print()
+    print(f"👥 Subscribers connected:    {result['connected']}/{result['subscribers']}"
+          + (f"  errors: {result['errors']}" if result['errors'] else ''))
+    print(f"🎯 Unique subscriptions:     {result['unique_subscriptions']} "
+          f"({result['server_health']['upstream_urls']} upstream URLs)")
+    print(f"📨 Events received:          {result['events_received']} ({result['events_per_second']}/s)")
+    print(f"🔌 Connect + subscribe:      p50 {result['connect_p50_ms']} ms, p95 {result['connect_p95_ms']} ms")
+    print(f"⏱️  First event:              p50 {result['first_event_p50_ms']} ms, p95 {result['first_event_p95_ms']} ms")
+    print(f"🚚 Delivery lag after poll:  p50 {result['delivery_lag_p50_ms']} ms, p95 {result['delivery_lag_p95_ms']} ms, "
+          f"p99 {result['delivery_lag_p99_ms']} ms")
+    print(f"🌐 Upstream ETA requests:    {result['upstream_requests']} "
+          f"(per-client polling would need ~{result['naive_client_polling_requests']})")
+    if result['server_rss_bytes']:
+        print(f"💾 Server RSS:               {result['server_rss_bytes'] / 1024 / 1024:.1f} MB")
+    if result['server_cpu_seconds'] is not None:
+        print(f"🖥️  Server CPU:               {result['server_cpu_seconds']}s "
+              f"({result['server_cpu_seconds'] / result['duration'] * 100:.0f}% of one core)")
+    print("   (the client load runs in this process; on small machines it competes with the server for CPU)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test for the server-sent ETA stream against a mock upstream')
+    parser.add_argument('--subscribers', type=int, default=2000, help='Concurrent SSE connections (default: 2000)')
+    parser.add_argument('--per-subscriber', type=int, default=5, help='Subscriptions per connection (default: 5)')
+    parser.add_argument('--pool', type=int, default=500, help='Distinct (route, stop) pairs to draw from (default: 500)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds every subscriber stays connected (default: 30)')
+    parser.add_argument('--poll', type=float, default=2, help='Stream server poll interval in seconds (default: 2)')
+    parser.add_argument('--eta-speedup', type=float, default=60,
+                        help='Mock ETA headway speedup so ETAs change during the test (default: 60)')
+    parser.add_argument('--latency', default='lognormal:0.05:0.4', help='Mock upstream latency distribution')
+    parser.add_argument('--scale', type=float, default=0.2, help='Mock network size as a multiple of the current network')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='Connections opened in parallel')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    rng = random.Random(args.seed)
+
+    print("=" * 70)
+    print("📡 HK Bus ETA Stream - Load Test")
+    print("=" * 70)
+
+    network = generate_network(scale=args.scale, seed=args.seed)
+    behaviour = MockAPIBehaviour(args.latency, seed=args.seed)
+    server = MockBusAPIServer(NetworkResponder(network, eta_speedup=args.eta_speedup), behaviour)
+    server.start()
+
+    stream_process = None
+    try:
+        with tempfile.TemporaryDirectory(prefix='hkbus_stream_') as tmp_dir:
+            tmp_path = Path(tmp_dir)
+            print("🧪 Collecting bus_data.json from the mock upstream...")
+            data_file = build_bus_data(server, tmp_dir)
+
+            pool = subscription_pool(data_file, args.pool, rng)
+            # Zipf 分佈：少數熱門組合被大量訂閱者共用
+            weights = [1 / (rank + 1) for rank in range(len(pool))]
+            assignments = [sorted(set(rng.choices(pool, weights=weights, k=args.per_subscriber)))
+                           for _ in range(args.subscribers)]
+
+            stream_process, port = start_stream_server(data_file, server, args.poll, tmp_path / 'stream.log')
+            print(f"🚀 Stream server on port {port}; opening {args.subscribers} subscribers for {args.duration:.0f}s")
+
+            requests_before = behaviour.counters['requests']
+            cpu_before = process_cpu_seconds(stream_process.pid)
+            clients = asyncio.run(run_clients(port, assignments, args.duration, args.connect_concurrency))
+            upstream_requests = behaviour.counters['requests'] - requests_before
+            cpu_after = process_cpu_seconds(stream_process.pid)
+            server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+
+            health = fetch_health(port)
+            server_rss = process_rss_bytes(stream_process.pid)
+    finally:
+        if stream_process is not None:
+            stream_process.terminate()
+            stream_process.wait(timeout=10)
+        server.stop()
+
+    result = summarize(clients, health, upstream_requests, args, server_rss, server_cpu)
+    print_report(result)
+
+    if args.output:
+        report = {'generated_at': datetime.now().isoformat(), 'settings': vars(args), 'result': result}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
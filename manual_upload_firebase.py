@@ -3,40 +3,64 @@
 手動上傳 bus_data.json 和 bus_data_metadata.json 到 Firebase Storage
 
 使用方式:
-  python3 manual_upload_firebase.py
+  python3 manual_upload_firebase.py                 # bus_data.json + metadata
+  python3 manual_upload_firebase.py --gzip          # 同時生成並上傳 bus_data.json.gz
+  python3 manual_upload_firebase.py --extra FILE    # 一併上傳其他文件 (可重複)
+
+metadata 文件有效且校驗碼相符時，直接信任該文件，不會解析 bus_data.json
 
 環境變數 (.env 文件):
   FIREBASE_SERVICE_ACCOUNT_PATH=/path/to/service-account.json
   FIREBASE_STORAGE_BUCKET=your-project.appspot.com
+  STORAGE_BACKEND=firebase (或 local，配合 LOCAL_STORAGE_DIR)
 """
 
 import os
 import sys
 import json
+import gzip
+import mmap
+import shutil
 import hashlib
+import logging
+import argparse
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 
-# Check Firebase libraries
+from storage_backends import METADATA_OBJECT, create_storage_backend, upload_artifacts
+
+# Firebase libraries (只有 STORAGE_BACKEND=firebase 時需要)
 try:
     import firebase_admin
-    from firebase_admin import credentials, storage
+    from firebase_admin import credentials
 except ImportError:
-    print("❌ Error: Firebase libraries not installed")
-    print("   Install with: pip3 install firebase-admin python-dotenv")
-    sys.exit(1)
+    firebase_admin = None
+
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+METADATA_REQUIRED_FIELDS = ['version', 'generated_at', 'file_size_bytes', 'md5_checksum', 'sha256_checksum', 'summary']
 
 
 def calculate_checksums(file_path):
-    """計算 MD5 和 SHA256 校驗碼"""
+    """計算 MD5 和 SHA256 校驗碼 (mmap 整個文件，以 8 MB 區塊更新雜湊，不複製數據)"""
     md5_hash = hashlib.md5()
     sha256_hash = hashlib.sha256()
 
     with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            md5_hash.update(chunk)
-            sha256_hash.update(chunk)
+        if os.fstat(f.fileno()).st_size == 0:
+            return md5_hash.hexdigest(), sha256_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), HASH_BLOCK_SIZE):
+                    block = view[offset:offset + HASH_BLOCK_SIZE]
+                    md5_hash.update(block)
+                    sha256_hash.update(block)
+                    block.release()
+            finally:
+                view.release()
 
     return md5_hash.hexdigest(), sha256_hash.hexdigest()
 
@@ -84,30 +108,46 @@ def initialize_firebase():
         return False
 
 
+def load_sidecar_metadata(metadata_file):
+    """讀取 metadata 文件；缺少必要欄位或格式錯誤返回 None"""
+    if not metadata_file.exists():
+        return None
+    try:
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(metadata, dict) or any(field not in metadata for field in METADATA_REQUIRED_FIELDS):
+        return None
+    return metadata
+
+
 def generate_or_verify_metadata(data_path):
-    """生成或驗證 metadata 文件"""
+    """
+    生成或驗證 metadata 文件，返回 (metadata 路徑, metadata)
+    快速路徑：metadata 有效且大小/MD5/SHA256 相符時直接使用，不解析數據文件
+    """
     data_file = Path(data_path)
     metadata_file = data_file.parent / 'bus_data_metadata.json'
 
-    # Read data file
-    with open(data_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # Calculate checksums
-    md5_checksum, sha256_checksum = calculate_checksums(data_file)
     file_size = data_file.stat().st_size
+    existing_metadata = load_sidecar_metadata(metadata_file)
 
-    # Check if metadata exists and is up-to-date
-    if metadata_file.exists():
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            existing_metadata = json.load(f)
+    md5_checksum, sha256_checksum = calculate_checksums(data_file)
 
-        # Verify MD5 match
-        if existing_metadata.get('md5_checksum') == md5_checksum:
+    if existing_metadata is not None:
+        if existing_metadata.get('file_size_bytes') == file_size and \
+                existing_metadata.get('md5_checksum') == md5_checksum and \
+                existing_metadata.get('sha256_checksum') == sha256_checksum:
             print(f"✅ Metadata file exists and matches: {metadata_file}")
-            return str(metadata_file)
-        else:
-            print(f"⚠️  Metadata outdated, regenerating...")
+            return str(metadata_file), existing_metadata
+        print(f"⚠️  Metadata outdated, regenerating...")
+    elif metadata_file.exists():
+        print(f"⚠️  Metadata invalid, regenerating...")
+
+    # Read data file (只在 metadata 需要重新生成時；bus_data.bin 相符時不需解析整份 JSON)
+    from bus_data_reader import load_bus_data_header, summary_companies
+    data = load_bus_data_header(data_file, sha256_checksum)
 
     # Create metadata
     metadata = {
@@ -120,10 +160,11 @@ def generate_or_verify_metadata(data_path):
             'total_routes': data.get('summary', {}).get('total_routes', 0),
             'total_stops': data.get('summary', {}).get('total_stops', 0),
             'total_mappings': data.get('summary', {}).get('total_stop_route_mappings', 0),
-            'companies': ['KMB', 'CTB', 'NWFB']
+            'companies': summary_companies(data.get('summary', {}))
         },
         'download_url': f"gs://{os.getenv('FIREBASE_STORAGE_BUCKET')}/bus_data.json"
     }
+    del data
 
     # Save metadata
     with open(metadata_file, 'w', encoding='utf-8') as f:
@@ -134,45 +175,96 @@ def generate_or_verify_metadata(data_path):
     print(f"   MD5: {md5_checksum}")
     print(f"   File size: {file_size:,} bytes ({file_size/1024/1024:.2f} MB)")
 
-    return str(metadata_file)
+    return str(metadata_file), metadata
+
+
+def ensure_gzip_variant(data_path, metadata):
+    """
+    生成 bus_data.json.gz；mtime 固定為 0，相同內容得到相同的壓縮文件
+    bus_data.json.gz.sha256 記錄壓縮時數據文件的 SHA256，與 metadata 相同時沿用 (不依賴文件修改時間)
+    """
+    data_file = Path(data_path)
+    gzip_file = data_file.with_name(data_file.name + '.gz')
+    sidecar_file = gzip_file.with_name(gzip_file.name + '.sha256')
+
+    if gzip_file.exists() and sidecar_file.exists() and \
+            sidecar_file.read_text(encoding='utf-8').strip() == metadata['sha256_checksum']:
+        print(f"✅ Compressed variant up to date: {gzip_file}")
+        return str(gzip_file)
+
+    tmp_file = gzip_file.with_suffix('.gz.tmp')
+    with open(data_file, 'rb') as src, open(tmp_file, 'wb') as raw:
+        with gzip.GzipFile(filename=data_file.name, mode='wb', fileobj=raw, compresslevel=9, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, HASH_BLOCK_SIZE)
+    os.replace(tmp_file, gzip_file)
+    sidecar_file.write_text(metadata['sha256_checksum'] + '\n', encoding='utf-8')
+
+    gzip_size = gzip_file.stat().st_size
+    print(f"🗜️  Compressed variant generated: {gzip_file} "
+          f"({gzip_size:,} bytes, {gzip_size / max(1, metadata['file_size_bytes']) * 100:.1f}% of original)")
+    return str(gzip_file)
+
+
+def blob_metadata_for(data_path, metadata):
+    """bus_data.json 的 blob metadata (取自 metadata，不解析數據文件)"""
+    return {
+        'version': str(metadata.get('version') or 0),
+        'generated_at': metadata.get('generated_at') or '',
+        'file_size': str(Path(data_path).stat().st_size),
+        'total_routes': str(metadata.get('summary', {}).get('total_routes', 0)),
+        'total_stops': str(metadata.get('summary', {}).get('total_stops', 0))
+    }
 
 
-def upload_file(local_path, remote_name, content_type='application/json'):
-    """上傳文件到 Firebase Storage"""
+def build_artifact_set(data_path, metadata_path, metadata, gzip_path=None, extra_paths=()):
+    """一次發佈的文件集合: [(local_path, remote_name, content_type, blob_metadata), ...]"""
+    data_blob_metadata = blob_metadata_for(data_path, metadata)
+    artifacts = [
+        (data_path, 'bus_data.json', 'application/json', data_blob_metadata),
+        (metadata_path, METADATA_OBJECT, 'application/json', None)
+    ]
+    if gzip_path:
+        artifacts.append((gzip_path, Path(gzip_path).name, 'application/gzip', {
+            'version': data_blob_metadata['version'],
+            'uncompressed_sha256': metadata['sha256_checksum'],
+            'uncompressed_size': str(metadata['file_size_bytes'])
+        }))
+    for extra_path in extra_paths:
+        content_type = 'application/json' if extra_path.endswith('.json') else 'application/octet-stream'
+        artifacts.append((extra_path, Path(extra_path).name, content_type, {'version': data_blob_metadata['version']}))
+    return artifacts
+
+
+def upload_files(artifacts):
+    """一次批量並行上傳整個文件集合 (分塊、可續傳、generation 前置條件)"""
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(remote_name)
-
-        # Read metadata if it's the data file
-        if remote_name == 'bus_data.json':
-            with open(local_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # Set blob metadata
-            blob.metadata = {
-                'version': str(data.get('version', 0)),
-                'generated_at': data.get('generated_at', ''),
-                'file_size': str(Path(local_path).stat().st_size),
-                'total_routes': str(data.get('summary', {}).get('total_routes', 0)),
-                'total_stops': str(data.get('summary', {}).get('total_stops', 0))
-            }
-
-        # Upload file
-        blob.upload_from_filename(local_path, content_type=content_type)
-
-        # Get file size
-        file_size = Path(local_path).stat().st_size
-
-        print(f"✅ Uploaded: {remote_name} ({file_size:,} bytes / {file_size/1024/1024:.2f} MB)")
-        return True
+        backend = create_storage_backend(state_dir=Path(artifacts[0][0]).parent)
+        ok, results = upload_artifacts(backend, artifacts)
+
+        for result in results:
+            file_size = result['bytes']
+            print(f"✅ Uploaded: {result['remote_name']} ({file_size:,} bytes / {file_size/1024/1024:.2f} MB "
+                  f"in {result['seconds']:.2f}s)")
+        return ok
 
     except Exception as e:
-        print(f"❌ Upload failed for {remote_name}: {e}")
+        print(f"❌ Upload failed: {e}")
         return False
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Publish bus data artifacts to Firebase Storage')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Also generate (if stale) and publish bus_data.json.gz')
+    parser.add_argument('--extra', action='append', default=[], metavar='FILE',
+                        help='Additional file to publish in the same batch (repeatable)')
+    return parser.parse_args()
+
+
 def main():
     """主執行函數"""
+    args = parse_args()
+
     print("=" * 70)
     print("🔥 HKBusApp - Manual Firebase Upload")
     print("=" * 70)
@@ -180,10 +272,18 @@ def main():
 
     # Load environment variables
     load_dotenv()
-
-    # Verify environment
-    if not verify_environment():
-        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='   %(message)s')
+
+    # Verify environment (其他儲存後端不需要 Firebase 設定)
+    storage_backend = os.getenv('STORAGE_BACKEND', 'firebase').lower()
+    use_firebase = storage_backend == 'firebase'
+    if use_firebase:
+        if firebase_admin is None:
+            print("❌ Error: Firebase libraries not installed")
+            print("   Install with: pip3 install firebase-admin python-dotenv")
+            sys.exit(1)
+        if not verify_environment():
+            sys.exit(1)
 
     # Get data file path
     script_dir = Path(__file__).parent.absolute()
@@ -199,24 +299,28 @@ def main():
     print(f"📂 Data file: {data_file}")
     print()
 
+    missing_extra = [path for path in args.extra if not os.path.exists(path)]
+    if missing_extra:
+        print(f"❌ Extra artifact not found: {', '.join(missing_extra)}")
+        sys.exit(1)
+
     # Generate or verify metadata
-    metadata_file = generate_or_verify_metadata(str(data_file))
+    metadata_file, metadata = generate_or_verify_metadata(str(data_file))
+    gzip_file = ensure_gzip_variant(str(data_file), metadata) if args.gzip else None
     print()
 
     # Initialize Firebase
-    if not initialize_firebase():
-        sys.exit(1)
+    if use_firebase:
+        if not initialize_firebase():
+            sys.exit(1)
+    else:
+        print(f"📁 Storage backend: {storage_backend} (Firebase not used)")
     print()
 
-    # Upload bus_data.json
-    print("📤 Uploading bus_data.json...")
-    if not upload_file(str(data_file), 'bus_data.json'):
-        sys.exit(1)
-    print()
-
-    # Upload bus_data_metadata.json
-    print("📤 Uploading bus_data_metadata.json...")
-    if not upload_file(metadata_file, 'bus_data_metadata.json'):
+    # Upload the whole artifact set in one parallel batch
+    artifacts = build_artifact_set(str(data_file), metadata_file, metadata, gzip_file, args.extra)
+    print(f"📤 Uploading {', '.join(remote_name for _, remote_name, _, _ in artifacts)}...")
+    if not upload_files(artifacts):
         sys.exit(1)
     print()
 
@@ -226,9 +330,6 @@ def main():
     print()
 
     # Display summary
-    with open(metadata_file, 'r', encoding='utf-8') as f:
-        metadata = json.load(f)
-
     print("📊 Upload Summary:")
     print(f"   Version: {metadata['version']}")
     print(f"   Generated: {metadata['generated_at']}")
@@ -237,7 +338,7 @@ def main():
     print(f"   Routes: {metadata['summary']['total_routes']:,}")
     print(f"   Stops: {metadata['summary']['total_stops']:,}")
     print()
-    print(f"☁️  Firebase URL: {metadata['download_url']}")
+    print(f"☁️  Firebase URL: {metadata.get('download_url', 'gs://' + os.getenv('FIREBASE_STORAGE_BUCKET', '') + '/bus_data.json')}")
     print("✅ Ready for iOS app download!")
     print("=" * 70)
 
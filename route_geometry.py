@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+每條路線的幾何資料 (站間距離、累計距離、範圍框)
+- route_stops 只有站點 ID 及 sequence；客戶端按距離排序或估算剩餘車程時不需再自行計算 haversine
+- 所有路線的站點座標攤平成一個陣列，以 NumPy 一次過計算全部站間距離、累計距離及範圍框
+- 未安裝 NumPy 時退回純 Python 逐站計算 (結果相同，bench 子命令比較兩者耗時)
+- 缺少座標的站點：相鄰的站間距離記為 0，並在統計中報告
+
+route_geometry.json 格式 (距離為整數米；第 n 個值對應按 sequence 排序後的第 n 個站):
+  {"version", "units": "m", "routes": {"KMB_1A_O": [[min_lat, min_lon, max_lat, max_lon], [0, 312, 845, ...]], ...},
+   "stats": {...}}
+  路線全長 = 累計距離最後一個值；站間距離 = 相鄰累計距離之差
+
+使用方式:
+  python3 route_geometry.py build     # 由 OUTPUT_DIRECTORY/bus_data.json 建立
+  python3 route_geometry.py bench     # NumPy 與純 Python 的耗時比較
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from transfer_graph import EARTH_RADIUS_M, haversine_m
+
+GEOMETRY_FILENAME = 'route_geometry.json'
+BBOX_DECIMALS = 5              # 約 1 米
+
+# derived_artifacts 的快取輸入
+ARTIFACT_INPUTS = ('stops', 'route_stops')
+
+
+def numpy_module():
+    """NumPy 為可選依賴"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def flatten_routes(bus_data: Dict[str, Any]) -> Tuple[List[str], List[float], List[float], List[int]]:
+    """
+    所有路線按 sequence 排序後的站點座標攤平為兩個列表
+    返回 (route_ids, latitudes, longitudes, offsets)；第 i 條路線佔 offsets[i]:offsets[i + 1]，缺少座標為 NaN
+    """
+    stops = bus_data.get('stops', {})
+    route_ids, latitudes, longitudes, offsets = [], [], [], [0]
+    for route_id in sorted(bus_data.get('route_stops', {})):
+        sequence = sorted(bus_data['route_stops'][route_id], key=lambda stop: int(stop['sequence']))
+        if not sequence:
+            continue
+        route_ids.append(route_id)
+        for entry in sequence:
+            stop = stops.get(entry['stop_id'], {})
+            latitude, longitude = stop.get('latitude'), stop.get('longitude')
+            if latitude is None or longitude is None:
+                latitudes.append(math.nan)
+                longitudes.append(math.nan)
+            else:
+                latitudes.append(float(latitude))
+                longitudes.append(float(longitude))
+        offsets.append(len(latitudes))
+    return route_ids, latitudes, longitudes, offsets
+
+
+def compute_geometry_numpy(latitudes: List[float], longitudes: List[float],
+                           offsets: List[int]) -> Tuple[List[float], List[List[float]]]:
+    """NumPy 批量計算：返回 (攤平的累計距離, 每條路線的範圍框)"""
+    np = numpy_module()
+    if len(offsets) < 2:
+        return [], []
+    lat_deg = np.asarray(latitudes, dtype=np.float64)
+    lon_deg = np.asarray(longitudes, dtype=np.float64)
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    counts = np.diff(np.asarray(offsets, dtype=np.int64))
+
+    lat = np.radians(lat_deg)
+    lon = np.radians(lon_deg)
+    a = np.sin((lat[1:] - lat[:-1]) / 2) ** 2 + \
+        np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin((lon[1:] - lon[:-1]) / 2) ** 2
+    segments = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    # step[i] = 第 i - 1 站到第 i 站的距離；每條路線的第一站 (及缺少座標的站間) 為 0
+    steps = np.zeros(len(lat_deg))
+    steps[1:] = np.nan_to_num(segments, nan=0.0)
+    steps[starts] = 0.0
+    cumulative = np.cumsum(steps)
+    cumulative -= np.repeat(cumulative[starts], counts)
+
+    bboxes = np.stack([
+        np.fmin.reduceat(lat_deg, starts), np.fmin.reduceat(lon_deg, starts),
+        np.fmax.reduceat(lat_deg, starts), np.fmax.reduceat(lon_deg, starts)
+    ], axis=1)
+    return cumulative.tolist(), bboxes.tolist()
+
+
+def compute_geometry_python(latitudes: List[float], longitudes: List[float],
+                            offsets: List[int]) -> Tuple[List[float], List[List[float]]]:
+    """純 Python 逐條路線計算 (NumPy 不可用時使用，亦作 bench 對照)"""
+    cumulative: List[float] = []
+    bboxes: List[List[float]] = []
+    for start, end in zip(offsets, offsets[1:]):
+        total = 0.0
+        cumulative.append(0.0)
+        for index in range(start + 1, end):
+            lat1, lon1, lat2, lon2 = latitudes[index - 1], longitudes[index - 1], latitudes[index], longitudes[index]
+            if not (math.isnan(lat1) or math.isnan(lat2)):
+                total += haversine_m(lat1, lon1, lat2, lon2)
+            cumulative.append(total)
+
+        route_lats = [value for value in latitudes[start:end] if not math.isnan(value)]
+        route_lons = [value for value in longitudes[start:end] if not math.isnan(value)]
+        if route_lats:
+            bboxes.append([min(route_lats), min(route_lons), max(route_lats), max(route_lons)])
+        else:
+            bboxes.append([math.nan] * 4)
+    return cumulative, bboxes
+
+
+def compute_geometry(latitudes: List[float], longitudes: List[float], offsets: List[int],
+                     backend: str = 'auto') -> Tuple[List[float], List[List[float]], str]:
+    """backend: 'auto' (有 NumPy 時使用)、'numpy' 或 'python'；返回 (累計距離, 範圍框, 實際使用的 backend)"""
+    if backend == 'auto':
+        backend = 'numpy' if numpy_module() is not None else 'python'
+    if backend == 'numpy':
+        return (*compute_geometry_numpy(latitudes, longitudes, offsets), 'numpy')
+    return (*compute_geometry_python(latitudes, longitudes, offsets), 'python')
+
+
+def build_route_geometry(bus_data: Dict[str, Any], backend: str = 'auto') -> Dict[str, Any]:
+    """建立 route_geometry.json 的內容"""
+    route_ids, latitudes, longitudes, offsets = flatten_routes(bus_data)
+    cumulative, bboxes, backend = compute_geometry(latitudes, longitudes, offsets, backend)
+
+    routes = {}
+    total_m = 0.0
+    for index, route_id in enumerate(route_ids):
+        start, end = offsets[index], offsets[index + 1]
+        bbox = [round(value, BBOX_DECIMALS) if not math.isnan(value) else None for value in bboxes[index]]
+        routes[route_id] = [bbox, [int(round(value)) for value in cumulative[start:end]]]
+        total_m += cumulative[end - 1]
+
+    return {
+        'version': bus_data.get('version'),
+        'units': 'm',
+        'routes': routes,
+        'stats': {
+            'routes': len(route_ids),
+            'route_stops': len(latitudes),
+            'missing_coordinates': sum(1 for value in latitudes if math.isnan(value)),
+            'total_route_km': round(total_m / 1000, 1),
+            'backend': backend
+        }
+    }
+
+
+def build_and_write(bus_data: Dict[str, Any], output_dir: Path, backend: str = 'auto') -> Tuple[str, Dict[str, Any]]:
+    """收集流程的後處理階段：建立並寫入 route_geometry.json，返回 (路徑, 統計)"""
+    start_time = time.time()
+    geometry = build_route_geometry(bus_data, backend)
+    build_seconds = time.time() - start_time
+
+    output_file = Path(output_dir) / GEOMETRY_FILENAME
+    tmp_file = output_file.with_suffix('.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(geometry, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_file, output_file)
+
+    return str(output_file), {
+        **geometry['stats'],
+        'file_size_bytes': output_file.stat().st_size,
+        'build_seconds': round(build_seconds, 3)
+    }
+
+
+class RouteGeometry:
+    """route_geometry.json 的查詢 API (position 為按 sequence 排序後的站點位置，由 0 開始)"""
+
+    def __init__(self, geometry: Dict[str, Any]):
+        self.version = geometry.get('version')
+        self.routes: Dict[str, List[Any]] = geometry['routes']
+
+    @classmethod
+    def load(cls, path: Path) -> 'RouteGeometry':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def bbox(self, route_id: str) -> Optional[List[float]]:
+        route = self.routes.get(route_id)
+        return route[0] if route else None
+
+    def cumulative_m(self, route_id: str) -> List[int]:
+        route = self.routes.get(route_id)
+        return route[1] if route else []
+
+    def length_m(self, route_id: str) -> int:
+        cumulative = self.cumulative_m(route_id)
+        return cumulative[-1] if cumulative else 0
+
+    def distance_m(self, route_id: str, from_position: int, to_position: int) -> int:
+        """同一路線兩個站之間的行車距離"""
+        cumulative = self.cumulative_m(route_id)
+        return cumulative[to_position] - cumulative[from_position]
+
+
+def run_bench(bus_data: Dict[str, Any], repeat: int):
+    """兩個 backend 各計算 repeat 次取最佳耗時，並確認結果一致"""
+    start_time = time.perf_counter()
+    route_ids, latitudes, longitudes, offsets = flatten_routes(bus_data)
+    flatten_ms = (time.perf_counter() - start_time) * 1000
+    print(f"📐 {len(route_ids):,} routes, {len(latitudes):,} route stops (flatten: {flatten_ms:.1f} ms)\n")
+
+    results = {}
+    timings = {}
+    backends = ['python'] + (['numpy'] if numpy_module() is not None else [])
+    for backend in backends:
+        best = math.inf
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            results[backend] = compute_geometry(latitudes, longitudes, offsets, backend)
+            best = min(best, time.perf_counter() - start_time)
+        timings[backend] = best * 1000
+
+    print(f"{'backend':<10} {'best of ' + str(repeat):>12} {'speedup':>9}")
+    print("-" * 33)
+    for backend in backends:
+        print(f"{backend:<10} {timings[backend]:>9.1f} ms {timings['python'] / timings[backend]:>8.1f}x")
+
+    if 'numpy' in results:
+        max_diff = max((abs(a - b) for a, b in zip(results['python'][0], results['numpy'][0])), default=0.0)
+        print(f"\n   max cumulative distance difference: {max_diff:.2e} m")
+    else:
+        print("\n⚠️  NumPy not installed (pip3 install numpy); only the pure-Python backend was timed")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Per-route inter-stop distances, cumulative length and bounding boxes')
+    parser.add_argument('data_file', nargs='?', help='bus_data.json (default: OUTPUT_DIRECTORY/bus_data.json)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build route_geometry.json from bus_data.json')
+    build_parser.add_argument('--backend', choices=['auto', 'numpy', 'python'], default='auto')
+
+    bench_parser = subparsers.add_parser('bench', help='Time the NumPy pass against a pure-Python loop')
+    bench_parser.add_argument('--repeat', type=int, default=5, help='Runs per backend (default: 5)')
+    return parser.parse_args(argv)
+
+
+def main():
+    from collect_bus_data_optimized_concurrent import default_data_file, load_bus_data, load_environment
+
+    args = parse_args()
+    load_environment()
+    data_file = Path(args.data_file) if args.data_file else default_data_file()
+    if not data_file.exists():
+        print(f"❌ Data file not found: {data_file}")
+        sys.exit(2)
+    bus_data = load_bus_data(data_file)
+
+    if args.command == 'bench':
+        run_bench(bus_data, args.repeat)
+        return
+
+    if args.backend == 'numpy' and numpy_module() is None:
+        print("❌ NumPy not installed (pip3 install numpy)")
+        sys.exit(2)
+    path, stats = build_and_write(bus_data, data_file.parent, args.backend)
+    print(f"✅ Route geometry written: {path}")
+    print(f"   {stats['routes']:,} routes, {stats['route_stops']:,} route stops, {stats['total_route_km']:,} km total "
+          f"({stats['missing_coordinates']} stops without coordinates)")
+    print(f"   {stats['file_size_bytes'] / 1024:.0f} KB, built in {stats['build_seconds']:.2f}s ({stats['backend']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+預先計算的站點聚類圖塊金字塔 (地圖顯示用)
+- 每個縮放級別使用標準 Web Mercator 圖塊 (z/x/y，256 px)
+- 網格聚類：每個圖塊再分成 CLUSTER_CELL_PX 大小的格子，同一格子的站點合併為一個聚類
+- 每個聚類記錄質心 (成員座標平均)、站點數量及站點 index (對應 stop_ids 列表)
+- 一次過輸出 stop_tiles.json (所有級別)，並報告每個級別的圖塊數量及大小
+
+stop_tiles.json 格式:
+  {"version", "zooms": [10, ...], "cluster_px": 64, "stop_ids": [...],
+   "tiles": {"z/x/y": [[lat, lon, count, [stop index, ...]], ...]}, "stats": {...}}
+
+使用方式:
+  python3 stop_tiles.py build                      # 由 OUTPUT_DIRECTORY/bus_data.json 建立
+  python3 stop_tiles.py lookup 22.3193 114.1694 14 # 該位置所在圖塊的聚類
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import statistics
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+TILES_FILENAME = 'stop_tiles.json'
+TILE_SIZE_PX = 256
+DEFAULT_ZOOMS = '10-16'        # 低於 10 全港只有少數聚類；高於 16 客戶端直接顯示個別站點
+DEFAULT_CLUSTER_PX = 64        # 每個圖塊 4 x 4 個聚類格子
+MAX_MERCATOR_LAT = 85.05112878
+
+# derived_artifacts 的快取輸入
+ARTIFACT_INPUTS = ('stops',)
+ARTIFACT_ENV = ('STOP_TILES_ZOOMS', 'STOP_TILES_CLUSTER_PX')
+
+
+def parse_zooms(spec: str) -> List[int]:
+    """'10-16' 或 '10,12,14'"""
+    if '-' in spec:
+        low, high = (int(part) for part in spec.split('-', 1))
+        return list(range(low, high + 1))
+    return sorted(int(part) for part in spec.split(',') if part.strip())
+
+
+def mercator(lat: float, lon: float) -> Tuple[float, float]:
+    """經緯度 → Web Mercator 世界座標 (0..1)"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def tile_for(lat: float, lon: float, zoom: int) -> Tuple[int, int]:
+    x, y = mercator(lat, lon)
+    scale = 1 << zoom
+    return min(scale - 1, int(x * scale)), min(scale - 1, int(y * scale))
+
+
+def build_stop_tiles(bus_data: Dict[str, Any], zooms: List[int],
+                     cluster_px: int = DEFAULT_CLUSTER_PX) -> Dict[str, Any]:
+    """所有縮放級別的網格聚類 (每個站點的 Mercator 座標只計算一次)"""
+    if TILE_SIZE_PX % cluster_px:
+        raise ValueError(f"cluster_px must divide {TILE_SIZE_PX}: {cluster_px}")
+    cells_per_tile = TILE_SIZE_PX // cluster_px
+
+    stop_ids = sorted(bus_data['stops'])
+    points = []
+    for index, stop_id in enumerate(stop_ids):
+        stop = bus_data['stops'][stop_id]
+        lat, lon = stop['latitude'], stop['longitude']
+        if math.isnan(lat) or math.isnan(lon):
+            continue
+        x, y = mercator(lat, lon)
+        points.append((index, lat, lon, x, y))
+
+    tiles: Dict[str, List[List[Any]]] = {}
+    stats: Dict[str, Dict[str, Any]] = {}
+    for zoom in zooms:
+        cells_across = (1 << zoom) * cells_per_tile
+        cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = defaultdict(list)
+        for index, lat, lon, x, y in points:
+            cells[(int(x * cells_across), int(y * cells_across))].append((index, lat, lon))
+
+        zoom_tiles: Dict[Tuple[int, int], List[List[Any]]] = defaultdict(list)
+        for (cell_x, cell_y), members in cells.items():
+            count = len(members)
+            zoom_tiles[(cell_x // cells_per_tile, cell_y // cells_per_tile)].append([
+                round(sum(m[1] for m in members) / count, 6),
+                round(sum(m[2] for m in members) / count, 6),
+                count,
+                sorted(m[0] for m in members)
+            ])
+
+        sizes = []
+        for (tile_x, tile_y), clusters in zoom_tiles.items():
+            clusters.sort(key=lambda cluster: (-cluster[2], cluster[0], cluster[1]))
+            tiles[f"{zoom}/{tile_x}/{tile_y}"] = clusters
+            sizes.append(len(json.dumps(clusters, separators=(',', ':'))))
+        stats[str(zoom)] = {
+            'tiles': len(zoom_tiles),
+            'clusters': len(cells),
+            'max_cluster_size': max((len(m) for m in cells.values()), default=0),
+            'tile_bytes_median': int(statistics.median(sizes)) if sizes else 0,
+            'tile_bytes_max': max(sizes, default=0),
+            'tile_bytes_total': sum(sizes)
+        }
+
+    return {
+        'version': bus_data.get('version'),
+        'zooms': zooms,
+        'tile_size_px': TILE_SIZE_PX,
+        'cluster_px': cluster_px,
+        'stop_ids': stop_ids,
+        'tiles': tiles,
+        'stats': stats
+    }
+
+
+def build_and_write(bus_data: Dict[str, Any], output_dir: Path, zooms: Optional[List[int]] = None,
+                    cluster_px: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """收集流程的後處理階段：建立並寫入 stop_tiles.json，返回 (路徑, 統計)"""
+    zooms = zooms or parse_zooms(os.getenv('STOP_TILES_ZOOMS', DEFAULT_ZOOMS))
+    cluster_px = cluster_px or int(os.getenv('STOP_TILES_CLUSTER_PX', str(DEFAULT_CLUSTER_PX)))
+
+    start_time = time.time()
+    pyramid = build_stop_tiles(bus_data, zooms, cluster_px)
+    build_seconds = time.time() - start_time
+
+    output_file = Path(output_dir) / TILES_FILENAME
+    tmp_file = output_file.with_suffix('.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(pyramid, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_file, output_file)
+
+    return str(output_file), {
+        'zooms': zooms,
+        'tiles': len(pyramid['tiles']),
+        'file_size_bytes': output_file.stat().st_size,
+        'build_seconds': round(build_seconds, 3),
+        'per_zoom': pyramid['stats']
+    }
+
+
+class StopTilePyramid:
+    """stop_tiles.json 的查詢 API"""
+
+    def __init__(self, pyramid: Dict[str, Any]):
+        self.version = pyramid.get('version')
+        self.zooms: List[int] = pyramid['zooms']
+        self.stop_ids: List[str] = pyramid['stop_ids']
+        self.tiles: Dict[str, List[List[Any]]] = pyramid['tiles']
+        self.stats: Dict[str, Any] = pyramid.get('stats', {})
+
+    @classmethod
+    def load(cls, tiles_file: Path) -> 'StopTilePyramid':
+        with open(tiles_file, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def nearest_zoom(self, zoom: int) -> int:
+        """超出範圍的縮放級別使用最接近的預先計算級別"""
+        return min(self.zooms, key=lambda z: abs(z - zoom))
+
+    def tile(self, zoom: int, x: int, y: int, resolve_ids: bool = True) -> List[Dict[str, Any]]:
+        """單一圖塊的聚類 (沒有站點的圖塊返回空列表)"""
+        clusters = []
+        for lat, lon, count, members in self.tiles.get(f"{zoom}/{x}/{y}", ()):
+            cluster = {'latitude': lat, 'longitude': lon, 'count': count, 'stop_indexes': members}
+            if resolve_ids:
+                cluster['stop_ids'] = [self.stop_ids[index] for index in members]
+            clusters.append(cluster)
+        return clusters
+
+    def tiles_in_bbox(self, zoom: int, min_lat: float, min_lon: float,
+                      max_lat: float, max_lon: float) -> List[Tuple[int, int]]:
+        """覆蓋範圍內有站點的圖塊 (地圖可見範圍 → 需要的圖塊)"""
+        x0, y0 = tile_for(max_lat, min_lon, zoom)
+        x1, y1 = tile_for(min_lat, max_lon, zoom)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                if f"{zoom}/{x}/{y}" in self.tiles]
+
+    def clusters_in_bbox(self, zoom: int, min_lat: float, min_lon: float,
+                         max_lat: float, max_lon: float) -> List[Dict[str, Any]]:
+        zoom = self.nearest_zoom(zoom)
+        clusters = []
+        for x, y in self.tiles_in_bbox(zoom, min_lat, min_lon, max_lat, max_lon):
+            clusters.extend(
+                cluster for cluster in self.tile(zoom, x, y, resolve_ids=False)
+                if min_lat <= cluster['latitude'] <= max_lat and min_lon <= cluster['longitude'] <= max_lon
+            )
+        return clusters
+
+
+def default_tiles_file() -> Path:
+    return Path(os.getenv('OUTPUT_DIRECTORY', str(Path(__file__).parent.absolute()))) / TILES_FILENAME
+
+
+def print_stats(stats: Dict[str, Any]):
+    print(f"{'zoom':>4} {'tiles':>7} {'clusters':>9} {'max size':>9} {'median B':>9} {'max B':>8} {'total KB':>9}")
+    print("-" * 62)
+    for zoom, zoom_stats in stats.items():
+        print(f"{zoom:>4} {zoom_stats['tiles']:>7,} {zoom_stats['clusters']:>9,} {zoom_stats['max_cluster_size']:>9,} "
+              f"{zoom_stats['tile_bytes_median']:>9,} {zoom_stats['tile_bytes_max']:>8,} "
+              f"{zoom_stats['tile_bytes_total'] / 1024:>9.1f}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Zoom-level stop cluster tiles for map rendering')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build stop_tiles.json from bus_data.json')
+    build_parser.add_argument('data_file', nargs='?', help='bus_data.json (default: OUTPUT_DIRECTORY/bus_data.json)')
+    build_parser.add_argument('--zooms', help="Zoom levels, e.g. '10-16' (default: STOP_TILES_ZOOMS or 10-16)")
+    build_parser.add_argument('--cluster-px', type=int, help='Cluster cell size in pixels (default: STOP_TILES_CLUSTER_PX or 64)')
+
+    lookup_parser = subparsers.add_parser('lookup', help='Clusters in the tile containing a location')
+    lookup_parser.add_argument('latitude', type=float)
+    lookup_parser.add_argument('longitude', type=float)
+    lookup_parser.add_argument('zoom', type=int)
+    lookup_parser.add_argument('--tiles', help='stop_tiles.json (default: OUTPUT_DIRECTORY/stop_tiles.json)')
+    return parser.parse_args(argv)
+
+
+def main():
+    from collect_bus_data_optimized_concurrent import default_data_file, load_bus_data, load_environment
+
+    args = parse_args()
+    load_environment()
+
+    if args.command == 'build':
+        data_file = Path(args.data_file) if args.data_file else default_data_file()
+        if not data_file.exists():
+            print(f"❌ Data file not found: {data_file}")
+            sys.exit(2)
+        zooms = parse_zooms(args.zooms) if args.zooms else None
+        path, stats = build_and_write(load_bus_data(data_file), data_file.parent, zooms, args.cluster_px)
+        print(f"✅ Stop tiles written: {path}")
+        print(f"   {stats['tiles']:,} tiles, {stats['file_size_bytes'] / 1024:.0f} KB, "
+              f"clustered in {stats['build_seconds']:.2f}s\n")
+        print_stats(stats['per_zoom'])
+        return
+
+    tiles_file = Path(args.tiles) if args.tiles else default_tiles_file()
+    if not tiles_file.exists():
+        print(f"❌ Stop tiles not found: {tiles_file} (run: python3 stop_tiles.py build)")
+        sys.exit(2)
+    pyramid = StopTilePyramid.load(tiles_file)
+    zoom = pyramid.nearest_zoom(args.zoom)
+    x, y = tile_for(args.latitude, args.longitude, zoom)
+    start_time = time.perf_counter()
+    clusters = pyramid.tile(zoom, x, y)
+    elapsed_us = (time.perf_counter() - start_time) * 1e6
+
+    print(f"🗺️  Tile {zoom}/{x}/{y}: {len(clusters)} clusters ({elapsed_us:.0f} µs)")
+    for cluster in clusters:
+        preview = ', '.join(cluster['stop_ids'][:3]) + (' ...' if cluster['count'] > 3 else '')
+        print(f"   ({cluster['latitude']:.5f}, {cluster['longitude']:.5f}) × {cluster['count']:<4} {preview}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+雲端儲存後端抽象
+- StorageBackend: 上傳介面 (分塊、可續傳、generation 前置條件)
+- FirebaseStorageBackend: Firebase / Google Cloud Storage 的 resumable upload session 實作
+- LocalStorageBackend: 本地檔案系統替身 (測試及離線執行用)
+- upload_artifacts: 數據檔案並行上傳並記錄吞吐量；metadata 最後上傳 (只在所有數據檔案成功後)
+
+可續傳：每個分塊完成後把 session 狀態寫入 .upload_sessions.json；
+分塊失敗 (連線錯誤、逾時、429、5xx) 時在同一次執行內退避重試 (UPLOAD_CHUNK_RETRIES)，
+重試前查詢伺服器已確認的位元組並從該處繼續；中斷後再次執行亦會從該處繼續，而非整個檔案重新上傳。
+
+前置條件：上傳前讀取遠端物件的 generation，並以 if_generation_match 建立 session；
+若另一個執行在期間寫入了同一物件，提交時會返回 412，不會互相覆蓋。
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 必須是 256 KB 的倍數
+DEFAULT_CHUNK_RETRIES = 3
+CHUNK_RETRY_BACKOFF = 1.0               # 秒；每次重試加倍
+SESSION_STATE_FILE = '.upload_sessions.json'
+METADATA_OBJECT = 'bus_data_metadata.json'    # 客戶端以此判斷新版本，必須在數據之後發佈
+
+
+class PreconditionFailedError(Exception):
+    """遠端物件的 generation 與預期不符 (另一個執行已寫入)"""
+
+
+def file_sha256(path: Path) -> str:
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+class UploadSessionState:
+    """可續傳 session 的持久化狀態 (以遠端名稱為鍵，並記錄檔案 SHA256 以免續傳到不同內容)"""
+
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self.lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Any]:
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, remote_name: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self._load().get(remote_name)
+
+    def put(self, remote_name: str, state: Optional[Dict[str, Any]]):
+        with self.lock:
+            sessions = self._load()
+            if state is None:
+                sessions.pop(remote_name, None)
+            else:
+                sessions[remote_name] = state
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.state_file.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(sessions, f, indent=2)
+            os.replace(tmp_file, self.state_file)
+
+
+class StorageBackend:
+    """儲存後端介面"""
+
+    name = ''
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, state_file: Optional[Path] = None):
+        self.chunk_size = chunk_size
+        self.sessions = UploadSessionState(state_file or Path(SESSION_STATE_FILE))
+
+    def describe(self, remote_name: str) -> str:
+        raise NotImplementedError
+
+    def get_generation(self, remote_name: str) -> Optional[int]:
+        """遠端物件目前的 generation (不存在返回 None)"""
+        raise NotImplementedError
+
+    def upload(self, local_path: str, remote_name: str, content_type: str = 'application/json',
+               metadata: Optional[Dict[str, str]] = None,
+               if_generation_match: Optional[int] = None) -> Dict[str, Any]:
+        """
+        分塊、可續傳地上傳一個檔案
+        if_generation_match: None 表示自動使用上傳前讀取的 generation (物件不存在時為 0)
+        返回 {'remote_name', 'bytes', 'seconds', 'generation', 'resumed_from'}
+        """
+        raise NotImplementedError
+
+    def _resume_state(self, local_path: Path, remote_name: str, file_hash: str,
+                      size: int) -> Optional[Dict[str, Any]]:
+        """返回同一內容未完成的 session 狀態 (內容不同則作廢)"""
+        state = self.sessions.get(remote_name)
+        if state and state.get('sha256') == file_hash and state.get('size') == size \
+                and state.get('backend') == self.name:
+            return state
+        if state:
+            self.sessions.put(remote_name, None)
+        return None
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """Firebase Storage (Google Cloud Storage) resumable upload session"""
+
+    name = 'firebase'
+
+    def __init__(self, bucket=None, chunk_size: int = DEFAULT_CHUNK_SIZE, state_file: Optional[Path] = None,
+                 chunk_retries: int = DEFAULT_CHUNK_RETRIES, retry_backoff: float = CHUNK_RETRY_BACKOFF):
+        super().__init__(chunk_size, state_file)
+        if bucket is None:
+            from firebase_admin import storage
+            bucket = storage.bucket()
+        self.bucket = bucket
+        self.chunk_retries = chunk_retries
+        self.retry_backoff = retry_backoff
+
+    def describe(self, remote_name: str) -> str:
+        return f"gs://{self.bucket.name}/{remote_name}"
+
+    def get_generation(self, remote_name: str) -> Optional[int]:
+        blob = self.bucket.get_blob(remote_name)
+        return blob.generation if blob is not None else None
+
+    def upload(self, local_path, remote_name, content_type='application/json', metadata=None,
+               if_generation_match=None):
+        import requests
+
+        path = Path(local_path)
+        size = path.stat().st_size
+        file_hash = file_sha256(path)
+        start_time = time.time()
+
+        state = self._resume_state(path, remote_name, file_hash, size)
+        offset = 0
+        if state:
+            offset = self._query_offset(state['session_url'], size)
+            if offset is None:
+                # session 已過期或已完成但未記錄，重新建立
+                self.sessions.put(remote_name, None)
+                state = None
+                offset = 0
+            else:
+                logging.info(f"⏯️  Resuming {remote_name} from byte {offset:,}/{size:,}")
+
+        if state is None:
+            if if_generation_match is None:
+                if_generation_match = self.get_generation(remote_name) or 0
+
+            blob = self.bucket.blob(remote_name)
+            blob.metadata = metadata or {}
+            session_url = blob.create_resumable_upload_session(
+                content_type=content_type,
+                size=size,
+                if_generation_match=if_generation_match
+            )
+            state = {
+                'backend': self.name,
+                'session_url': session_url,
+                'sha256': file_hash,
+                'size': size,
+                'if_generation_match': if_generation_match
+            }
+            self.sessions.put(remote_name, state)
+
+        resumed_from = offset
+        result = None
+        failures = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < size or size == 0:
+                chunk = f.read(self.chunk_size)
+                end = offset + len(chunk) - 1
+                headers = {'Content-Range': f"bytes {offset}-{end}/{size}" if size else "bytes */0"}
+                try:
+                    response = requests.put(state['session_url'], data=chunk, headers=headers, timeout=120)
+                    if response.status_code == 429 or response.status_code >= 500:
+                        response.raise_for_status()
+                except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                    # 暫時性錯誤：退避後從伺服器確認的位置繼續 (session 無效時放棄，下次執行重新建立)
+                    failures += 1
+                    if failures > self.chunk_retries:
+                        raise
+                    time.sleep(self.retry_backoff * 2 ** (failures - 1))
+                    confirmed = self._query_offset(state['session_url'], size)
+                    if confirmed is None:
+                        raise
+                    logging.warning(f"⚠️  Chunk at byte {offset:,} of {remote_name} failed ({e}), "
+                                    f"retry {failures}/{self.chunk_retries} from byte {confirmed:,}")
+                    offset = confirmed
+                    f.seek(offset)
+                    continue
+
+                if response.status_code == 308:
+                    # 未完成：Range 標頭為伺服器已確認的範圍
+                    committed = response.headers.get('Range')
+                    offset = int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+                    f.seek(offset)
+                    continue
+                if response.status_code == 412:
+                    self.sessions.put(remote_name, None)
+                    raise PreconditionFailedError(
+                        f"{remote_name} changed remotely (expected generation {state['if_generation_match']})")
+                response.raise_for_status()
+                result = response.json()
+                break
+
+        self.sessions.put(remote_name, None)
+        return {
+            'remote_name': remote_name,
+            'bytes': size - resumed_from,
+            'seconds': time.time() - start_time,
+            'generation': int(result['generation']) if result and 'generation' in result else None,
+            'resumed_from': resumed_from
+        }
+
+    @staticmethod
+    def _query_offset(session_url: str, size: int) -> Optional[int]:
+        """查詢 session 已接收的位元組數 (session 無效返回 None)"""
+        import requests
+
+        try:
+            response = requests.put(session_url, headers={'Content-Range': f"bytes */{size}"}, timeout=30)
+        except requests.RequestException:
+            return None
+        if response.status_code == 308:
+            committed = response.headers.get('Range')
+            return int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+        return None
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    本地檔案系統替身 (與 Firebase 後端相同的語義)
+    - 每個物件旁有 .meta.json 記錄 generation、content_type 及 metadata
+    - 分塊寫入 .partial 檔案，中斷後從已寫入的位置繼續
+    - generation 前置條件不符時拋出 PreconditionFailedError
+    """
+
+    name = 'local'
+
+    def __init__(self, root_dir: Path, chunk_size: int = DEFAULT_CHUNK_SIZE, state_file: Optional[Path] = None):
+        super().__init__(chunk_size, state_file or Path(root_dir) / SESSION_STATE_FILE)
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.commit_lock = threading.Lock()
+
+    def describe(self, remote_name: str) -> str:
+        return str(self.root_dir / remote_name)
+
+    def _meta_path(self, remote_name: str) -> Path:
+        return self.root_dir / f"{remote_name}.meta.json"
+
+    def get_generation(self, remote_name: str) -> Optional[int]:
+        meta_path = self._meta_path(remote_name)
+        if not meta_path.exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['generation']
+
+    def upload(self, local_path, remote_name, content_type='application/json', metadata=None,
+               if_generation_match=None):
+        path = Path(local_path)
+        size = path.stat().st_size
+        file_hash = file_sha256(path)
+        start_time = time.time()
+
+        partial_path = self.root_dir / f".{remote_name}.partial"
+        state = self._resume_state(path, remote_name, file_hash, size)
+        if state and partial_path.exists():
+            offset = partial_path.stat().st_size
+            logging.info(f"⏯️  Resuming {remote_name} from byte {offset:,}/{size:,}")
+        else:
+            if if_generation_match is None:
+                if_generation_match = self.get_generation(remote_name) or 0
+            state = {
+                'backend': self.name,
+                'sha256': file_hash,
+                'size': size,
+                'if_generation_match': if_generation_match
+            }
+            self.sessions.put(remote_name, state)
+            offset = 0
+            partial_path.write_bytes(b'')
+
+        resumed_from = offset
+        with open(path, 'rb') as src, open(partial_path, 'ab') as dst:
+            src.seek(offset)
+            for chunk in iter(lambda: src.read(self.chunk_size), b""):
+                dst.write(chunk)
+                dst.flush()
+
+        # 提交：檢查前置條件後原子性取代
+        with self.commit_lock:
+            current = self.get_generation(remote_name) or 0
+            if current != state['if_generation_match']:
+                partial_path.unlink()
+                self.sessions.put(remote_name, None)
+                raise PreconditionFailedError(
+                    f"{remote_name} changed remotely (expected generation {state['if_generation_match']}, found {current})")
+
+            generation = current + 1
+            os.replace(partial_path, self.root_dir / remote_name)
+            with open(self._meta_path(remote_name), 'w', encoding='utf-8') as f:
+                json.dump({'generation': generation, 'content_type': content_type,
+                           'metadata': metadata or {}}, f, indent=2, ensure_ascii=False)
+
+        self.sessions.put(remote_name, None)
+        return {
+            'remote_name': remote_name,
+            'bytes': size - resumed_from,
+            'seconds': time.time() - start_time,
+            'generation': generation,
+            'resumed_from': resumed_from
+        }
+
+
+def create_storage_backend(state_dir: Optional[Path] = None) -> StorageBackend:
+    """
+    依環境變數建立後端
+    STORAGE_BACKEND=firebase (預設，需先初始化 Firebase) 或 local (LOCAL_STORAGE_DIR)
+    UPLOAD_CHUNK_MB: 分塊大小 (預設 8，會調整為 256 KB 的倍數)
+    UPLOAD_CHUNK_RETRIES: 每個檔案在同一次執行內的分塊重試次數 (預設 3)
+    """
+    chunk_mb = float(os.getenv('UPLOAD_CHUNK_MB', '8'))
+    chunk_size = max(1, int(chunk_mb * 1024 * 1024) // (256 * 1024)) * 256 * 1024
+    state_file = Path(state_dir) / SESSION_STATE_FILE if state_dir else None
+
+    backend_name = os.getenv('STORAGE_BACKEND', 'firebase').lower()
+    if backend_name == 'local':
+        root_dir = Path(os.getenv('LOCAL_STORAGE_DIR', str(Path(__file__).parent.absolute() / 'storage')))
+        return LocalStorageBackend(root_dir, chunk_size, state_file)
+    if backend_name == 'firebase':
+        return FirebaseStorageBackend(chunk_size=chunk_size, state_file=state_file,
+                                      chunk_retries=int(os.getenv('UPLOAD_CHUNK_RETRIES', str(DEFAULT_CHUNK_RETRIES))))
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend_name}")
+
+
+def _upload_batch(backend: StorageBackend, artifacts: List[Tuple[str, str, str, Optional[Dict[str, str]]]],
+                  max_workers: int) -> Tuple[bool, List[Dict[str, Any]]]:
+    """並行上傳一組檔案，返回 (全部成功, 結果列表)"""
+    results = []
+    all_ok = True
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(artifacts)))) as executor:
+        future_to_name = {
+            executor.submit(backend.upload, local_path, remote_name, content_type, metadata): remote_name
+            for local_path, remote_name, content_type, metadata in artifacts
+        }
+
+        for future in as_completed(future_to_name):
+            remote_name = future_to_name[future]
+            try:
+                result = future.result()
+            except PreconditionFailedError as e:
+                logging.error(f"❌ Upload conflict for {remote_name}: {e}")
+                all_ok = False
+                continue
+            except Exception as e:
+                logging.error(f"❌ Upload failed for {remote_name}: {e}")
+                all_ok = False
+                continue
+
+            throughput = result['bytes'] / result['seconds'] / 1024 / 1024 if result['seconds'] > 0 else 0
+            resumed = f", resumed from byte {result['resumed_from']:,}" if result['resumed_from'] else ""
+            logging.info(f"✅ Uploaded {backend.describe(remote_name)}: {result['bytes']:,} bytes in "
+                         f"{result['seconds']:.2f}s ({throughput:.2f} MB/s, generation {result['generation']}{resumed})")
+            results.append(result)
+
+    return all_ok, results
+
+
+def upload_artifacts(backend: StorageBackend, artifacts: List[Tuple[str, str, str, Optional[Dict[str, str]]]],
+                     max_workers: int = 4) -> Tuple[bool, List[Dict[str, Any]]]:
+    """
+    上傳多個檔案: artifacts = [(local_path, remote_name, content_type, metadata), ...]
+    數據檔案先並行上傳；bus_data_metadata.json 最後上傳，且只在所有數據檔案成功後
+    (客戶端不會在對應數據存在之前看到新的 version / checksum)
+    返回 (全部成功, 結果列表)；每個檔案及總體吞吐量都會寫入日誌
+    """
+    start_time = time.time()
+    data_artifacts = [artifact for artifact in artifacts if artifact[1] != METADATA_OBJECT]
+    metadata_artifacts = [artifact for artifact in artifacts if artifact[1] == METADATA_OBJECT]
+
+    all_ok, results = _upload_batch(backend, data_artifacts, max_workers) if data_artifacts else (True, [])
+    if metadata_artifacts:
+        if all_ok:
+            metadata_ok, metadata_results = _upload_batch(backend, metadata_artifacts, max_workers)
+            all_ok = all_ok and metadata_ok
+            results.extend(metadata_results)
+        else:
+            logging.error(f"❌ Skipping {METADATA_OBJECT} upload: not every data file was uploaded")
+
+    elapsed = time.time() - start_time
+    total_bytes = sum(r['bytes'] for r in results)
+    throughput = total_bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0
+    logging.info(f"📤 {len(results)}/{len(artifacts)} artifacts uploaded: {total_bytes:,} bytes in "
+                 f"{elapsed:.2f}s ({throughput:.2f} MB/s aggregate)")
+
+    return all_ok, results
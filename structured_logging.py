@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+非阻塞結構化日誌
+- LOG_MODE=queue (預設)：所有 handler 移到背景線程 (QueueListener)，worker 線程只把記錄放入隊列，不會因檔案 / console I/O 互相等待
+- LOG_MODE=sync：handler 在呼叫線程直接寫入 (舊行為，比較用)
+- 除了原有的文字日誌，另寫一份 JSON-lines 記錄 (.jsonl)：每行一個 JSON，包括 stage 標籤及結構化欄位
+- 每個 API 請求一行 (logger 'hkbus.requests'，只寫入 .jsonl，不顯示在 console)
+- ProgressReporter：進度訊息按時間限流 (LOG_PROGRESS_SECONDS)，不再每 N 個任務輸出一次
+
+結構化欄位:
+  logging.info("message", extra={'fields': {'route_id': ..., 'elapsed_ms': ...}})
+
+stage 標籤:
+  CollectorMetrics.stage() 設定當前線程的 stage；提交到線程池的函數用 bind_stage() 包裝以沿用
+"""
+
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable
+
+REQUEST_LOGGER = 'hkbus.requests'
+LOG_MODES = ('queue', 'sync')
+DEFAULT_PROGRESS_SECONDS = 5.0
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_stage = threading.local()
+_listener: Optional[logging.handlers.QueueListener] = None
+_request_logger = logging.getLogger(REQUEST_LOGGER)
+_request_logger.setLevel(logging.WARNING)      # configure_logging() 有 JSON-lines 輸出時才啟用
+
+
+def current_stage() -> Optional[str]:
+    return getattr(_stage, 'name', None)
+
+
+class stage_tag:
+    """在當前線程設定 stage 標籤 (可巢狀，離開時還原)"""
+
+    def __init__(self, name: Optional[str]):
+        self.name = name
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = current_stage()
+        _stage.name = self.name
+        return self
+
+    def __exit__(self, *exc):
+        _stage.name = self.previous
+
+
+def bind_stage(func: Callable) -> Callable:
+    """包裝提交到線程池的函數，使其記錄沿用提交時的 stage 標籤"""
+    name = current_stage()
+    if name is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with stage_tag(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class StageFilter(logging.Filter):
+    """在發出記錄的線程加上 stage 屬性 (queue 模式下在放入隊列之前執行)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'stage'):
+            record.stage = current_stage()
+        return True
+
+
+class ExcludeRequestsFilter(logging.Filter):
+    """請求記錄只寫入 .jsonl"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.name != REQUEST_LOGGER
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """每筆記錄一行 JSON：ts, level, logger, thread, stage, msg 及 extra={'fields': {...}} 的欄位"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'stage': getattr(record, 'stage', None),
+            'msg': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(text_file: Optional[Path] = None, json_file: Optional[Path] = None,
+                      mode: str = 'queue', log_requests: bool = True) -> logging.Logger:
+    """
+    設定 root logger：console + 文字日誌 (text_file) + JSON-lines (json_file)
+    queue 模式下由背景線程寫入；程式結束時 (atexit) 清空隊列
+    """
+    global _listener
+    if mode not in LOG_MODES:
+        raise ValueError(f"Unknown LOG_MODE: {mode} (expected one of {', '.join(LOG_MODES)})")
+    shutdown_logging()
+
+    text_formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if text_file is not None:
+        handlers.append(logging.FileHandler(text_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(text_formatter)
+        handler.addFilter(ExcludeRequestsFilter())
+    if json_file is not None:
+        json_handler = logging.FileHandler(json_file, encoding='utf-8')
+        json_handler.setFormatter(JSONLinesFormatter())
+        handlers.append(json_handler)
+
+    if mode == 'queue':
+        queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(StageFilter())
+        _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        attached = [queue_handler]
+    else:
+        for handler in handlers:
+            handler.addFilter(StageFilter())
+        attached = handlers
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(logging.INFO)
+    for handler in attached:
+        root.addHandler(handler)
+
+    # 請求記錄：沒有 JSON-lines 輸出或已停用時，isEnabledFor 直接返回 False，不建立記錄
+    _request_logger.setLevel(logging.INFO if json_file is not None and log_requests else logging.WARNING)
+    return root
+
+
+def shutdown_logging():
+    """停止背景線程並寫出隊列中剩餘的記錄"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+class ProgressReporter:
+    """按時間限流的進度訊息 (最多每 interval 秒一次，完成時必定輸出)"""
+
+    def __init__(self, label: str, total: int, interval: float = DEFAULT_PROGRESS_SECONDS,
+                 logger: Optional[logging.Logger] = None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.logger = logger or logging.getLogger()
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.lock = threading.Lock()
+
+    def advance(self, count: int = 1):
+        with self.lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self.last_report < self.interval and self.done < self.total:
+                return
+            self.last_report = now
+            done = self.done
+
+        elapsed = now - self.started
+        percent = done / self.total * 100 if self.total else 100.0
+        self.logger.info(f"   {self.label} progress: {done}/{self.total} ({percent:.1f}%)", extra={'fields': {
+            'progress': self.label,
+            'done': done,
+            'total': self.total,
+            'rate_per_second': round(done / elapsed, 1) if elapsed > 0 else None
+        }})
+
+
+def log_request(url: str, endpoint: str, elapsed: float, bytes_received: int, ok: bool, retries: int,
+                error: Optional[str] = None):
+    """每個 API 請求一筆結構化記錄 (請求記錄停用時不建立記錄)"""
+    if not _request_logger.isEnabledFor(logging.INFO):
+        return
+    fields: Dict[str, Any] = {
+        'url': url,
+        'endpoint': endpoint,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'bytes': bytes_received,
+        'ok': ok,
+        'retries': retries
+    }
+    if error is not None:
+        fields['error'] = error
+    _request_logger.info('request', extra={'fields': fields})
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+合成巴士網絡產生器 (壓力測試用)
+- 以目前數據規模的倍數 (10x–100x) 產生路線、站點及路線站點序列
+- 輸出形狀與 KMB / CTB API 回應相同，可直接餵給收集器的處理流程
+- 站點圍繞多個「地區中心」分佈；路線沿著方向逐步選取附近站點，令站點在路線間共用
+- 逐個規模執行處理階段，報告耗時及記憶體曲線，找出超線性的熱點
+
+使用方式:
+  python3 synthetic_bus_network.py --scales 1,2,5,10
+  python3 synthetic_bus_network.py --scales 1,10,100 --output scale_report.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import zlib
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+from urllib.parse import urlsplit
+from typing import Dict, List, Any, Optional, Tuple
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+# 目前 (1x) 的數據規模
+BASELINE = {
+    'kmb_route_numbers': 650,   # x2 方向 ≈ 1,300 路線方向
+    'ctb_route_numbers': 400,   # x2 方向 ≈ 800 路線方向
+    'kmb_stops': 6700,
+    'ctb_stops': 2550,
+    'districts': 40,
+}
+
+# 香港範圍 (與 validate_data 的邊界一致)
+HK_BOUNDS = (22.20, 113.90, 22.55, 114.35)
+
+STOPS_PER_ROUTE = (12, 45)
+STOP_SPACING_DEG = 0.004        # 約 400 米
+KMB_SPECIAL_SERVICE_RATIO = 0.1  # 帶特別班次 (service_type 2) 的路線比例
+DATA_TIMESTAMP = '2026-01-01T05:00:00+08:00'
+
+HK_TIMEZONE = timezone(timedelta(hours=8))
+ETA_HEADWAY_MINUTES = (4, 20)    # 合成 ETA 的班距範圍
+ETA_PER_ROUTE = 3                # 每條路線返回的班次數 (與真實 API 相同)
+
+
+class StopGrid:
+    """簡單的網格索引，用於快速尋找某位置附近的站點"""
+
+    def __init__(self, stops: List[Tuple[str, float, float]], cell_size: float):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self.stops = stops
+        for index, (_, lat, lon) in enumerate(stops):
+            self.cells[self.cell(lat, lon)].append(index)
+
+    def cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(lat / self.cell_size), int(lon / self.cell_size)
+
+    def near(self, lat: float, lon: float, rng: random.Random) -> Optional[int]:
+        """返回附近隨機一個站點 (由近至遠逐圈搜尋)"""
+        row, col = self.cell(lat, lon)
+        for radius in range(4):
+            candidates = []
+            for dr in range(-radius, radius + 1):
+                for dc in range(-radius, radius + 1):
+                    if max(abs(dr), abs(dc)) == radius:
+                        candidates.extend(self.cells.get((row + dr, col + dc), ()))
+            if candidates:
+                return rng.choice(candidates)
+        return None
+
+
+def _scatter_stops(count: int, centers: List[Tuple[float, float, float]], bounds: Tuple[float, float, float, float],
+                   rng: random.Random) -> List[Tuple[float, float]]:
+    """圍繞地區中心產生站點座標 (限制在邊界內)"""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    coords = []
+    for _ in range(count):
+        lat_c, lon_c, spread = rng.choice(centers)
+        lat = min(max(rng.gauss(lat_c, spread), min_lat), max_lat)
+        lon = min(max(rng.gauss(lon_c, spread), min_lon), max_lon)
+        coords.append((lat, lon))
+    return coords
+
+
+def _walk_route(grid: StopGrid, rng: random.Random, length: int) -> List[int]:
+    """從隨機站點出發，沿大致固定的方向逐步選取附近站點"""
+    start = rng.randrange(len(grid.stops))
+    _, lat, lon = grid.stops[start]
+    heading = rng.uniform(0, 2 * math.pi)
+    sequence = [start]
+    seen = {start}
+
+    attempts = 0
+    while len(sequence) < length and attempts < length * 4:
+        attempts += 1
+        heading += rng.gauss(0, 0.35)
+        lat += STOP_SPACING_DEG * math.sin(heading)
+        lon += STOP_SPACING_DEG * math.cos(heading)
+        index = grid.near(lat, lon, rng)
+        if index is None or index in seen:
+            # 離開有站點的範圍時掉頭
+            heading += math.pi / 2
+            continue
+        seen.add(index)
+        sequence.append(index)
+        _, lat, lon = grid.stops[index]
+
+    return sequence
+
+
+def generate_network(scale: float = 1.0, seed: int = 42,
+                     bounds: Tuple[float, float, float, float] = HK_BOUNDS) -> Dict[str, Any]:
+    """
+    產生合成網絡，返回與 benchmark_collector 模擬伺服器相同的結構:
+    kmb_stops / kmb_routes / kmb_route_stops (KMB 批量 API 的 data 列表)
+    ctb_routes (列表)、ctb_route_stops ({(route, direction): [...]})、ctb_stops ({stop_id: {...}})
+    """
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = bounds
+
+    districts = max(4, int(BASELINE['districts'] * math.sqrt(scale)))
+    centers = [
+        (rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon), rng.uniform(0.006, 0.02))
+        for _ in range(districts)
+    ]
+
+    kmb_stop_count = max(50, int(BASELINE['kmb_stops'] * scale))
+    ctb_stop_count = max(50, int(BASELINE['ctb_stops'] * scale))
+    kmb_route_count = max(5, int(BASELINE['kmb_route_numbers'] * scale))
+    ctb_route_count = max(5, int(BASELINE['ctb_route_numbers'] * scale))
+
+    # 站點越密集，網格越細，保持每格站點數量相近
+    cell_size = STOP_SPACING_DEG * 1.5 / max(1.0, math.sqrt(scale) / 2)
+
+    # KMB 站點
+    kmb_coords = _scatter_stops(kmb_stop_count, centers, bounds, rng)
+    kmb_stops = []
+    for i, (lat, lon) in enumerate(kmb_coords):
+        kmb_stops.append({
+            'stop': f"{rng.getrandbits(64):016X}",
+            'name_en': f"KMB STOP {i}",
+            'name_tc': f"九巴站{i}",
+            'name_sc': f"九巴站{i}",
+            'lat': f"{lat:.6f}",
+            'long': f"{lon:.6f}",
+            'data_timestamp': DATA_TIMESTAMP
+        })
+    kmb_grid = StopGrid([(s['stop'], lat, lon) for s, (lat, lon) in zip(kmb_stops, kmb_coords)], cell_size)
+
+    # KMB 路線 (出入站方向互為反向，部分路線有特別班次)
+    kmb_routes = []
+    kmb_route_stops = []
+    for i in range(kmb_route_count):
+        route = str(i + 1) if i % 7 else f"{i + 1}X"
+        outbound = _walk_route(kmb_grid, rng, rng.randint(*STOPS_PER_ROUTE))
+        service_types = ['1', '2'] if rng.random() < KMB_SPECIAL_SERVICE_RATIO else ['1']
+
+        for bound, sequence in (('O', outbound), ('I', list(reversed(outbound)))):
+            for service_type in service_types:
+                stops = sequence if service_type == '1' else sequence[:max(2, len(sequence) * 2 // 3)]
+                kmb_routes.append({
+                    'route': route,
+                    'bound': bound,
+                    'service_type': service_type,
+                    'orig_en': f"ORIGIN {route}",
+                    'orig_tc': f"起點{route}",
+                    'orig_sc': f"起点{route}",
+                    'dest_en': f"DESTINATION {route}",
+                    'dest_tc': f"終點{route}",
+                    'dest_sc': f"终点{route}"
+                })
+                for seq, index in enumerate(stops, start=1):
+                    kmb_route_stops.append({
+                        'route': route,
+                        'bound': bound,
+                        'service_type': service_type,
+                        'seq': str(seq),
+                        'stop': kmb_grid.stops[index][0],
+                        'data_timestamp': DATA_TIMESTAMP
+                    })
+
+    # CTB 站點 (6 位數字 ID)
+    ctb_coords = _scatter_stops(ctb_stop_count, centers, bounds, rng)
+    ctb_stops = {}
+    for i, (lat, lon) in enumerate(ctb_coords):
+        stop_id = f"{i + 1:06d}"
+        ctb_stops[stop_id] = {
+            'stop': stop_id,
+            'name_tc': f"城巴站{i}",
+            'name_en': f"CTB STOP {i}",
+            'name_sc': f"城巴站{i}",
+            'lat': f"{lat:.6f}",
+            'long': f"{lon:.6f}",
+            'data_timestamp': DATA_TIMESTAMP
+        }
+    ctb_grid = StopGrid([(stop_id, lat, lon) for stop_id, (lat, lon) in zip(ctb_stops, ctb_coords)], cell_size)
+
+    # CTB 路線
+    ctb_routes = []
+    ctb_route_stops = {}
+    for i in range(ctb_route_count):
+        route = str(i + 1) if i % 5 else f"{i + 1}A"
+        ctb_routes.append({
+            'co': 'CTB',
+            'route': route,
+            'orig_tc': f"起點{route}",
+            'orig_en': f"ORIGIN {route}",
+            'dest_tc': f"終點{route}",
+            'dest_en': f"DESTINATION {route}",
+            'data_timestamp': DATA_TIMESTAMP
+        })
+        outbound = _walk_route(ctb_grid, rng, rng.randint(*STOPS_PER_ROUTE))
+        for direction, sequence in (('outbound', outbound), ('inbound', list(reversed(outbound)))):
+            ctb_route_stops[(route, direction)] = [
+                {
+                    'co': 'CTB',
+                    'route': route,
+                    'dir': direction[0].upper(),
+                    'seq': seq,
+                    'stop': ctb_grid.stops[index][0],
+                    'data_timestamp': DATA_TIMESTAMP
+                }
+                for seq, index in enumerate(sequence, start=1)
+            ]
+
+    return {
+        'kmb_stops': kmb_stops,
+        'kmb_routes': kmb_routes,
+        'kmb_route_stops': kmb_route_stops,
+        'ctb_routes': ctb_routes,
+        'ctb_route_stops': ctb_route_stops,
+        'ctb_stops': ctb_stops
+    }
+
+
+class NetworkResponder:
+    """把 API 請求路徑解析為合成網絡的回應位元組 (模擬伺服器及記憶體傳輸共用)"""
+
+    def __init__(self, network: Dict[str, Any], eta_speedup: float = 1.0):
+        self.network = network
+        self.eta_speedup = eta_speedup  # >1 時班距按比例縮短 (負載測試中 ETA 更頻繁地改變)
+        # 預先序列化批量回應 (與真實 API 一樣是一次過的大回應)
+        self.static = {
+            '/v1/transport/kmb/stop': self.encode({'type': 'StopList', 'data': network['kmb_stops']}),
+            '/v1/transport/kmb/route': self.encode({'type': 'RouteList', 'data': network['kmb_routes']}),
+            '/v1/transport/kmb/route-stop': self.encode({'type': 'RouteStopList', 'data': network['kmb_route_stops']}),
+            '/v2/transport/citybus/route/CTB': self.encode({'type': 'RouteList', 'data': network['ctb_routes']}),
+        }
+        self._stop_services: Optional[Dict[str, List[Dict[str, Any]]]] = None
+
+    @staticmethod
+    def encode(payload: Dict[str, Any]) -> bytes:
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    def resolve(self, path: str) -> Optional[bytes]:
+        """返回回應內容 (None 表示 404)"""
+        path = path.split('?', 1)[0].rstrip('/')
+        if path in self.static:
+            return self.static[path]
+
+        parts = path.split('/')
+        # /v2/transport/citybus/route-stop/CTB/{route}/{direction}
+        if len(parts) == 8 and parts[4] == 'route-stop' and parts[5] == 'CTB':
+            stops = self.network['ctb_route_stops'].get((parts[6], parts[7]))
+            if stops is None:
+                return None
+            return self.encode({'type': 'RouteStop', 'data': stops})
+        # /v2/transport/citybus/stop/{stop_id}
+        if len(parts) == 6 and parts[4] == 'stop':
+            stop = self.network['ctb_stops'].get(parts[5])
+            if stop is None:
+                return None
+            return self.encode({'type': 'Stop', 'data': stop})
+        # /v1/transport/kmb/stop-eta/{stop_id}
+        if len(parts) == 6 and parts[4] == 'stop-eta':
+            return self.encode({'type': 'StopETA', 'data': self.eta_entries('KMB', parts[5])})
+        # /v1/transport/kmb/eta/{stop_id}/{route}/{service_type}
+        if len(parts) == 8 and parts[3] == 'kmb' and parts[4] == 'eta':
+            return self.encode({'type': 'ETA', 'data': self.eta_entries('KMB', parts[5], parts[6], parts[7])})
+        # /v2/transport/citybus/eta/CTB/{stop_id}/{route}
+        if len(parts) == 8 and parts[4] == 'eta' and parts[5] == 'CTB':
+            return self.encode({'type': 'ETA', 'data': self.eta_entries('CTB', parts[6], parts[7])})
+        return None
+
+    def stop_services(self) -> Dict[str, List[Dict[str, Any]]]:
+        """站點 → 途經的班次 (company, route, dir, service_type, seq)，第一次查詢 ETA 時才建立"""
+        if self._stop_services is None:
+            services = defaultdict(list)
+            for entry in self.network['kmb_route_stops']:
+                services[('KMB', entry['stop'])].append({
+                    'route': entry['route'], 'dir': entry['bound'],
+                    'service_type': entry['service_type'], 'seq': int(entry['seq'])
+                })
+            for stops in self.network['ctb_route_stops'].values():
+                for entry in stops:
+                    services[('CTB', entry['stop'])].append({
+                        'route': entry['route'], 'dir': entry['dir'], 'seq': entry['seq']
+                    })
+            self._stop_services = services
+        return self._stop_services
+
+    def eta_entries(self, company: str, stop_id: str, route: Optional[str] = None,
+                    service_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        合成 ETA：每個班次有固定的班距及相位 (由 ID 雜湊決定)，按目前時間計算之後的到站時間
+        同一分鐘內重複查詢結果相同，巴士到站後列表自然前移 (可測試快取及推送變更)
+        """
+        now = datetime.now(HK_TIMEZONE)
+        now_ts = now.timestamp()
+        entries = []
+        for service in self.stop_services().get((company, stop_id), ()):
+            if route is not None and service['route'] != route:
+                continue
+            if service_type is not None and service.get('service_type') != service_type:
+                continue
+
+            key = f"{company}|{stop_id}|{service['route']}|{service['dir']}|{service.get('service_type', '')}"
+            digest = zlib.crc32(key.encode('utf-8'))
+            minutes = ETA_HEADWAY_MINUTES[0] + digest % (ETA_HEADWAY_MINUTES[1] - ETA_HEADWAY_MINUTES[0] + 1)
+            headway = max(1, int(60 * minutes / self.eta_speedup))
+            phase = (digest >> 8) % headway
+            first_arrival = now_ts + (phase - now_ts) % headway
+
+            entry = {
+                'co': company,
+                'route': service['route'],
+                'dir': service['dir'],
+                'seq': service['seq'],
+                'stop': stop_id,
+                'dest_tc': f"終點{service['route']}",
+                'dest_en': f"DESTINATION {service['route']}",
+                'rmk_tc': '',
+                'rmk_en': '',
+                'data_timestamp': now.isoformat(timespec='seconds')
+            }
+            if company == 'KMB':
+                entry['service_type'] = int(service['service_type'])
+            for eta_seq in range(1, ETA_PER_ROUTE + 1):
+                eta = datetime.fromtimestamp(first_arrival + (eta_seq - 1) * headway, HK_TIMEZONE)
+                entries.append(dict(entry, eta_seq=eta_seq, eta=eta.isoformat(timespec='seconds')))
+        return entries
+
+
+class InMemoryTransport:
+    """收集器的記憶體傳輸：不經網絡直接返回合成回應 (只量度處理成本)"""
+
+    def __init__(self, responder: NetworkResponder):
+        self.responder = responder
+
+    def get(self, url: str, timeout: int = 30):
+        from collect_bus_data_optimized_concurrent import ReplayResponse
+
+        body = self.responder.resolve(urlsplit(url).path)
+        if body is None:
+            return ReplayResponse(url, 404, b'{}')
+        return ReplayResponse(url, 200, body)
+
+
+def current_rss_bytes() -> int:
+    """目前的 RSS (Linux 讀取 /proc；其他平台退回峰值 RSS)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        from collect_bus_data_optimized_concurrent import peak_rss_bytes
+        return peak_rss_bytes()
+
+
+def profile_scale(scale: float, seed: int, output_dir: str) -> Dict[str, Any]:
+    """在當前進程產生指定規模的網絡並執行各處理階段，返回耗時及記憶體"""
+    import collect_bus_data_optimized_concurrent as collector_module
+
+    os.environ['OUTPUT_DIRECTORY'] = output_dir
+    stages: Dict[str, Dict[str, float]] = {}
+
+    def run(name: str, func):
+        start_time = time.time()
+        result = func()
+        stages[name] = {
+            'seconds': round(time.time() - start_time, 4),
+            'rss_mb': round(current_rss_bytes() / 1024 / 1024, 1)
+        }
+        return result
+
+    network = run('generate', lambda: generate_network(scale, seed))
+    responder = run('encode_responses', lambda: NetworkResponder(network))
+
+    collector = collector_module.OptimizedConcurrentBusDataCollector(operators=['KMB', 'CTB'])
+    collector.http = InMemoryTransport(responder)
+
+    run('collect_kmb', lambda: collector.collect_kmb_batch())
+    run('collect_ctb', lambda: collector.collect_ctb_concurrent())
+    run('reverse_mapping', collector.create_reverse_mapping)
+    run('validate', collector.validate_data)
+    data_file = run('save', collector.finalize_and_save)
+    run('metadata', lambda: collector.generate_metadata(data_file))
+
+    return {
+        'scale': scale,
+        'routes': len(collector.bus_data['routes']),
+        'stops': len(collector.bus_data['stops']),
+        'route_stop_entries': sum(len(stops) for stops in collector.bus_data['route_stops'].values()),
+        'file_size_bytes': os.path.getsize(data_file),
+        'stages': stages,
+        'peak_rss_mb': round(collector_module.peak_rss_bytes() / 1024 / 1024, 1)
+    }
+
+
+def run_scale_subprocess(scale: float, seed: int) -> Dict[str, Any]:
+    """每個規模在獨立子進程執行，令峰值 RSS 互不影響"""
+    env = dict(os.environ, BUS_OPERATORS='KMB,CTB', PROFILE_STAGES='')
+    with tempfile.TemporaryDirectory(prefix='hkbus_scale_') as output_dir:
+        process = subprocess.run(
+            [sys.executable, str(Path(__file__).absolute()), '--run-one', str(scale),
+             '--seed', str(seed), '--output-dir', output_dir],
+            env=env, cwd=str(SCRIPT_DIR), capture_output=True, text=True
+        )
+    if process.returncode != 0:
+        raise RuntimeError(f"Scale {scale} failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def scaling_exponents(results: List[Dict[str, Any]]) -> Dict[str, List[Optional[float]]]:
+    """
+    相鄰兩個規模之間各階段的縮放指數 log(t2/t1) / log(n2/n1)
+    (n = 路線站點數量)；約 1.0 為線性，明顯大於 1 表示超線性
+    """
+    exponents: Dict[str, List[Optional[float]]] = defaultdict(list)
+    for previous, current in zip(results, results[1:]):
+        size_ratio = current['route_stop_entries'] / max(1, previous['route_stop_entries'])
+        for stage, stats in current['stages'].items():
+            before = previous['stages'].get(stage, {}).get('seconds', 0)
+            after = stats['seconds']
+            if before > 0.005 and after > 0 and size_ratio > 1:
+                exponents[stage].append(round(math.log(after / before) / math.log(size_ratio), 2))
+            else:
+                exponents[stage].append(None)
+    return dict(exponents)
+
+
+def print_report(results: List[Dict[str, Any]], exponents: Dict[str, List[Optional[float]]]):
+    stage_names = list(results[0]['stages'])
+
+    print()
+    print(f"{'scale':>6} {'routes':>9} {'stops':>9} {'entries':>10} {'file MB':>8} {'peak RSS MB':>11}")
+    print("-" * 58)
+    for r in results:
+        print(f"{r['scale']:>6g} {r['routes']:>9,} {r['stops']:>9,} {r['route_stop_entries']:>10,} "
+              f"{r['file_size_bytes'] / 1024 / 1024:>8.1f} {r['peak_rss_mb']:>11.1f}")
+
+    print()
+    header = f"{'stage':<18}" + ''.join(f"{str(r['scale']) + 'x (s)':>12}" for r in results) + "   exponents"
+    print(header)
+    print("-" * len(header))
+    for stage in stage_names:
+        times = ''.join(f"{r['stages'][stage]['seconds']:>12.3f}" for r in results)
+        stage_exponents = exponents.get(stage, [])
+        flagged = ', '.join('-' if e is None else (f"{e}⚠️" if e > 1.25 else str(e)) for e in stage_exponents)
+        print(f"{stage:<18}{times}   {flagged}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic bus network scale test')
+    parser.add_argument('--scales', default='1,2,5,10', help='Comma separated multiples of the current network size')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--run-one', type=float, metavar='SCALE', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        result = profile_scale(args.run_one, args.seed, args.output_dir)
+        print(json.dumps(result))
+        return
+
+    print("=" * 70)
+    print("📈 HK Bus Pipeline - Synthetic Scale Test")
+    print("=" * 70)
+
+    results = []
+    for scale in [float(s) for s in args.scales.split(',') if s.strip()]:
+        print(f"\n▶️  Scale {scale:g}x ...")
+        result = run_scale_subprocess(scale, args.seed)
+        total = sum(stage['seconds'] for stage in result['stages'].values())
+        print(f"   ✅ {result['routes']:,} routes, {result['stops']:,} stops, "
+              f"{total:.2f}s total, peak RSS {result['peak_rss_mb']:.1f} MB")
+        results.append(result)
+
+    exponents = scaling_exponents(results)
+    print_report(results, exponents)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(),
+                'seed': args.seed,
+                'results': results,
+                'scaling_exponents': exponents
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n📄 Results saved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
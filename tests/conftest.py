@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 腳本位於倉庫根目錄 (沒有套件)，測試直接匯入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,142 @@
+import json
+import random
+import zlib
+
+import pytest
+
+from backup_store import BackupStore
+from collect_bus_data_optimized_concurrent import write_bus_data
+
+
+def make_bus_data(routes: int = 300, stops: int = 600, seed: int = 1):
+    rng = random.Random(seed)
+    stop_ids = [f"{i:06d}" for i in range(stops)]
+    bus_data = {
+        'version': 1700000000,
+        'generated_at': '2026-01-01T03:00:00',
+        'routes': {},
+        'stops': {stop_id: {'name_tc': f"站{stop_id}", 'name_en': f"Stop {stop_id}", 'latitude': 22.3,
+                            'longitude': 114.1, 'company': 'KMB'} for stop_id in stop_ids},
+        'route_stops': {},
+        'stop_routes': {},
+        'summary': {'total_routes': routes, 'kmb_routes': routes}
+    }
+    for number in range(routes):
+        route_id = f"KMB_{number}_O"
+        bus_data['routes'][route_id] = {'route_number': str(number), 'company': 'KMB', 'direction': 'outbound',
+                                        'dest_tc': '乙'}
+        route_stops = [{'stop_id': stop_id, 'sequence': sequence + 1}
+                       for sequence, stop_id in enumerate(rng.sample(stop_ids, 12))]
+        bus_data['route_stops'][route_id] = route_stops
+        for stop in route_stops:
+            bus_data['stop_routes'].setdefault(stop['stop_id'], []).append(
+                {'route_id': route_id, 'route_number': str(number), 'sequence': stop['sequence']})
+    return bus_data
+
+
+def reordered_copy(bus_data):
+    """同一份數據的另一次收集：字典插入次序及 stop_routes 列表次序相反"""
+    copy = {key: ({k: value[k] for k in reversed(list(value))} if isinstance(value, dict) else value)
+            for key, value in reversed(list(json.loads(json.dumps(bus_data)).items()))}
+    copy['stop_routes'] = {stop_id: list(reversed(routes)) for stop_id, routes in copy['stop_routes'].items()}
+    return copy
+
+
+def test_identical_recollection_only_writes_header_chunks(tmp_path):
+    bus_data = make_bus_data()
+    first_file = tmp_path / 'first.json'
+    second_file = tmp_path / 'second.json'
+    write_bus_data(json.loads(json.dumps(bus_data)), first_file)
+
+    recollected = reordered_copy(bus_data)
+    recollected['version'] += 1
+    recollected['generated_at'] = '2026-01-02T03:00:00'
+    write_bus_data(recollected, second_file)
+
+    store = BackupStore(tmp_path / 'backup')
+    first = store.backup({'bus_data.json': first_file})
+    second = store.backup({'bus_data.json': second_file})
+
+    first_chunks = set(first['files']['bus_data.json']['chunks'])
+    new_chunks = [digest for digest in second['files']['bus_data.json']['chunks'] if digest not in first_chunks]
+    assert len(first_chunks) > 3
+    assert new_chunks
+    for digest in new_chunks:
+        chunk = zlib.decompress(store.chunk_path(digest).read_bytes())
+        assert chunk.startswith((b'  "version"', b'  "generated_at"')), chunk[:80]
+
+
+def test_write_bus_data_sorts_stop_routes(tmp_path):
+    bus_data = make_bus_data(routes=20, stops=30)
+    output_file = tmp_path / 'bus_data.json'
+    write_bus_data(reordered_copy(bus_data), output_file)
+
+    saved = json.loads(output_file.read_text(encoding='utf-8'))
+    for routes in saved['stop_routes'].values():
+        keys = [(route['route_id'], route['sequence']) for route in routes]
+        assert keys == sorted(keys)
+
+
+def backup_versions(store, tmp_path, count):
+    data_file = tmp_path / 'bus_data.json'
+    meta_file = tmp_path / 'bus_data_metadata.json'
+    versions = []
+    for n in range(count):
+        bus_data = make_bus_data(routes=40, stops=80, seed=n)
+        bus_data['version'] += n
+        write_bus_data(bus_data, data_file)
+        meta_file.write_text(json.dumps({'version': bus_data['version']}), encoding='utf-8')
+        versions.append(store.backup({'bus_data.json': data_file, 'bus_data_metadata.json': meta_file,
+                                      'missing.json': tmp_path / 'missing.json'},
+                                     label={'version': bus_data['version']}))
+    return versions
+
+
+def test_restore_round_trip_and_lookup(tmp_path):
+    store = BackupStore(tmp_path / 'backup')
+    first, second = backup_versions(store, tmp_path, 2)
+    assert set(first['files']) == {'bus_data.json', 'bus_data_metadata.json'}
+    assert first['id'] != second['id']
+    current = (tmp_path / 'bus_data.json').read_bytes()
+
+    # 內容未變不建立新版本
+    assert store.backup({'bus_data.json': tmp_path / 'bus_data.json',
+                         'bus_data_metadata.json': tmp_path / 'bus_data_metadata.json'}) is None
+
+    restore_dir = tmp_path / 'restore'
+    restored = store.restore(str(first['label']['version']), restore_dir)
+    assert sorted(restored) == ['bus_data.json', 'bus_data_metadata.json']
+    assert json.loads((restore_dir / 'bus_data_metadata.json').read_text())['version'] == first['label']['version']
+    assert store.find_version('latest')['id'] == second['id']
+    store.restore('latest', restore_dir)
+    assert (restore_dir / 'bus_data.json').read_bytes() == current
+    assert list(restore_dir.glob('.*.tmp')) == []
+
+
+def test_prune_keeps_latest_versions_and_their_chunks(tmp_path):
+    store = BackupStore(tmp_path / 'backup', keep_versions=2)
+    versions = backup_versions(store, tmp_path, 4)
+    assert versions[-1]['stats']['removed_versions'] == [versions[1]['id']]
+    assert [v['id'] for v in store.list_versions()] == [versions[3]['id'], versions[2]['id']]
+
+    kept = {digest for version in store.list_versions()
+            for record in version['files'].values() for digest in record['chunks']}
+    on_disk = {path.stem for path in store.chunks_dir.rglob('*.z')}
+    assert on_disk == kept
+    assert store.find_version(str(versions[0]['label']['version'])) is None
+
+
+def test_corrupted_chunk_leaves_target_untouched(tmp_path):
+    store = BackupStore(tmp_path / 'backup')
+    (version,) = backup_versions(store, tmp_path, 1)
+    digest = version['files']['bus_data.json']['chunks'][0]
+    store.chunk_path(digest).write_bytes(zlib.compress(b'tampered'))
+
+    target = tmp_path / 'target'
+    target.mkdir()
+    (target / 'bus_data.json').write_text('{"current": true}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        store.restore(version['id'], target)
+    assert (target / 'bus_data.json').read_text(encoding='utf-8') == '{"current": true}'
+    with pytest.raises(KeyError):
+        store.restore('19990101_000000', target)
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from bus_data_reader import BusDataReader, build_and_write, load_bus_data_header
+from collect_bus_data_optimized_concurrent import write_bus_data
+
+
+def make_bus_data():
+    routes = {f"KMB_{n}_O": {'route_number': str(n), 'company': 'KMB', 'direction': 'outbound', 'dest_tc': '中環'}
+              for n in range(50)}
+    stops = {f"{n:04X}": {'name_tc': f"站{n}", 'name_en': f"Stop {n}", 'latitude': 22.3, 'longitude': 114.1,
+                          'company': 'KMB'} for n in range(120)}
+    route_stops = {route_id: [{'stop_id': f"{(i * 7 + s) % 120:04X}", 'sequence': s + 1} for s in range(5)]
+                   for i, route_id in enumerate(routes)}
+    stop_routes = {}
+    for route_id, entries in route_stops.items():
+        for entry in entries:
+            stop_routes.setdefault(entry['stop_id'], []).append({'route_id': route_id, 'sequence': entry['sequence']})
+    return {'version': 1700000000, 'generated_at': '2026-01-01T03:00:00', 'routes': routes, 'stops': stops,
+            'route_stops': route_stops, 'stop_routes': stop_routes, 'summary': {'total_routes': len(routes)}}
+
+
+@pytest.fixture
+def companion(tmp_path):
+    bus_data = make_bus_data()
+    write_bus_data(bus_data, tmp_path / 'bus_data.json')
+    path, stats = build_and_write(bus_data, tmp_path)
+    assert stats['records']['routes'] == 50
+    return bus_data, tmp_path, path
+
+
+def test_reader_returns_every_record(companion):
+    bus_data, _, path = companion
+    with BusDataReader(path) as reader:
+        assert reader.version == bus_data['version']
+        assert reader.summary == bus_data['summary']
+        assert reader.counts() == {section: len(bus_data[section])
+                                   for section in ('routes', 'route_stops', 'stops', 'stop_routes')}
+        for route_id, route in bus_data['routes'].items():
+            assert reader.route(route_id) == route
+            assert reader.route_stops(route_id) == bus_data['route_stops'][route_id]
+        for stop_id, stop in bus_data['stops'].items():
+            assert reader.stop(stop_id) == stop
+            assert reader.stop_routes(stop_id) == bus_data['stop_routes'].get(stop_id)
+        assert list(reader.keys('routes')) == sorted(bus_data['routes'])
+        assert reader.route('KMB_999_O') is None
+        assert reader.stop('') is None
+
+
+def test_header_falls_back_to_json_when_companion_is_stale(companion):
+    bus_data, output_dir, _ = companion
+    data_file = output_dir / 'bus_data.json'
+    assert load_bus_data_header(data_file)['summary'] == bus_data['summary']
+
+    bus_data['summary'] = {'total_routes': 0}
+    data_file.write_text(json.dumps(bus_data), encoding='utf-8')
+    assert load_bus_data_header(data_file)['summary'] == {'total_routes': 0}
+
+
+def test_rejects_files_that_are_not_companions(tmp_path):
+    path = tmp_path / 'bus_data.bin'
+    path.write_bytes(b'not a companion file' * 10)
+    with pytest.raises(ValueError):
+        BusDataReader(path)
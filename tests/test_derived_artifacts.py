@@ -0,0 +1,92 @@
+import json
+import sys
+
+import pytest
+
+import derived_artifacts
+from derived_artifacts import MANIFEST_FILENAME, build_artifacts
+
+# 測試用產物模組：只使用 routes 分區，受 FAKE_ARTIFACT_MODE 影響
+ARTIFACT_SOURCE = '''
+import os
+import json
+from pathlib import Path
+
+ARTIFACT_INPUTS = ('routes',)
+ARTIFACT_ENV = ('FAKE_ARTIFACT_MODE',)
+builds = []
+
+
+def build_and_write(bus_data, output_dir):
+    if os.getenv('FAKE_ARTIFACT_MODE') == 'fail':
+        raise RuntimeError('boom')
+    builds.append(sorted(bus_data['routes']))
+    path = Path(output_dir) / 'fake_artifact.json'
+    path.write_text(json.dumps(sorted(bus_data['routes'])), encoding='utf-8')
+    return str(path), {'build_seconds': 0.0, 'file_size_bytes': path.stat().st_size}
+'''
+
+
+@pytest.fixture
+def artifact(tmp_path, monkeypatch):
+    module_dir = tmp_path / 'modules'
+    module_dir.mkdir()
+    (module_dir / 'fake_artifact.py').write_text(ARTIFACT_SOURCE, encoding='utf-8')
+    monkeypatch.syspath_prepend(str(module_dir))
+    monkeypatch.delenv('FAKE_ARTIFACT_MODE', raising=False)
+    import fake_artifact
+    yield fake_artifact
+    sys.modules.pop('fake_artifact', None)
+
+
+def build(bus_data, data_file):
+    data_file.write_text(json.dumps(bus_data), encoding='utf-8')
+    return build_artifacts(bus_data, data_file, names=('fake_artifact',), workers=1)['fake_artifact']
+
+
+def test_unchanged_inputs_skip_the_build(tmp_path, artifact):
+    data_file = tmp_path / 'bus_data.json'
+    bus_data = {'version': 1, 'routes': {'KMB_1_O': {}}, 'stops': {'A': {}}}
+
+    assert build(bus_data, data_file)['cached'] is False
+    # 版本號及未使用的分區改變不影響快取
+    bus_data.update(version=2, stops={'A': {}, 'B': {}})
+    record = build(bus_data, data_file)
+    assert record['cached'] is True
+    assert len(artifact.builds) == 1
+
+    manifest = json.loads((tmp_path / MANIFEST_FILENAME).read_text(encoding='utf-8'))
+    assert manifest['fake_artifact']['input_sha256'] == record['input_sha256']
+    assert 'cached' not in manifest['fake_artifact']
+
+
+def test_input_section_env_and_missing_output_trigger_rebuild(tmp_path, artifact, monkeypatch):
+    data_file = tmp_path / 'bus_data.json'
+    bus_data = {'version': 1, 'routes': {'KMB_1_O': {}}, 'stops': {}}
+    first = build(bus_data, data_file)
+
+    bus_data['routes']['KMB_2_O'] = {}
+    second = build(bus_data, data_file)
+    assert second['cached'] is False
+    assert second['input_sha256'] != first['input_sha256']
+
+    monkeypatch.setenv('FAKE_ARTIFACT_MODE', 'compact')
+    assert build(bus_data, data_file)['cached'] is False
+
+    (tmp_path / 'fake_artifact.json').unlink()
+    assert build(bus_data, data_file)['cached'] is False
+    assert build(bus_data, data_file)['cached'] is True
+    assert len(artifact.builds) == 4
+
+
+def test_failed_build_is_dropped_from_manifest(tmp_path, artifact, monkeypatch):
+    data_file = tmp_path / 'bus_data.json'
+    bus_data = {'version': 1, 'routes': {'KMB_1_O': {}}}
+    build(bus_data, data_file)
+
+    monkeypatch.setenv('FAKE_ARTIFACT_MODE', 'fail')
+    assert 'error' in build(bus_data, data_file)
+    assert 'fake_artifact' not in derived_artifacts.load_manifest(tmp_path)
+
+    monkeypatch.delenv('FAKE_ARTIFACT_MODE')
+    assert build(bus_data, data_file)['cached'] is False
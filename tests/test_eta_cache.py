@@ -0,0 +1,91 @@
+import threading
+
+import eta_service
+from collect_bus_data_optimized_concurrent import CollectorMetrics
+from eta_service import ETACache
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_hit_within_ttl_and_reload_after_expiry(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(eta_service.time, 'time', clock)
+    cache = ETACache(ttl=15)
+    calls = []
+
+    def loader():
+        calls.append(clock.now)
+        return {'eta': len(calls)}
+
+    assert cache.get('KMB_1A_O:A', loader) == ({'eta': 1}, 1000.0, 'miss')
+    clock.now += 14
+    assert cache.get('KMB_1A_O:A', loader) == ({'eta': 1}, 1000.0, 'hit')
+    clock.now += 1
+    assert cache.get('KMB_1A_O:A', loader) == ({'eta': 2}, 1015.0, 'miss')
+    assert cache.stats == {'hits': 1, 'misses': 2, 'coalesced': 0, 'failures': 0}
+
+
+def test_failed_loads_are_not_cached():
+    cache = ETACache(ttl=15)
+    results = iter([None, {'eta': 1}])
+
+    assert cache.get('key', lambda: next(results))[::2] == (None, 'miss')
+    assert cache.get('key', lambda: next(results))[::2] == ({'eta': 1}, 'miss')
+    assert cache.stats['failures'] == 1
+    assert cache.size() == 1
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    cache = ETACache(ttl=15)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return {'eta': 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('key', loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while cache.stats['misses'] + cache.stats['coalesced'] < len(threads):
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(status for _, _, status in results) == ['coalesced'] * 7 + ['miss']
+    assert all(value == {'eta': 1} for value, _, _ in results)
+
+
+def test_expired_entries_are_purged_when_full(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(eta_service.time, 'time', clock)
+    cache = ETACache(ttl=15, max_entries=3)
+    for key in ('a', 'b', 'c'):
+        cache.get(key, lambda: 1)
+    clock.now += 20
+    cache.get('d', lambda: 1)
+    assert cache.size() == 1
+
+
+def test_latency_samples_are_bounded():
+    metrics = CollectorMetrics(latency_samples=16)
+    url = 'https://data.etabus.gov.hk/v1/transport/kmb/eta/A/1/1'
+    for i in range(1000):
+        metrics.record_request(url, float(i), 10, ok=True)
+
+    (stats,) = metrics.endpoints.values()
+    (endpoint,) = metrics.snapshot()['endpoints'].values()
+    assert len(stats['latencies']) == 16
+    assert endpoint['requests'] == 1000
+    assert endpoint['latency_seconds']['sum'] == sum(range(1000))
+    assert endpoint['latency_seconds']['max'] == 999.0
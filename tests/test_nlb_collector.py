@@ -0,0 +1,43 @@
+import logging
+
+from collect_bus_data_optimized_concurrent import NLBOperatorCollector, OptimizedConcurrentBusDataCollector
+
+ROUTES = [
+    # routeId 順序決定方向；B2 有四個 routeId (兩組變體)
+    {'routeId': '12', 'routeNo': 'B2', 'routeName_c': '丙 > 丁', 'routeName_e': 'C > D'},
+    {'routeId': '3', 'routeNo': '1', 'routeName_c': '大澳 > 梅窩', 'routeName_e': 'Tai O > Mui Wo'},
+    {'routeId': '4', 'routeNo': '1', 'routeName_c': '梅窩 > 大澳', 'routeName_e': 'Mui Wo > Tai O'},
+    {'routeId': '10', 'routeNo': 'B2', 'routeName_c': '甲 > 乙', 'routeName_e': 'A > B'},
+    {'routeId': '11', 'routeNo': 'B2', 'routeName_c': '乙 > 甲', 'routeName_e': 'B > A'},
+    {'routeId': '13', 'routeNo': 'B2', 'routeName_c': '丁 > 丙', 'routeName_e': 'D > C'},
+]
+
+
+def fake_fetch_json(url, description="", timeout=30):
+    if 'action=list&routeId=' in url:
+        route_id = url.rsplit('=', 1)[1]
+        stops = [{'stopId': f"{route_id}{n}", 'stopName_c': f"站{n}", 'stopName_e': f"Stop {n}",
+                  'latitude': '22.25', 'longitude': '113.9'} for n in range(3)]
+        return {'stops': stops}, 0.0
+    return {'routes': ROUTES}, 0.0
+
+
+def test_nlb_keeps_extra_route_variants(monkeypatch, caplog):
+    collector = OptimizedConcurrentBusDataCollector(operators=['NLB'])
+    monkeypatch.setattr(collector, 'fetch_json', fake_fetch_json)
+
+    with caplog.at_level(logging.WARNING):
+        assert collector.collect_per_route_operator(NLBOperatorCollector())
+
+    routes = collector.bus_data['routes']
+    assert sorted(routes) == ['NLB_1_I', 'NLB_1_O', 'NLB_B2_I', 'NLB_B2_I_2', 'NLB_B2_O', 'NLB_B2_O_2']
+    assert routes['NLB_B2_O']['origin_en'] == 'A'
+    assert routes['NLB_B2_I']['origin_en'] == 'B'
+    assert (routes['NLB_B2_O_2']['route_number'], routes['NLB_B2_O_2']['direction']) == ('B2', 'outbound')
+    assert routes['NLB_B2_O_2']['origin_en'] == 'C'
+    assert routes['NLB_B2_I_2']['direction'] == 'inbound'
+    assert [stop['stop_id'] for stop in collector.bus_data['route_stops']['NLB_B2_O_2']] == ['120', '121', '122']
+
+    warnings = [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert 'B2 has 4 routeIds' in warnings[0]
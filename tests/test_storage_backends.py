@@ -0,0 +1,112 @@
+import re
+import json
+
+import pytest
+import requests
+
+from storage_backends import FirebaseStorageBackend
+
+CHUNK = 256 * 1024
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, payload=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.payload = payload or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeSessionServer:
+    """GCS resumable session 替身：按 Content-Range 接收位元組，可注入失敗"""
+
+    def __init__(self, fail_calls=()):
+        self.received = bytearray()
+        self.calls = 0
+        self.fail_calls = dict(fail_calls)   # 第 N 次上傳請求 -> 'drop' (收到後斷線) / 'lost' (未收到) / 503
+        self.queries = 0
+
+    def put(self, url, data=None, headers=None, timeout=None):
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)|bytes \*/(\d+)', headers['Content-Range'])
+        if data is None:
+            self.queries += 1
+            return self._progress(int(match.group(4)))
+
+        self.calls += 1
+        start, total = int(match.group(1)), int(match.group(3))
+        failure = self.fail_calls.get(self.calls)
+        if failure == 'lost':
+            raise requests.ConnectionError('connection reset')
+        if failure == 503:
+            return FakeResponse(503)
+        assert start == len(self.received)
+        self.received.extend(data)
+        if failure == 'drop':
+            raise requests.ConnectionError('connection reset after upload')
+        return self._progress(total)
+
+    def _progress(self, total):
+        if len(self.received) >= total:
+            return FakeResponse(200, payload={'generation': '7'})
+        headers = {'Range': f"bytes=0-{len(self.received) - 1}"} if self.received else {}
+        return FakeResponse(308, headers)
+
+
+class FakeBlob:
+    def __init__(self):
+        self.metadata = {}
+
+    def create_resumable_upload_session(self, content_type, size, if_generation_match):
+        return 'https://upload.example/session'
+
+
+class FakeBucket:
+    name = 'bucket'
+
+    def get_blob(self, name):
+        return None
+
+    def blob(self, name):
+        return FakeBlob()
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'bus_data.json'
+    path.write_bytes(bytes(range(256)) * (CHUNK * 3 // 256 + 100))
+    return path
+
+
+def make_backend(tmp_path, retries=3):
+    return FirebaseStorageBackend(FakeBucket(), chunk_size=CHUNK, state_file=tmp_path / 'sessions.json',
+                                  chunk_retries=retries, retry_backoff=0)
+
+
+@pytest.mark.parametrize('failure', ['drop', 'lost', 503])
+def test_chunk_failure_resumes_from_confirmed_offset(tmp_path, data_file, monkeypatch, failure):
+    server = FakeSessionServer({2: failure})
+    monkeypatch.setattr(requests, 'put', server.put)
+
+    result = make_backend(tmp_path).upload(str(data_file), 'bus_data.json')
+
+    assert bytes(server.received) == data_file.read_bytes()
+    assert server.queries == 1
+    assert result['generation'] == 7
+    assert json.loads((tmp_path / 'sessions.json').read_text()) == {}
+
+
+def test_retries_are_bounded(tmp_path, data_file, monkeypatch):
+    server = FakeSessionServer({call: 'lost' for call in range(2, 10)})
+    monkeypatch.setattr(requests, 'put', server.put)
+
+    with pytest.raises(requests.ConnectionError):
+        make_backend(tmp_path, retries=2).upload(str(data_file), 'bus_data.json')
+    assert server.calls == 4
+    # session 保留，下次執行可續傳
+    assert 'bus_data.json' in json.loads((tmp_path / 'sessions.json').read_text())
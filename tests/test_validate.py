@@ -0,0 +1,54 @@
+import json
+
+from collect_bus_data_optimized_concurrent import cmd_validate, parse_args, stop_routes_mismatches
+
+
+def make_bus_data():
+    routes = {
+        'KMB_1_O': {'route_number': '1', 'company': 'KMB', 'direction': 'outbound', 'origin_tc': '甲', 'dest_tc': '乙'},
+        'NLB_B2_O_2': {'route_number': 'B2', 'company': 'NLB', 'direction': 'outbound', 'origin_tc': '丙', 'dest_tc': '丁'},
+    }
+    route_stops = {
+        'KMB_1_O': [{'stop_id': 'A', 'sequence': 1}, {'stop_id': 'B', 'sequence': 2}],
+        'NLB_B2_O_2': [{'stop_id': 'B', 'sequence': 1}, {'stop_id': 'C', 'sequence': 2}],
+    }
+    stop_routes = {}
+    for route_id, stops in route_stops.items():
+        for stop in stops:
+            stop_routes.setdefault(stop['stop_id'], []).append({
+                'route_number': routes[route_id]['route_number'], 'company': routes[route_id]['company'],
+                'direction': 'outbound', 'destination': routes[route_id]['dest_tc'],
+                'sequence': stop['sequence'], 'route_id': route_id})
+    stops = {stop_id: {'name_tc': stop_id, 'name_en': stop_id, 'latitude': 22.3, 'longitude': 114.1,
+                       'company': 'KMB'} for stop_id in stop_routes}
+    return {'version': 1, 'routes': routes, 'stops': stops, 'route_stops': route_stops, 'stop_routes': stop_routes}
+
+
+def test_stop_routes_mismatches():
+    bus_data = make_bus_data()
+    assert stop_routes_mismatches(bus_data) == []
+
+    bus_data['stop_routes']['B'].pop()
+    del bus_data['stop_routes']['C']
+    bus_data['stop_routes']['Z'] = [{'route_id': 'KMB_1_O', 'sequence': 9}]
+    assert stop_routes_mismatches(bus_data) == ['B', 'C', 'Z']
+
+
+def test_validate_checks_file_as_stored(tmp_path, monkeypatch):
+    monkeypatch.setenv('OUTPUT_DIRECTORY', str(tmp_path))
+    bus_data = make_bus_data()
+    del bus_data['stop_routes']['C']
+    data_file = tmp_path / 'bus_data.json'
+    data_file.write_text(json.dumps(bus_data), encoding='utf-8')
+    collector_report = tmp_path / 'validation_report.json'
+    collector_report.write_text('{"status": "PASS"}', encoding='utf-8')
+    report_path = tmp_path / 'check.json'
+
+    # 資料量低於收集門檻，驗證失敗；重點是原樣驗證及報告位置
+    assert cmd_validate(parse_args(['validate', str(data_file), '--report', str(report_path)])) == 2
+
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    assert report['checks']['stop_routes_match']['examples'] == ['C']
+    assert report['checks']['company_validity']['status'] == 'PASS'
+    assert json.loads(data_file.read_text(encoding='utf-8')) == bus_data
+    assert collector_report.read_text(encoding='utf-8') == '{"status": "PASS"}'
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+預先計算的轉乘圖 (直達及一次轉乘查詢)
+- 路線邊：每條路線的站點序列 (CSR 陣列)，加上每個站點的 (路線, 站序位置)，從位置差即可得到乘車站數
+- 步行連結：以網格空間索引找出半徑內的站點對 (包括 KMB / CTB 不同 ID 但相近的站點)
+- 緊湊的二進制格式 (transfer_graph.bin)：字串表 + 小端 uint32 / uint16 陣列，載入時不需解析 JSON
+- 查詢 API：direct() 及 one_transfer()，完整數據集每次查詢只需數毫秒
+
+使用方式:
+  python3 transfer_graph.py build                       # 由 OUTPUT_DIRECTORY/bus_data.json 建立
+  python3 transfer_graph.py query <起點 stop_id> <終點 stop_id>
+  python3 transfer_graph.py bench --queries 500         # 隨機起終點的查詢耗時
+"""
+
+import os
+import sys
+import math
+import time
+import array
+import random
+import struct
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+GRAPH_MAGIC = b'HKTG'
+GRAPH_FORMAT_VERSION = 1
+GRAPH_FILENAME = 'transfer_graph.bin'
+
+DEFAULT_WALK_RADIUS_M = 200     # 與 App 附近站點搜尋的半徑相同
+MAX_WALK_LINKS = 30             # 每個站點最多保留最近的幾個步行鄰站 (大型轉車站不會令圖爆炸)
+TRANSFER_PENALTY_STOPS = 3      # 轉乘一次相當於多坐幾個站 (排序用)
+WALK_METRES_PER_STOP = 100      # 每步行多少米相當於多坐一個站
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEG_LAT = 111320.0
+
+# derived_artifacts 的快取輸入
+ARTIFACT_INPUTS = ('routes', 'route_stops', 'stops')
+ARTIFACT_ENV = ('TRANSFER_WALK_RADIUS_M',)
+
+
+def _le_array(typecode: str, values=()) -> array.array:
+    arr = array.array(typecode, values)
+    assert arr.itemsize == {'I': 4, 'H': 2}[typecode], f"Unexpected item size for '{typecode}'"
+    return arr
+
+
+def _to_le_bytes(arr: array.array) -> bytes:
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le_bytes(typecode: str, data: bytes) -> array.array:
+    arr = _le_array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def walking_links(stop_ids: List[str], stops: Dict[str, Dict[str, Any]],
+                  radius_m: float, max_links: int = MAX_WALK_LINKS) -> List[List[Tuple[int, int]]]:
+    """
+    網格空間索引：格子邊長 = 半徑，每個站點只需檢查自己及相鄰 8 格
+    返回每個站點最近的 max_links 個 [(鄰近站點 index, 距離米), ...]，按距離排序
+    """
+    cos_lat = math.cos(math.radians(22.35))  # 香港緯度；格子只用作篩選，實際距離以 haversine 計算
+    cell_lat = radius_m / METRES_PER_DEG_LAT
+    cell_lon = radius_m / (METRES_PER_DEG_LAT * cos_lat)
+
+    coords = []
+    grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for index, stop_id in enumerate(stop_ids):
+        stop = stops.get(stop_id)
+        if stop is None:
+            coords.append(None)
+            continue
+        lat, lon = stop['latitude'], stop['longitude']
+        cell = (int(math.floor(lat / cell_lat)), int(math.floor(lon / cell_lon)))
+        coords.append((lat, lon, cell))
+        grid[cell].append(index)
+
+    links: List[List[Tuple[int, int]]] = [[] for _ in stop_ids]
+    for index, coord in enumerate(coords):
+        if coord is None:
+            continue
+        lat, lon, (row, col) = coord
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                for other in grid.get((row + dr, col + dc), ()):
+                    # 每對只計算一次
+                    if other <= index:
+                        continue
+                    other_lat, other_lon, _ = coords[other]
+                    distance = haversine_m(lat, lon, other_lat, other_lon)
+                    if distance <= radius_m:
+                        metres = int(round(distance))
+                        links[index].append((other, metres))
+                        links[other].append((index, metres))
+
+    for neighbours in links:
+        neighbours.sort(key=lambda link: link[1])
+        del neighbours[max_links:]
+    return links
+
+
+def build_transfer_graph(bus_data: Dict[str, Any], walk_radius_m: float = DEFAULT_WALK_RADIUS_M) -> Dict[str, Any]:
+    """由 bus_data 建立轉乘圖的陣列 (CSR 格式)"""
+    route_ids = sorted(route_id for route_id in bus_data['route_stops'] if route_id in bus_data['routes'])
+    stop_ids = sorted(set(bus_data['stops']) | {
+        stop['stop_id'] for route_id in route_ids for stop in bus_data['route_stops'][route_id]
+    })
+    stop_index = {stop_id: index for index, stop_id in enumerate(stop_ids)}
+
+    # 路線 → 站點序列 (按 sequence 排序)
+    route_offsets = _le_array('I', [0])
+    route_stops = _le_array('I')
+    stop_entries: List[List[Tuple[int, int]]] = [[] for _ in stop_ids]
+    for route_index, route_id in enumerate(route_ids):
+        sequence = sorted(bus_data['route_stops'][route_id], key=lambda stop: int(stop['sequence']))
+        for position, stop in enumerate(sequence):
+            stop_idx = stop_index[stop['stop_id']]
+            route_stops.append(stop_idx)
+            stop_entries[stop_idx].append((route_index, position))
+        route_offsets.append(len(route_stops))
+
+    # 站點 → (路線, 位置)
+    stop_offsets = _le_array('I', [0])
+    entry_routes = _le_array('I')
+    entry_positions = _le_array('H')
+    for entries in stop_entries:
+        for route_index, position in entries:
+            entry_routes.append(route_index)
+            entry_positions.append(position)
+        stop_offsets.append(len(entry_routes))
+
+    # 步行連結
+    walk_offsets = _le_array('I', [0])
+    walk_targets = _le_array('I')
+    walk_metres = _le_array('H')
+    for neighbours in walking_links(stop_ids, bus_data['stops'], walk_radius_m):
+        for other, metres in neighbours:
+            walk_targets.append(other)
+            walk_metres.append(metres)
+        walk_offsets.append(len(walk_targets))
+
+    return {
+        'data_version': int(bus_data.get('version') or 0),
+        'walk_radius_m': float(walk_radius_m),
+        'stop_ids': stop_ids,
+        'route_ids': route_ids,
+        'route_offsets': route_offsets,
+        'route_stops': route_stops,
+        'stop_offsets': stop_offsets,
+        'entry_routes': entry_routes,
+        'entry_positions': entry_positions,
+        'walk_offsets': walk_offsets,
+        'walk_targets': walk_targets,
+        'walk_metres': walk_metres,
+    }
+
+
+ARRAY_SECTIONS = [
+    ('route_offsets', 'I'), ('route_stops', 'I'),
+    ('stop_offsets', 'I'), ('entry_routes', 'I'), ('entry_positions', 'H'),
+    ('walk_offsets', 'I'), ('walk_targets', 'I'), ('walk_metres', 'H'),
+]
+HEADER = struct.Struct('<4sHHqf')  # magic, version, section count, data version, walk radius
+
+
+def write_transfer_graph(graph: Dict[str, Any], output_file: Path) -> int:
+    """
+    寫入二進制檔案 (原子替換)，返回檔案大小
+    格式: header + 兩個字串表 (uint32 長度 + '\\n' 分隔的 UTF-8) + 陣列段 (uint32 元素數 + 小端數據)
+    """
+    output_file = Path(output_file)
+    tmp_file = output_file.with_suffix(output_file.suffix + '.tmp')
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(GRAPH_MAGIC, GRAPH_FORMAT_VERSION, len(ARRAY_SECTIONS),
+                            graph['data_version'], graph['walk_radius_m']))
+        for key in ('stop_ids', 'route_ids'):
+            blob = '\n'.join(graph[key]).encode('utf-8')
+            f.write(struct.pack('<I', len(blob)))
+            f.write(blob)
+        for key, _ in ARRAY_SECTIONS:
+            f.write(struct.pack('<I', len(graph[key])))
+            f.write(_to_le_bytes(graph[key]))
+    os.replace(tmp_file, output_file)
+    return output_file.stat().st_size
+
+
+def build_and_write(bus_data: Dict[str, Any], output_dir: Path,
+                    walk_radius_m: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+    """收集流程的後處理階段：建立並寫入 transfer_graph.bin，返回 (路徑, 統計)"""
+    if walk_radius_m is None:
+        walk_radius_m = float(os.getenv('TRANSFER_WALK_RADIUS_M', str(DEFAULT_WALK_RADIUS_M)))
+    start_time = time.time()
+    graph = build_transfer_graph(bus_data, walk_radius_m)
+    output_file = Path(output_dir) / GRAPH_FILENAME
+    size = write_transfer_graph(graph, output_file)
+    stats = {
+        'stops': len(graph['stop_ids']),
+        'routes': len(graph['route_ids']),
+        'route_edges': len(graph['route_stops']),
+        'walking_links': len(graph['walk_targets']),
+        'walk_radius_m': walk_radius_m,
+        'file_size_bytes': size,
+        'build_seconds': round(time.time() - start_time, 3)
+    }
+    return str(output_file), stats
+
+
+class TransferGraph:
+    """載入 transfer_graph.bin 並回答直達 / 一次轉乘查詢"""
+
+    def __init__(self, graph: Dict[str, Any]):
+        self.data_version = graph['data_version']
+        self.walk_radius_m = graph['walk_radius_m']
+        self.stop_ids: List[str] = graph['stop_ids']
+        self.route_ids: List[str] = graph['route_ids']
+        self.stop_index = {stop_id: index for index, stop_id in enumerate(self.stop_ids)}
+        self.route_index = {route_id: index for index, route_id in enumerate(self.route_ids)}
+        for key, _ in ARRAY_SECTIONS:
+            setattr(self, key, graph[key])
+
+    @classmethod
+    def load(cls, graph_file: Path) -> 'TransferGraph':
+        with open(graph_file, 'rb') as f:
+            data = f.read()
+        magic, version, sections, data_version, walk_radius_m = HEADER.unpack_from(data, 0)
+        if magic != GRAPH_MAGIC or version != GRAPH_FORMAT_VERSION or sections != len(ARRAY_SECTIONS):
+            raise ValueError(f"Not a transfer graph (format {GRAPH_FORMAT_VERSION}): {graph_file}")
+
+        offset = HEADER.size
+        graph: Dict[str, Any] = {'data_version': data_version, 'walk_radius_m': walk_radius_m}
+        for key in ('stop_ids', 'route_ids'):
+            (length,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            blob = data[offset:offset + length].decode('utf-8')
+            graph[key] = blob.split('\n') if blob else []
+            offset += length
+        for key, typecode in ARRAY_SECTIONS:
+            (count,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            size = count * _le_array(typecode).itemsize
+            graph[key] = _from_le_bytes(typecode, data[offset:offset + size])
+            offset += size
+        return cls(graph)
+
+    def _index(self, stop_id: str) -> int:
+        if stop_id not in self.stop_index:
+            raise KeyError(f"Unknown stop: {stop_id}")
+        return self.stop_index[stop_id]
+
+    def _entries(self, stop: int):
+        for i in range(self.stop_offsets[stop], self.stop_offsets[stop + 1]):
+            yield self.entry_routes[i], self.entry_positions[i]
+
+    def _walks(self, stop: int):
+        for i in range(self.walk_offsets[stop], self.walk_offsets[stop + 1]):
+            yield self.walk_targets[i], self.walk_metres[i]
+
+    def _leg(self, route: int, board: int, alight: int) -> Dict[str, Any]:
+        start = self.route_offsets[route]
+        return {
+            'route_id': self.route_ids[route],
+            'board_stop': self.stop_ids[self.route_stops[start + board]],
+            'alight_stop': self.stop_ids[self.route_stops[start + alight]],
+            'board_position': board,
+            'alight_position': alight,
+            'stops': alight - board
+        }
+
+    def routes_at(self, stop_id: str) -> List[str]:
+        return sorted({self.route_ids[route] for route, _ in self._entries(self._index(stop_id))})
+
+    def nearby_stops(self, stop_id: str) -> List[Tuple[str, int]]:
+        """步行半徑內的站點 [(stop_id, 米), ...]"""
+        return [(self.stop_ids[other], metres) for other, metres in self._walks(self._index(stop_id))]
+
+    def direct(self, origin_id: str, dest_id: str) -> List[Dict[str, Any]]:
+        """同一路線上起點在終點之前的直達班次 (按站數排序)"""
+        origin, dest = self._index(origin_id), self._index(dest_id)
+        dest_positions: Dict[int, List[int]] = defaultdict(list)
+        for route, position in self._entries(dest):
+            dest_positions[route].append(position)
+
+        best: Dict[int, Tuple[int, int]] = {}
+        for route, board in self._entries(origin):
+            for alight in dest_positions.get(route, ()):
+                if alight > board and (route not in best or alight - board < best[route][1] - best[route][0]):
+                    best[route] = (board, alight)
+        legs = [self._leg(route, board, alight) for route, (board, alight) in best.items()]
+        legs.sort(key=lambda leg: leg['stops'])
+        return legs
+
+    def one_transfer(self, origin_id: str, dest_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        一次轉乘 (轉乘點可以是同一站或步行半徑內的另一站)
+        1. 起點的每條路線向前展開：可到達站點 → {路線: (站數, 上車位置, 下車位置)}
+        2. 終點的每條路線向後展開：可出發站點 → {路線: (站數, 上車位置, 下車位置)}
+        3. 對每個可到達站點及其步行鄰站配對，每對 (路線1, 路線2) 保留得分最低的轉乘點
+        """
+        origin, dest = self._index(origin_id), self._index(dest_id)
+        # 可以直達的路線不需要轉乘
+        direct_routes = {self.route_index[leg['route_id']] for leg in self.direct(origin_id, dest_id)}
+
+        forward: Dict[int, Dict[int, Tuple[int, int, int]]] = defaultdict(dict)
+        for route, board in self._entries(origin):
+            start, end = self.route_offsets[route], self.route_offsets[route + 1]
+            for q in range(start + board + 1, end):
+                rides = q - start - board
+                reached = forward[self.route_stops[q]]
+                if route not in reached or rides < reached[route][0]:
+                    reached[route] = (rides, board, q - start)
+
+        backward: Dict[int, Dict[int, Tuple[int, int, int]]] = defaultdict(dict)
+        for route, alight in self._entries(dest):
+            start = self.route_offsets[route]
+            for q in range(start, start + alight):
+                rides = alight - (q - start)
+                departing = backward[self.route_stops[q]]
+                if route not in departing or rides < departing[route][0]:
+                    departing[route] = (rides, q - start, alight)
+
+        best: Dict[Tuple[int, int], Tuple[float, int, int, int]] = {}
+        for stop, first_legs in forward.items():
+            if stop == dest:
+                continue
+            for transfer_stop, metres in [(stop, 0)] + list(self._walks(stop)):
+                second_legs = backward.get(transfer_stop)
+                if not second_legs:
+                    continue
+                for route1, (rides1, _, _) in first_legs.items():
+                    for route2, (rides2, _, _) in second_legs.items():
+                        if route1 == route2 or route1 in direct_routes or route2 in direct_routes:
+                            continue
+                        score = rides1 + rides2 + TRANSFER_PENALTY_STOPS + metres / WALK_METRES_PER_STOP
+                        key = (route1, route2)
+                        if key not in best or score < best[key][0]:
+                            best[key] = (score, stop, transfer_stop, metres)
+
+        options = []
+        for (route1, route2), (score, stop, transfer_stop, metres) in sorted(best.items(), key=lambda item: item[1][0])[:limit]:
+            _, board1, alight1 = forward[stop][route1]
+            _, board2, alight2 = backward[transfer_stop][route2]
+            options.append({
+                'score': round(score, 2),
+                'walk_metres': metres,
+                'legs': [self._leg(route1, board1, alight1), self._leg(route2, board2, alight2)]
+            })
+        return options
+
+    def plan(self, origin_id: str, dest_id: str, limit: int = 10) -> Dict[str, Any]:
+        return {
+            'origin': origin_id,
+            'destination': dest_id,
+            'direct': self.direct(origin_id, dest_id),
+            'one_transfer': self.one_transfer(origin_id, dest_id, limit)
+        }
+
+
+def default_graph_file() -> Path:
+    return Path(os.getenv('OUTPUT_DIRECTORY', str(Path(__file__).parent.absolute()))) / GRAPH_FILENAME
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Transfer graph for direct and one-transfer bus trips')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build transfer_graph.bin from bus_data.json')
+    build_parser.add_argument('data_file', nargs='?', help='bus_data.json (default: OUTPUT_DIRECTORY/bus_data.json)')
+    build_parser.add_argument('--radius', type=float, help='Walking link radius in metres (default: TRANSFER_WALK_RADIUS_M or 200)')
+
+    query_parser = subparsers.add_parser('query', help='Direct and one-transfer options between two stops')
+    query_parser.add_argument('origin')
+    query_parser.add_argument('destination')
+    query_parser.add_argument('--limit', type=int, default=5, help='One-transfer options to show (default: 5)')
+
+    bench_parser = subparsers.add_parser('bench', help='Time queries between random stop pairs')
+    bench_parser.add_argument('--queries', type=int, default=200, help='Number of random queries (default: 200)')
+    bench_parser.add_argument('--seed', type=int, default=42)
+
+    for sub in (query_parser, bench_parser):
+        sub.add_argument('--graph', help='transfer_graph.bin (default: OUTPUT_DIRECTORY/transfer_graph.bin)')
+    return parser.parse_args(argv)
+
+
+def main():
+    from collect_bus_data_optimized_concurrent import default_data_file, load_bus_data, load_environment
+
+    args = parse_args()
+    load_environment()
+
+    if args.command == 'build':
+        data_file = Path(args.data_file) if args.data_file else default_data_file()
+        if not data_file.exists():
+            print(f"❌ Data file not found: {data_file}")
+            sys.exit(2)
+        path, stats = build_and_write(load_bus_data(data_file), data_file.parent, args.radius)
+        print(f"✅ Transfer graph written: {path}")
+        print(f"   {stats['stops']:,} stops, {stats['routes']:,} routes, {stats['route_edges']:,} route stops, "
+              f"{stats['walking_links']:,} directed walking links (≤{stats['walk_radius_m']:.0f} m)")
+        print(f"   {stats['file_size_bytes'] / 1024:.0f} KB, built in {stats['build_seconds']:.2f}s")
+        return
+
+    graph_file = Path(args.graph) if args.graph else default_graph_file()
+    if not graph_file.exists():
+        print(f"❌ Transfer graph not found: {graph_file} (run: python3 transfer_graph.py build)")
+        sys.exit(2)
+    start_time = time.perf_counter()
+    graph = TransferGraph.load(graph_file)
+    print(f"📂 Loaded {graph_file} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    if args.command == 'query':
+        start_time = time.perf_counter()
+        try:
+            result = graph.plan(args.origin, args.destination, args.limit)
+        except KeyError as e:
+            print(f"❌ {e.args[0]}")
+            sys.exit(2)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+        print(f"\n🚌 Direct ({len(result['direct'])}):")
+        for leg in result['direct']:
+            print(f"   {leg['route_id']:<16} {leg['stops']} stops")
+        print(f"\n🔁 One transfer (best {len(result['one_transfer'])}):")
+        for option in result['one_transfer']:
+            first, second = option['legs']
+            walk = f", walk {option['walk_metres']} m" if option['walk_metres'] else ''
+            print(f"   {first['route_id']} ({first['stops']} stops) → {first['alight_stop']}{walk} → "
+                  f"{second['route_id']} ({second['stops']} stops)")
+        print(f"\n⏱️  Query time: {elapsed_ms:.2f} ms")
+        return
+
+    rng = random.Random(args.seed)
+    served = [stop_id for index, stop_id in enumerate(graph.stop_ids)
+              if graph.stop_offsets[index + 1] > graph.stop_offsets[index]]
+    timings = []
+    found = 0
+    for _ in range(args.queries):
+        origin, dest = rng.sample(served, 2)
+        start_time = time.perf_counter()
+        result = graph.plan(origin, dest)
+        timings.append((time.perf_counter() - start_time) * 1000)
+        found += bool(result['direct'] or result['one_transfer'])
+    timings.sort()
+    print(f"\n⏱️  {args.queries} random queries: p50 {timings[len(timings) // 2]:.2f} ms, "
+          f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, max {timings[-1]:.2f} ms")
+    print(f"   {found}/{args.queries} pairs connected directly or with one transfer")
+
+
+if __name__ == '__main__':
+    main()